@@ -0,0 +1,226 @@
+#Background solves with progress reporting and cancellation for the Streamlit page
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gurobipy import GRB
+
+from distances import distances_key
+from divisible import divisible_optimal, divisible_p_algorithm
+from heuristic import heuristic_optimal, heuristic_p_algorithm
+from memoization import store_scenarios
+from p_algorithm import ModelSession, cost_matrix, lp_optimal, p_scenarios, p_sweep
+from parallel_solver import solve_in_pool
+from screening import mip_time_limit, screen_scenarios
+
+def progress_callback(report, cancelled):
+    '''
+    Gurobi callback that passes (p_regional, objective, bound, runtime) of the running MIP to report
+    and terminates the solve as soon as cancelled() returns True.
+    '''
+
+    def callback(model, where):
+
+        if cancelled():
+            model.terminate()
+            return
+
+        if where == GRB.Callback.MIP:
+            report(model._p_regional,
+                   model.cbGet(GRB.Callback.MIP_OBJBST),
+                   model.cbGet(GRB.Callback.MIP_OBJBND),
+                   model.cbGet(GRB.Callback.RUNTIME))
+
+    return callback
+
+class SolveJob:
+    '''
+    Solves the assignment model and the trade-off sweep of the page in a background thread.
+    The assignment and the sweep run concurrently, each on half of the cores. The p values of the sweep go to the worker
+    processes of parallel_solver (at most max_workers, by default one per core of its half); with a single worker they are
+    solved in this process, as a warm-started sweep for the MIP. Progress is kept per solve (None for the assignment model,
+    p for the sweep) and the results go into the solution cache unless the job was cancelled.
+    sessions is an optional dictionary that keeps the ModelSession of the assignment model from one job to the next,
+    so that an edited instance updates the previous model instead of building a new one.
+    With multi_scenario, the p values of the sweep are solved as the scenarios of one model (p_scenarios) within their combined time limit.
+    distances is an optional distances.DistanceBackend (great-circle or external distances) used by every solve and cache key.
+    '''
+
+    def __init__(self, inst, p_values, method="mip", time_limit=None, mip_gap=None, key=None, sessions=None, multi_scenario=False,
+                 max_workers=None, distances=None):
+
+        self.inst = inst
+        self.p_values = list(p_values)
+        self.method = method
+        self.time_limit = time_limit
+        self.mip_gap = mip_gap
+        self.key = key
+        self.sessions = sessions
+        self.multi_scenario = multi_scenario
+        self.max_workers = max_workers
+        self.distances = distances
+
+        self.result = None
+        self.error = None
+        self.start_time = time.perf_counter()
+
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._progress = {p: {"objective": None, "bound": None, "runtime": 0.0, "done": False}
+                          for p in [None] + list(dict.fromkeys(self.p_values))}
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+
+        return not self._thread.is_alive()
+
+    def progress(self):
+        '''
+        Rows with the current objective, bound and runtime of every solve, for display.
+        '''
+
+        with self._lock:
+            return [{"Model": "Assignment" if p is None else f"p = {p}",
+                     "Objective": row["objective"],
+                     "Bound": row["bound"],
+                     "Time (s)": round(row["runtime"], 1),
+                     "Done": row["done"]} for p, row in self._progress.items()]
+
+    def elapsed(self):
+
+        return time.perf_counter() - self.start_time
+
+    def _report(self, p_regional, objective, bound, runtime):
+
+        # Gurobi reports GRB.INFINITY while there is no incumbent yet
+        with self._lock:
+            row = self._progress[p_regional]
+            row["objective"] = objective if abs(objective) < GRB.INFINITY else None
+            row["bound"] = bound if abs(bound) < GRB.INFINITY else None
+            row["runtime"] = runtime
+
+    def _finish(self, p_regional, solution):
+
+        with self._lock:
+            row = self._progress[p_regional]
+            row["done"] = True
+            if solution["assigned_customers"]:
+                row["objective"] = solution["total_cost"]
+                row["bound"] = solution["best_bound"]
+
+    def _solve_lp(self, costs, params):
+
+        screened, time_limit = {}, self.time_limit
+        if self.method == "mip":
+            stime = time.perf_counter()
+            screened, _ = screen_scenarios(self.inst, [None], costs, self.mip_gap, self.time_limit)
+            time_limit = mip_time_limit(self.time_limit, time.perf_counter() - stime, 1)
+
+        if self.method == "heuristic":
+            solution = heuristic_optimal(self.inst, costs, self.time_limit)
+        elif self.method == "divisible":
+            solution = divisible_optimal(self.inst, costs, self.time_limit)
+        elif None in screened:
+            solution = screened[None]
+        elif self.sessions is not None:
+            callback = progress_callback(self._report, lambda: self.cancelled)
+            # A session only edits its own distances, so each backend keeps its own
+            name = "assignment" if distances_key(self.distances) is None else ("assignment", distances_key(self.distances))
+            session = self.sessions.get(name)
+            if session is None:
+                session = self.sessions[name] = ModelSession(self.inst, params=params, distances=self.distances)
+            # A stale job may still hold the session until its cancelled solve returns
+            with session.lock:
+                session.sync(self.inst)
+                solution = session.optimize(time_limit, self.mip_gap, callback)
+        else:
+            callback = progress_callback(self._report, lambda: self.cancelled)
+            solution = lp_optimal(self.inst, costs, params, time_limit=time_limit, mip_gap=self.mip_gap, callback=callback)
+
+        self._finish(None, solution)
+        return solution
+
+    def _solve_sweep(self, costs, params):
+
+        time_limit = self.time_limit
+        if self.method == "mip":
+            # Only the p values that screening could not settle are solved as MIPs, within what screening left of the time limits
+            stime = time.perf_counter()
+            solutions, remaining = screen_scenarios(self.inst, self.p_values, costs, self.mip_gap, self.time_limit)
+            time_limit = mip_time_limit(self.time_limit, time.perf_counter() - stime, len(set(self.p_values)))
+            for p, solution in solutions.items():
+                self._finish(p, solution)
+        else:
+            solutions, remaining = {}, list(dict.fromkeys(self.p_values))
+
+        # The sweep has half of the cores, the other half being the assignment model's
+        workers = min(len(remaining), self.max_workers or max(1, (os.cpu_count() or 1) // 2))
+
+        if remaining and self.method == "mip" and self.multi_scenario:
+            # The objective and bound of the callback are not those of any one scenario, so the rows only show the runtime
+            def report(p_values, objective, bound, runtime):
+                for p in p_values:
+                    self._report(p, GRB.INFINITY, GRB.INFINITY, runtime)
+
+            callback = progress_callback(report, lambda: self.cancelled)
+            combined = None if time_limit is None else time_limit*len(remaining)
+            for p, solution in zip(remaining, p_scenarios(self.inst, remaining, costs=costs, params=params, time_limit=combined,
+                                                          mip_gap=self.mip_gap, callback=callback)):
+                solutions[p] = solution
+                self._finish(p, solution)
+        elif workers > 1:
+            # OutputFlag goes first, so the workers print neither their logs nor the Threads change on the server console
+            pool_params = {"OutputFlag": 0, "Threads": max(1, params["Threads"] // workers)}
+            for p, solution in solve_in_pool(self.inst, costs, remaining, self.method, time_limit, self.mip_gap, workers,
+                                             pool_params, self._report, lambda: self.cancelled):
+                solutions[p] = solution
+                self._finish(p, solution)
+        elif self.method != "mip":
+            solve = heuristic_p_algorithm if self.method == "heuristic" else divisible_p_algorithm
+            for p in remaining:
+                if self.cancelled:
+                    return None
+                solutions[p] = solve(self.inst, p, costs, self.time_limit)
+                self._finish(p, solutions[p])
+        elif remaining:
+            callback = progress_callback(self._report, lambda: self.cancelled)
+            for p, solution in zip(remaining, p_sweep(self.inst, remaining, costs, params, time_limit, self.mip_gap, callback)):
+                solutions[p] = solution
+                self._finish(p, solution)
+
+        if self.cancelled:
+            return None
+        return [solutions[p] for p in self.p_values]
+
+    def _run(self):
+
+        try:
+            costs = cost_matrix(self.inst) if self.distances is None else self.distances.cost_matrix(self.inst)
+            params = {"Threads": max(1, (os.cpu_count() or 1) // 2)}
+
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                lp_future = executor.submit(self._solve_lp, costs, params)
+                sweep_future = executor.submit(self._solve_sweep, costs, params)
+                lp_solution, p_solutions = lp_future.result(), sweep_future.result()
+
+            if not self.cancelled:
+                store_scenarios(self.inst, self.p_values, lp_solution, p_solutions, self.method, self.time_limit, self.mip_gap,
+                                self.multi_scenario, self.distances)
+                self.result = (lp_solution, p_solutions)
+
+        except Exception as error:
+            self.error = error
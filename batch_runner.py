@@ -0,0 +1,238 @@
+#Headless batch experiments over a parameter grid, with incremental and resumable result files
+#
+#Usage: python batch_runner.py --customers 100 500 --depots 5 10 --seeds 1 2 3 --p 0 1 2 all --output results.csv
+#Results go to CSV (appended row by row), XLSX or Parquet (rewritten after every run; Parquet needs pyarrow).
+#Rerunning the same command skips the runs already in the output file; runs with another --generator, --time-limit or --mip-gap are new runs.
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from divisible import divisible_optimal, divisible_p_algorithm
+from heuristic import heuristic_optimal, heuristic_p_algorithm
+from instance_generator import generate_instance
+from miscellanious_functions import CreateInstance
+from p_algorithm import cost_matrix, lp_optimal, p_algorithm
+
+COLUMNS = ["run_id", "customers", "depots", "grid", "generator", "seed", "cost_km", "cost_warehouse", "warehouse_limit",
+           "divisible", "model", "p", "method", "time_limit", "mip_gap", "status", "inbound_cost", "outbound_cost", "warehouse_cost", "total_cost",
+           "best_bound", "gap", "node_count", "open_regional", "generate_time", "cost_matrix_time", "solve_time"]
+
+# Last instance generated by this worker process; consecutive runs mostly share their instance
+_last_instance = (None, None)
+
+def run_id(cell):
+    '''
+    Identifier of a run, identical across result formats so that finished runs can be recognised when resuming.
+    '''
+
+    p = "lp" if cell["p"] is None else cell["p"]
+    time_limit = "none" if cell["time_limit"] is None else cell["time_limit"]
+    mip_gap = "none" if cell["mip_gap"] is None else cell["mip_gap"]
+    return (f"c{cell['customers']}_d{cell['depots']}_g{cell['grid']}_{cell['generator']}_s{cell['seed']}_km{cell['cost_km']}"
+            f"_wh{cell['cost_warehouse']}_wl{cell['warehouse_limit']}_div{int(cell['divisible'])}_p{p}_{cell['method']}"
+            f"_tl{time_limit}_gap{mip_gap}")
+
+def grid_cells(args):
+    '''
+    Every run of the parameter grid; p values above the number of regional depots are skipped and "all" stands for all of them.
+    '''
+
+    cells = []
+    for customers, depots, seed, cost_km, cost_warehouse, warehouse_limit, divisible in itertools.product(
+            args.customers, args.depots, args.seeds, args.cost_km, args.cost_warehouse, args.warehouse_limit, args.divisible):
+
+        p_values = ([None] if not args.no_lp else []) + list(dict.fromkeys(depots if p == "all" else int(p) for p in args.p))
+        for p in p_values:
+            if p is not None and p > depots:
+                continue
+            cells.append({"customers": customers, "depots": depots, "grid": args.grid, "seed": seed, "cost_km": cost_km,
+                          "cost_warehouse": cost_warehouse, "warehouse_limit": warehouse_limit, "divisible": bool(divisible),
+                          "p": p, "method": args.method, "generator": args.generator, "time_limit": args.time_limit,
+                          "mip_gap": args.mip_gap})
+
+    return cells
+
+def _instance(cell):
+
+    global _last_instance
+
+    key = (cell["customers"], cell["depots"], cell["grid"], cell["divisible"], cell["cost_km"],
+           cell["cost_warehouse"], cell["warehouse_limit"], cell["seed"])
+    generator = cell["generator"]
+    if _last_instance[0] != (key, generator):
+        if generator == "create":
+            inst = CreateInstance(*key)
+        else:
+            inst = generate_instance(*key, distribution=generator)
+        _last_instance = ((key, generator), inst)
+
+    return _last_instance[1]
+
+def run_cell(task):
+    '''
+    Generates the instance of a run and solves it, returning the result row.
+    '''
+
+    cell, params = task
+    time_limit, mip_gap = cell["time_limit"], cell["mip_gap"]
+
+    stime = time.perf_counter()
+    inst = _instance(cell)
+    generate_time = time.perf_counter() - stime
+
+    stime = time.perf_counter()
+    costs = cost_matrix(inst)
+    cost_matrix_time = time.perf_counter() - stime
+
+    stime = time.perf_counter()
+    if cell["method"] == "heuristic":
+        if cell["p"] is None:
+            solution = heuristic_optimal(inst, costs, time_limit)
+        else:
+            solution = heuristic_p_algorithm(inst, cell["p"], costs, time_limit)
+    elif cell["method"] == "divisible":
+        if cell["p"] is None:
+            solution = divisible_optimal(inst, costs, time_limit)
+        else:
+            solution = divisible_p_algorithm(inst, cell["p"], costs, time_limit)
+    elif cell["p"] is None:
+        solution = lp_optimal(inst, costs, params, time_limit=time_limit, mip_gap=mip_gap)
+    else:
+        solution = p_algorithm(inst, cell["p"], costs, params, time_limit=time_limit, mip_gap=mip_gap)
+    solve_time = time.perf_counter() - stime
+
+    return dict(cell,
+                run_id=run_id(cell),
+                model="assignment" if cell["p"] is None else "p",
+                p="" if cell["p"] is None else cell["p"],
+                status=solution["status"],
+                inbound_cost=solution["inbound_cost"],
+                outbound_cost=solution["outbound_cost"],
+                warehouse_cost=solution["warehouse_cost"],
+                total_cost=solution["total_cost"],
+                best_bound=solution["best_bound"],
+                gap=solution["gap"],
+                node_count=solution["node_count"],
+                # used_warehouses always lists the central depot 1001
+                open_regional=len(set(solution["used_warehouses"]) - {1001}),
+                generate_time=round(generate_time, 4),
+                cost_matrix_time=round(cost_matrix_time, 4),
+                solve_time=round(solve_time, 4))
+
+class ResultFile:
+    '''
+    Results file that is updated after every finished run. CSV rows are appended; XLSX and Parquet files are rewritten
+    to a temporary file and swapped in, so an interruption never leaves a partial file behind.
+    '''
+
+    def __init__(self, path):
+
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower().lstrip(".")
+        if self.format not in ("csv", "xlsx", "parquet"):
+            raise ValueError(f"Unsupported results file {path}; use .csv, .xlsx or .parquet")
+
+        self.rows = self._read() if os.path.exists(path) else []
+
+    def _read(self):
+
+        if self.format == "csv":
+            with open(self.path, newline="") as f:
+                return list(csv.DictReader(f))
+
+        import pandas as pd
+        df = pd.read_excel(self.path) if self.format == "xlsx" else pd.read_parquet(self.path)
+        return df.astype(object).where(df.notna(), None).to_dict("records")
+
+    def finished(self):
+
+        return {row["run_id"] for row in self.rows}
+
+    def append(self, row):
+
+        row = {column: row.get(column) for column in COLUMNS}
+        self.rows.append(row)
+
+        if self.format == "csv":
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+            return
+
+        import pandas as pd
+        df = pd.DataFrame(self.rows, columns=COLUMNS)
+        root, extension = os.path.splitext(self.path)
+        temporary = root + ".partial" + extension
+        if self.format == "xlsx":
+            df.to_excel(temporary, index=False, engine="openpyxl")
+        else:
+            df.astype({"p": str}).to_parquet(temporary, index=False)
+        os.replace(temporary, self.path)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Batch experiments over a grid of instance parameters and p values")
+    parser.add_argument("--customers", type=int, nargs="+", default=[50])
+    parser.add_argument("--depots", type=int, nargs="+", default=[5], help="Numbers of regional depots")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1])
+    parser.add_argument("--cost-km", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--cost-warehouse", type=float, nargs="+", default=[100.0])
+    parser.add_argument("--warehouse-limit", type=int, nargs="+", default=[500])
+    parser.add_argument("--divisible", type=int, nargs="+", choices=[0, 1], default=[0])
+    parser.add_argument("--grid", type=int, default=100, help="Grid size")
+    parser.add_argument("--p", nargs="+", default=["0", "1", "2", "3", "4", "all"],
+                        help="Numbers of regional depots to open in the trade-off runs; all opens every regional depot")
+    parser.add_argument("--no-lp", action="store_true", help="Skip the assignment model (lp_optimal) runs")
+    parser.add_argument("--method", choices=["mip", "heuristic", "divisible"], default="mip",
+                        help="divisible is the exact engine for divisible demand and needs --divisible 1")
+    parser.add_argument("--generator", choices=["create", "uniform", "clustered"], default="create",
+                        help="CreateInstance as on the page, or generate_instance with uniform or clustered customers")
+    parser.add_argument("--time-limit", type=float, default=None, help="Time limit of every solve in seconds")
+    parser.add_argument("--mip-gap", type=float, default=None, help="Target relative gap of the MIP solves")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of cores)")
+    parser.add_argument("--output", default="results.csv", help="Results file (.csv, .xlsx or .parquet)")
+    args = parser.parse_args()
+    if args.method == "divisible" and 0 in args.divisible:
+        parser.error("--method divisible needs divisible demand (--divisible 1)")
+
+    results = ResultFile(args.output)
+    finished = results.finished()
+    cells = [cell for cell in grid_cells(args) if run_id(cell) not in finished]
+    print(f"{len(finished)} runs already in {args.output}, {len(cells)} to go")
+    if not cells:
+        return
+
+    cores = os.cpu_count() or 1
+    workers = max(1, min(args.workers or cores, len(cells)))
+    # OutputFlag goes first, so the workers do not log setting Threads
+    params = {"OutputFlag": 0, "Threads": max(1, cores // workers)}
+    tasks = [(cell, params) for cell in cells]
+
+    failed = 0
+    stime = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(run_cell, task): task[0] for task in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                row = future.result()
+            except Exception as error:
+                # Failed runs are not written, so they are retried when the batch is resumed
+                failed += 1
+                print(f"[{done}/{len(cells)}] {run_id(futures[future])} failed: {error}", file=sys.stderr)
+                continue
+            results.append(row)
+            print(f"[{done}/{len(cells)}] {row['run_id']} {row['status']} {row['total_cost']:.2f} ({row['solve_time']:.2f} s)")
+
+    print(f"Finished in {time.perf_counter() - stime:.1f} s, {failed} failed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#Benchmark of the customer x depot cost precomputation against the former all-pairs dictionaries
+#
+#Usage: python benchmark_cost_matrix.py [--customers 1000 10000 50000] [--depots 20] [--legacy-limit 2000]
+
+import argparse
+import time
+import tracemalloc
+
+from miscellanious_functions import CreateInstance
+from p_algorithm import cost_matrix
+
+def legacy_dicts(inst):
+    '''
+    The dist/cost/time dictionaries that lp_optimal and p_algorithm used to build over every ordered pair of nodes.
+    Pairs are compared by identity so that customer and depot ids overlapping above 1000 customers do not break the loop.
+    '''
+
+    all_Nodes = inst["allNodes"]
+    CostKm = inst["CostKm"]
+
+    dist = {(i[0], j[0]): round(((i[1]-j[1])**2 + (i[2]-j[2])**2)**0.5, 2) for i in all_Nodes for j in all_Nodes if i is not j}
+    cost = {(i[0], j[0]): round(CostKm*dist[i[0], j[0]], 2) for i in all_Nodes for j in all_Nodes if i is not j}
+    time = {(i[0], j[0]): round(dist[i[0], j[0]]/30, 2) for i in all_Nodes for j in all_Nodes if i is not j}
+
+    return dist, cost, time
+
+def measure(function, inst):
+
+    tracemalloc.start()
+    stime = time.perf_counter()
+    result = function(inst)
+    elapsed = time.perf_counter() - stime
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return elapsed, peak
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cost matrix build time and peak memory")
+    parser.add_argument("--customers", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--depots", type=int, default=20, help="Number of regional depots")
+    parser.add_argument("--grid", type=int, default=500)
+    parser.add_argument("--legacy-limit", type=int, default=2000,
+                        help="Largest instance the dictionaries are actually built for; larger sizes are extrapolated quadratically")
+    args = parser.parse_args()
+
+    print(f"{'customers':>10} {'method':>12} {'time (s)':>12} {'peak (MB)':>12}")
+
+    legacy_reference = None
+    for n in args.customers:
+        inst = CreateInstance(n, args.depots, args.grid, False, 0.5, 100, 500, 1)
+        nodes = len(inst["allNodes"])
+
+        elapsed, peak = measure(cost_matrix, inst)
+        print(f"{n:>10} {'numpy':>12} {elapsed:>12.4f} {peak/2**20:>12.2f}")
+
+        if n <= args.legacy_limit:
+            elapsed, peak = measure(legacy_dicts, inst)
+            legacy_reference = (nodes, elapsed, peak)
+            print(f"{n:>10} {'dicts':>12} {elapsed:>12.4f} {peak/2**20:>12.2f}")
+        elif legacy_reference is not None:
+            scale = (nodes/legacy_reference[0])**2
+            print(f"{n:>10} {'dicts (est.)':>12} {legacy_reference[1]*scale:>12.1f} {legacy_reference[2]*scale/2**20:>12.0f}")
+        else:
+            print(f"{n:>10} {'dicts':>12} {'skipped':>12} {'skipped':>12}")
+
+if __name__ == "__main__":
+    main()
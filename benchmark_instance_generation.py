@@ -0,0 +1,40 @@
+#Benchmark of the vectorized instance generator against CreateInstance
+#
+#Usage: python benchmark_instance_generation.py [--customers 100000 1000000 5000000] [--legacy-limit 1000000] [--path instance.bin]
+
+import argparse
+import os
+import time
+
+from instance_generator import generate_instance
+from miscellanious_functions import CreateInstance
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Instance generation time, CreateInstance vs generate_instance")
+    parser.add_argument("--customers", type=int, nargs="+", default=[100000, 1000000, 5000000])
+    parser.add_argument("--depots", type=int, default=20, help="Number of regional depots")
+    parser.add_argument("--legacy-limit", type=int, default=1000000, help="Largest size generated with CreateInstance")
+    parser.add_argument("--path", default=None, help="Also stream the generated instances to this file")
+    args = parser.parse_args()
+
+    print(f"{'customers':>10} {'method':>22} {'time (s)':>10} {'s/million':>10}")
+
+    for n in args.customers:
+        runs = [("CreateInstance", lambda: CreateInstance(n, args.depots, 1000, False, 1, 100, 1000, 1))] if n <= args.legacy_limit else []
+        runs += [(f"numpy {distribution}", lambda distribution=distribution: generate_instance(n, args.depots, 1000, False, 1, 100, 1000, 1, distribution, "lognormal"))
+                 for distribution in ("uniform", "clustered")]
+        if args.path:
+            runs.append(("numpy clustered stream", lambda: generate_instance(n, args.depots, 1000, False, 1, 100, 1000, 1, "clustered", "lognormal", path=args.path)))
+
+        for method, run in runs:
+            stime = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - stime
+            print(f"{n:>10} {method:>22} {elapsed:>10.3f} {elapsed/n*1e6:>10.3f}")
+
+    if args.path and os.path.exists(args.path):
+        os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
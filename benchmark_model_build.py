@@ -0,0 +1,96 @@
+#Benchmark of the matrix-API model construction and bulk extraction against the per-variable versions
+#
+#Usage: python benchmark_model_build.py [--customers 100 1000 5000] [--depots 20] [--time-limit 10]
+#Solving needs a Gurobi license that covers the model size; the restricted pip license only covers small models.
+
+import argparse
+import time
+
+import gurobipy as gp
+from gurobipy import GRB
+
+from miscellanious_functions import CreateInstance
+from p_algorithm import build_model, cost_matrix, extract_solution
+
+def legacy_build_model(inst, costs):
+    '''
+    The model as it was built before the matrix API: addVars over every pair and quicksum constraints.
+    '''
+
+    all_Customers = inst["allCustomers"]
+    all_Depots = inst["allDepots"]
+    CostWarehouse = inst["CostWarehouse"]
+    WarehouseLimit = inst["WarehouseLimit"]
+
+    N_customers = [i[0] for i in all_Customers]
+    N_depots = [i[0] for i in all_Depots]
+    cost = costs["cost"].tolist()
+    demand = {i[0]: i[3] for i in all_Customers}
+    capacity = {i[0]: WarehouseLimit if i[3] == True else 10000 for i in all_Depots}
+    central = {i[0]: 1 if i[3] == True else 0 for i in all_Depots}
+
+    m = gp.Model("p_algorithm")
+    vtype = GRB.CONTINUOUS if inst["Divisible"] else GRB.BINARY
+    x = m.addVars(N_customers, N_depots, vtype=vtype, name="x")
+    y = m.addVars(N_depots, vtype=GRB.BINARY, name="y")
+    inbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="inbound_cost")
+    outbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="outbound_cost")
+    warehouse_cost = m.addVar(vtype=GRB.CONTINUOUS, name="warehouse_cost")
+
+    m.setObjective(inbound_cost + outbound_cost + warehouse_cost, GRB.MINIMIZE)
+
+    m.addConstrs(gp.quicksum(x[i, j] for j in N_depots) == 1 for i in N_customers)
+    m.addConstrs(gp.quicksum(x[i, j]*demand[i] for i in N_customers) <= capacity[j] * y[j] for j in N_depots)
+    m.addConstr(inbound_cost == gp.quicksum(cost[a][b] * x[i, j] for a, i in enumerate(N_customers) for b, j in enumerate(N_depots) if central[j] == 0))
+    m.addConstr(outbound_cost == gp.quicksum(cost[a][b] * x[i, j] for a, i in enumerate(N_customers) for b, j in enumerate(N_depots) if central[j] == 1))
+    m.addConstr(warehouse_cost == gp.quicksum(CostWarehouse * y[j] for j in N_depots))
+    m.update()
+
+    return m, (x, y, N_customers, N_depots)
+
+def legacy_extract_solution(m, handles):
+
+    x, y, N_customers, N_depots = handles
+
+    return {"assigned_customers": {i: j for i in N_customers for j in N_depots if x[i, j].x == 1},
+            "used_warehouses": [j for j in N_depots if y[j].x == 1] + [1001],
+            "total_cost": m.objVal}
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Model build and extraction time, per-variable vs matrix API")
+    parser.add_argument("--customers", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--depots", type=int, default=20, help="Number of regional depots")
+    parser.add_argument("--time-limit", type=float, default=10, help="Solve time limit in seconds, extraction only needs an incumbent")
+    args = parser.parse_args()
+
+    print(f"{'customers':>10} {'method':>10} {'build (s)':>12} {'extract (s)':>12} {'objective':>12}")
+
+    for n in args.customers:
+        inst = CreateInstance(n, args.depots, 500, False, 0.5, 100, max(100, n // 2), 1)
+        costs = cost_matrix(inst)
+
+        for method in ("quicksum", "matrix"):
+            stime = time.perf_counter()
+            if method == "quicksum":
+                m, handles = legacy_build_model(inst, costs)
+            else:
+                m, handles = build_model(inst, costs)
+                m.update()
+            build_time = time.perf_counter() - stime
+
+            m.Params.OutputFlag = 0
+            m.Params.TimeLimit = args.time_limit
+            m.optimize()
+            if m.SolCount == 0:
+                print(f"{n:>10} {method:>10} {build_time:>12.4f} {'no solution':>12}")
+                continue
+
+            stime = time.perf_counter()
+            solution = legacy_extract_solution(m, handles) if method == "quicksum" else extract_solution(m, handles)
+            extract_time = time.perf_counter() - stime
+
+            print(f"{n:>10} {method:>10} {build_time:>12.4f} {extract_time:>12.4f} {solution['total_cost']:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#Benchmark of the trade-off curve solved as one multi-scenario model against one p_algorithm model per p and the warm-started sweep
+#
+#Usage: python benchmark_p_scenarios.py [--customers 50 150] [--depots 8] [--warehouse-limits 100 200 300] [--repeat 3]
+#Solving needs a Gurobi license that covers the model size; the restricted pip license only covers small models.
+
+import argparse
+import itertools
+import time
+
+from instance import Instance, customer_array, depot_array
+from miscellanious_functions import CreateInstance
+from p_algorithm import cost_matrix, p_algorithm, p_scenarios, p_sweep
+
+def timed(function, repeat):
+    '''
+    Minimum wall time of repeat runs of function() and its last result.
+    '''
+
+    best = None
+    for _ in range(repeat):
+        stime = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - stime
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def loop(inst, costs, p_values, warehouse_limits):
+
+    solutions = []
+    for p, limit in itertools.product(p_values, warehouse_limits):
+        scenario = Instance(customer_array(inst), depot_array(inst), inst["GridSize"], inst["Divisible"], inst["CostKm"],
+                            inst["CostWarehouse"], limit)
+        solutions.append(p_algorithm(scenario, p, costs, {"OutputFlag": 0}))
+    return solutions
+
+def sweep(inst, costs, p_values, warehouse_limits):
+
+    solutions = []
+    for limit in warehouse_limits:
+        scenario = Instance(customer_array(inst), depot_array(inst), inst["GridSize"], inst["Divisible"], inst["CostKm"],
+                            inst["CostWarehouse"], limit)
+        solutions.append(p_sweep(scenario, p_values, costs, {"OutputFlag": 0}))
+    # Same order as the loop: p first, then the limit
+    return [solutions[b][a] for a in range(len(p_values)) for b in range(len(warehouse_limits))]
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Wall time of the trade-off curve: per-p loop, p_sweep and multi-scenario p_scenarios")
+    parser.add_argument("--customers", type=int, nargs="+", default=[50, 150])
+    parser.add_argument("--depots", type=int, default=8, help="Number of regional depots")
+    parser.add_argument("--warehouse-limits", type=int, nargs="+", default=None,
+                        help="Grid of central depot capacities; by default only that of the instance")
+    parser.add_argument("--divisible", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'customers':>10} {'scenarios':>10} {'method':>10} {'wall (s)':>10} {'speedup':>8} {'max diff':>10}")
+
+    for n in args.customers:
+        inst = CreateInstance(n, args.depots, 100, args.divisible, 0.5, 100, max(50, n // 2), 1)
+        costs = cost_matrix(inst)
+        p_values = list(range(args.depots + 1))
+        warehouse_limits = args.warehouse_limits or [inst["WarehouseLimit"]]
+        n_scenarios = len(p_values)*len(warehouse_limits)
+
+        reference, loop_time = timed(lambda: loop(inst, costs, p_values, warehouse_limits), args.repeat)
+        results = {"loop": (reference, loop_time),
+                   "sweep": timed(lambda: sweep(inst, costs, p_values, warehouse_limits), args.repeat),
+                   "scenarios": timed(lambda: p_scenarios(inst, p_values, warehouse_limits, costs=costs, params={"OutputFlag": 0}),
+                                      args.repeat)}
+
+        for method, (solutions, wall) in results.items():
+            # Largest difference in total cost from the per-p loop over the scenarios both solved
+            diff = max([abs(a["total_cost"] - b["total_cost"]) for a, b in zip(reference, solutions)
+                        if a["assigned_customers"] and b["assigned_customers"]], default=0.0)
+            print(f"{n:>10} {n_scenarios:>10} {method:>10} {wall:>10.4f} {loop_time/wall:>7.2f}x {diff:>10.2e}")
+
+if __name__ == "__main__":
+    main()
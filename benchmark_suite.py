@@ -0,0 +1,197 @@
+#Benchmark suite over the whole page pipeline: generation, model build, solve, extraction and plotting
+#
+#Usage: python benchmark_suite.py [--customers 50 200 1000] [--depots 10] [--repeat 3] [--output results.json]
+#       python benchmark_suite.py --baseline baseline.json          (flags regressions, exit status 1 if any)
+#                                                                   (exit status 2 if the baseline ran with other --depots or --time-limit)
+#       python benchmark_suite.py --output baseline.json            (stores a new baseline)
+#Peak memory is what tracemalloc sees (Python and NumPy allocations); memory allocated inside Gurobi is not included.
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import gurobipy as gp
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from miscellanious_functions import CreateInstance, PComparisonPlot, SolutionPlot
+from p_algorithm import build_model, cost_matrix, extract_solution, p_sweep
+
+P_VALUES = [0, 1, 2, 3, 4]
+
+def measure(function, setup=None, repeat=3):
+    '''
+    Runs function(setup()) once under tracemalloc for the peak memory, then repeat more times for the wall and CPU times
+    (minimum over the runs). setup is not timed. Returns (result of the last run, measurements).
+    '''
+
+    def run(traced):
+        state = setup() if setup is not None else None
+        if traced:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(state) if setup is not None else function()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1] if traced else None
+        if traced:
+            tracemalloc.stop()
+        return result, wall, cpu, peak
+
+    result, _, _, peak = run(True)
+    walls, cpus = [], []
+    for _ in range(repeat):
+        result, wall, cpu, _ = run(False)
+        walls.append(wall)
+        cpus.append(cpu)
+
+    return result, {"wall": min(walls), "cpu": min(cpus), "peak_mb": peak/2**20}
+
+def draw(fig):
+
+    # Figures are only rendered when drawn; saving to memory includes the rasterization the page pays for
+    fig.savefig(io.BytesIO(), format="png")
+    plt.close(fig)
+
+def solve(state):
+
+    m, model_vars = state
+    m.optimize()
+    return m, model_vars
+
+def run_case(n_customers, n_depots, divisible, repeat, time_limit):
+    '''
+    Measures every phase for one instance size; phases that cannot run (e.g. solves beyond the Gurobi license) are reported as skipped.
+    '''
+
+    args = (n_customers, n_depots, 100, divisible, 0.5, 100, max(100, n_customers // 2), 1)
+    params = {"OutputFlag": 0, "TimeLimit": time_limit}
+    phases = {}
+
+    inst, phases["generate"] = measure(lambda: CreateInstance(*args), repeat=repeat)
+    costs, phases["cost_matrix"] = measure(lambda: cost_matrix(inst), repeat=repeat)
+
+    def build(p_regional):
+        m, model_vars = build_model(inst, costs, p_regional, params)
+        m.update()
+        return m, model_vars
+
+    _, phases["build_assignment"] = measure(lambda: build(None), repeat=repeat)
+    _, phases["build_p"] = measure(lambda: build(2), repeat=repeat)
+
+    try:
+        state, phases["solve_assignment"] = measure(solve, lambda: build(None), repeat=repeat)
+        solution, phases["extract"] = measure(lambda: extract_solution(*state), repeat=repeat)
+        p_solutions, phases["p_sweep"] = measure(lambda: p_sweep(inst, P_VALUES, costs, params), repeat=repeat)
+    except gp.GurobiError as error:
+        print(f"  solves skipped for {n_customers} customers: {error}", file=sys.stderr)
+        return phases
+
+    if solution["assigned_customers"]:
+        _, phases["solution_plot"] = measure(lambda: draw(SolutionPlot(inst, solution)), repeat=repeat)
+    _, phases["comparison_plot"] = measure(lambda: draw(PComparisonPlot(inst, P_VALUES, p_solutions)), repeat=repeat)
+
+    return phases
+
+def config_mismatch(config, baseline):
+    '''
+    Differences between the run configuration and the one stored in baseline: (errors, warnings).
+    Another number of depots or time limit changes every instance or solve, so those runs cannot be compared;
+    another size ladder or Divisible setting only leaves fewer runs to compare.
+    '''
+
+    stored = baseline.get("config")
+    if stored is None:
+        return [], [f"the baseline does not record its run configuration; it may not match {config}"]
+
+    errors = [f"{name} {stored.get(name)} in the baseline, {config[name]} now" for name in ("depots", "time_limit")
+              if stored.get(name) != config[name]]
+    warnings = [f"{name} {stored.get(name)} in the baseline, {config[name]} now; only the runs in both are compared"
+                for name in ("customers", "divisible") if stored.get(name) != config[name]]
+    if stored.get("repeat") != config["repeat"]:
+        warnings.append(f"repeat {stored.get('repeat')} in the baseline, {config['repeat']} now; the minimum times are less comparable")
+
+    return errors, warnings
+
+def compare(results, baseline, tolerance, min_time):
+    '''
+    Regressions of results against baseline: wall time, CPU time or peak memory more than tolerance (relative) above the baseline.
+    Times below min_time seconds are too noisy to compare and only count when they grow by more than min_time.
+    '''
+
+    reference = {(r["customers"], r["divisible"], r["phase"]): r for r in baseline["results"]}
+    regressions = []
+
+    for r in results:
+        base = reference.get((r["customers"], r["divisible"], r["phase"]))
+        if base is None:
+            continue
+        for metric in ("wall", "cpu"):
+            if r[metric] > base[metric]*(1 + tolerance) and r[metric] - base[metric] > min_time:
+                regressions.append((r, metric, base[metric], r[metric]))
+        if base["peak_mb"] > 0 and r["peak_mb"] > base["peak_mb"]*(1 + tolerance) and r["peak_mb"] - base["peak_mb"] > 1:
+            regressions.append((r, "peak_mb", base["peak_mb"], r["peak_mb"]))
+
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Wall time, CPU time and peak memory per phase over a ladder of instance sizes")
+    parser.add_argument("--customers", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--depots", type=int, default=10, help="Number of regional depots")
+    parser.add_argument("--divisible", type=int, nargs="+", choices=[0, 1], default=[0, 1])
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per phase, the minimum is kept")
+    parser.add_argument("--time-limit", type=float, default=10, help="Time limit of every solve in seconds")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file, e.g. to store a new baseline")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to flag regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown or memory growth flagged as a regression")
+    parser.add_argument("--min-time", type=float, default=0.005, help="Absolute slowdown in seconds below which nothing is flagged")
+    args = parser.parse_args()
+
+    config = {"customers": args.customers, "depots": args.depots, "divisible": args.divisible, "time_limit": args.time_limit,
+              "repeat": args.repeat}
+
+    # The baseline is checked before measuring, so a mismatched one fails fast
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        errors, warnings = config_mismatch(config, baseline)
+        for warning in warnings:
+            print(f"WARNING {warning}", file=sys.stderr)
+        if errors:
+            print(f"Cannot compare against {args.baseline}: " + "; ".join(errors), file=sys.stderr)
+            sys.exit(2)
+
+    results = []
+    print(f"{'customers':>10} {'divisible':>10} {'phase':>18} {'wall (s)':>10} {'cpu (s)':>10} {'peak (MB)':>10}")
+
+    for n in args.customers:
+        for divisible in args.divisible:
+            phases = run_case(n, args.depots, bool(divisible), args.repeat, args.time_limit)
+            for phase, values in phases.items():
+                results.append(dict(customers=n, divisible=divisible, phase=phase, **values))
+                print(f"{n:>10} {divisible:>10} {phase:>18} {values['wall']:>10.4f} {values['cpu']:>10.4f} {values['peak_mb']:>10.2f}")
+
+    if args.output:
+        machine = {"python": platform.python_version(), "numpy": np.__version__, "gurobi": ".".join(map(str, gp.gurobi.version())),
+                   "platform": platform.platform(), "cpus": os.cpu_count()}
+        with open(args.output, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": machine, "config": config,
+                       "results": results}, f, indent=1)
+
+    if args.baseline:
+        regressions = compare(results, baseline, args.tolerance, args.min_time)
+        for r, metric, before, after in regressions:
+            print(f"REGRESSION {r['customers']} customers, divisible {r['divisible']}, {r['phase']}: {metric} {before:.4f} -> {after:.4f}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
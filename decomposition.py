@@ -0,0 +1,180 @@
+#Spatial decomposition for instances too large for a single MIP: regions are solved in parallel, stitched and repaired
+
+import math
+import os
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from heuristic import DEFAULT_TIME_LIMIT, heuristic_optimal, heuristic_p_algorithm, improve_design, solution_from_design
+from instance import Instance, customer_array, depot_array
+from p_algorithm import cost_matrix, lagrangian_lower_bound, lp_optimal, p_algorithm
+from parallel_solver import map_in_pool
+from profiling import finish_profile, new_profile, phase
+
+# Customers per region when the number of regions is not given
+DEFAULT_REGION_SIZE = 2000
+
+# Above this many customers the regions come from mini-batch k-means
+MINIBATCH_CUSTOMERS = 20000
+
+def partition(inst, n_regions, seed=0):
+    '''
+    Clusters the customers into n_regions geographic regions with k-means and gives every regional depot the region of
+    its nearest cluster center. Returns the region of every customer and of every depot (-1 for the central depot).
+    '''
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+
+    customers_xy = np.column_stack([customers["x"], customers["y"]])
+    depots_xy = np.column_stack([depots["x"], depots["y"]])
+
+    n_regions = max(1, min(n_regions, len(customers)))
+    if len(customers) > MINIBATCH_CUSTOMERS:
+        kmeans = MiniBatchKMeans(n_clusters=n_regions, random_state=seed, n_init=3, batch_size=4096)
+    else:
+        kmeans = KMeans(n_clusters=n_regions, random_state=seed, n_init=3)
+
+    customer_region = kmeans.fit_predict(customers_xy)
+    depot_region = kmeans.predict(depots_xy)
+    depot_region[depots["central"]] = -1
+
+    return customer_region, depot_region
+
+def _central_shares(demand, capacity, customer_region, depot_region, n_regions, warehouse_limit):
+    '''
+    Splits the central depot capacity between the regions so that the shares add up to WarehouseLimit.
+    Each region first gets the demand its own regional depots cannot hold; the rest is shared in proportion to demand.
+    '''
+
+    region_demand = np.bincount(customer_region, weights=demand, minlength=n_regions)
+    regional = depot_region >= 0
+    region_capacity = np.bincount(depot_region[regional], weights=capacity[regional], minlength=n_regions)
+
+    required = np.maximum(region_demand - region_capacity, 0)
+    spare = max(warehouse_limit - required.sum(), 0)
+
+    return required + spare*region_demand/max(region_demand.sum(), 1e-12)
+
+def _p_shares(p_regional, demand, customer_region, depot_region, n_regions):
+    '''
+    Splits the p_regional regional depots to open between the regions in proportion to their demand (largest remainder),
+    never giving a region more than it has.
+    '''
+
+    available = np.bincount(depot_region[depot_region >= 0], minlength=n_regions)
+    weight = np.where(available > 0, np.bincount(customer_region, weights=demand, minlength=n_regions), 0)
+
+    target = p_regional*weight/max(weight.sum(), 1e-12)
+    shares = np.minimum(np.floor(target).astype(int), available)
+    while shares.sum() < min(p_regional, available.sum()):
+        remainder = np.where(shares < available, target - shares, -np.inf)
+        shares[int(np.argmax(remainder))] += 1
+
+    return shares
+
+def _solve_region(task):
+
+    sub_inst, p_regional, method, params, time_limit, mip_gap = task
+
+    if method == "heuristic":
+        if p_regional is None:
+            return heuristic_optimal(sub_inst, time_limit=time_limit)
+        return heuristic_p_algorithm(sub_inst, p_regional, time_limit=time_limit)
+
+    if p_regional is None:
+        return lp_optimal(sub_inst, params=params, time_limit=time_limit, mip_gap=mip_gap)
+    return p_algorithm(sub_inst, p_regional, params=params, time_limit=time_limit, mip_gap=mip_gap)
+
+def decomposition_solve(inst, p_regional=None, n_regions=None, costs=None, method="mip", max_workers=None,
+                        time_limit=None, mip_gap=None, seed=0):
+    '''
+    Solves lp_optimal (p_regional None) or p_algorithm approximately by spatial decomposition:
+    1. customers and regional depots are clustered into n_regions regions (about DEFAULT_REGION_SIZE customers each by default);
+    2. every region is solved on its own customers, its regional depots and the central depot, in parallel; the central
+       depot's WarehouseLimit is split between the regions (and p_regional as well) so the shares add up to the full values;
+    3. the regional designs are stitched together and repaired by a capacity-aware reassignment and local search on the full instance;
+    4. a Lagrangian lower bound of the full model gives "best_bound" and "gap", so the quality can be measured.
+    time_limit (seconds) is shared out: 60% for the regions, 20% each for the repair and the bound.
+    Returns the usual solution dictionary with status "decomposition" and the number of regions in "regions".
+    '''
+
+    if n_regions is None:
+        n_regions = math.ceil(len(customer_array(inst))/DEFAULT_REGION_SIZE)
+
+    profile = new_profile("assignment" if p_regional is None else "p", p_regional)
+    with phase(profile, "distance"):
+        if costs is None:
+            costs = cost_matrix(inst)
+    cost = costs["cost"]
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+    demand = np.asarray(customers["demand"], dtype=float)
+    central = np.asarray(depots["central"], dtype=bool)
+    capacity = np.where(central, inst["WarehouseLimit"], 10000).astype(float)
+    warehouse = inst["CostWarehouse"] if p_regional is None else 0
+
+    with phase(profile, "cluster"):
+        customer_region, depot_region = partition(inst, n_regions, seed)
+        n_regions = int(customer_region.max()) + 1
+
+    central_share = _central_shares(demand, capacity, customer_region, depot_region, n_regions, inst["WarehouseLimit"])
+    p_share = _p_shares(p_regional, demand, customer_region, depot_region, n_regions) if p_regional is not None else [None]*n_regions
+
+    # Every region shares the page budget with the others that run on the same worker
+    cores = os.cpu_count() or 1
+    workers = max(1, min(max_workers or cores, n_regions))
+    rounds = math.ceil(n_regions/workers)
+    region_time = None if time_limit is None else 0.6*time_limit/rounds
+    repair_time = DEFAULT_TIME_LIMIT if time_limit is None else 0.2*time_limit
+    bound_time = DEFAULT_TIME_LIMIT if time_limit is None else 0.2*time_limit
+    # OutputFlag goes first, so the regional solves print neither their logs nor the Threads change
+    params = {"OutputFlag": 0, "Threads": max(1, cores // workers)}
+
+    tasks = []
+    for region in range(n_regions):
+        region_depots = (depot_region == region) | central
+        sub_inst = Instance(customers[customer_region == region], depots[region_depots], inst["GridSize"], inst["Divisible"],
+                            inst["CostKm"], inst["CostWarehouse"], central_share[region], inst["Seed"])
+        tasks.append((sub_inst, None if p_regional is None else int(p_share[region]), method, params, region_time, mip_gap))
+
+    with phase(profile, "solve"):
+        region_solutions = map_in_pool(_solve_region, tasks, workers)
+
+    # Stitch the regional designs: a depot is open when its region opened it, the central depot stays open
+    depot_position = {j: b for b, j in enumerate(depots["id"].tolist())}
+    open_mask = central.copy()
+    for solution in region_solutions:
+        for j in solution["used_warehouses"]:
+            open_mask[depot_position[j]] = True
+
+    # Regions that failed leave fewer than p_regional regional depots open; the busiest closed ones make up the difference
+    if p_regional is not None:
+        regional = np.flatnonzero(~central)
+        missing = p_regional - int(open_mask[regional].sum())
+        if missing > 0:
+            closed = regional[~open_mask[regional]]
+            nearest = np.bincount(cost.argmin(axis=1), minlength=len(central))
+            open_mask[closed[np.argsort(-nearest[closed], kind="stable")[:missing]]] = True
+
+    with phase(profile, "repair"):
+        open_mask, assignment, value = improve_design(inst, open_mask, p_regional, costs, repair_time)
+
+    with phase(profile, "extract"):
+        solution = solution_from_design(inst, cost, central, open_mask, assignment, p_regional,
+                                        "decomposition" if open_mask is not None else "infeasible")
+
+    if open_mask is not None:
+        with phase(profile, "bound"):
+            bound = lagrangian_lower_bound(cost, demand, capacity, central, warehouse, p_regional, value,
+                                           time.perf_counter() + bound_time)
+        solution["best_bound"] = min(bound, solution["total_cost"])
+        solution["gap"] = (solution["total_cost"] - solution["best_bound"])/max(abs(solution["total_cost"]), 1e-10)
+
+    solution["regions"] = n_regions
+    profile["regions"] = n_regions
+
+    return finish_profile(solution, profile)
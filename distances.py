@@ -0,0 +1,179 @@
+#Distance backends (grid, great-circle or external matrices) with a memory-mapped on-disk cache of the cost matrices
+
+import hashlib
+import os
+
+import numpy as np
+
+from instance import customer_array, depot_array
+from p_algorithm import cost_matrix, pair_costs, round2
+
+# Mean Earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "2e-flap", "distances")
+
+# Customers per block when filling the matrices, so that memory stays bounded on large networks
+BLOCK_ROWS = 2**14
+
+METRICS = ("euclidean", "haversine")
+
+def haversine(lon1, lat1, lon2, lat2):
+    '''
+    Great-circle distance in km between points given in degrees; the arguments broadcast against each other.
+    '''
+
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def _distance_block(customers, depots, metric):
+
+    if metric == "euclidean":
+        dx = customers["x"][:, None] - depots["x"][None, :]
+        dy = customers["y"][:, None] - depots["y"][None, :]
+        return np.sqrt(dx**2 + dy**2)
+
+    # x holds the longitude and y the latitude
+    return haversine(customers["x"][:, None], customers["y"][:, None], depots["x"][None, :], depots["y"][None, :])
+
+def matrix_key(matrix):
+    '''
+    Fingerprint of an external distance matrix, computed once per matrix and passed to network_key.
+    '''
+
+    return hashlib.sha1(np.ascontiguousarray(matrix, dtype=float).tobytes()).hexdigest()
+
+def network_key(inst, metric="euclidean", matrix_fingerprint=None):
+    '''
+    Fingerprint of the node set of an instance (customer and depot coordinates) and of the distances used on it;
+    matrix_fingerprint is the matrix_key of the external distances, if any.
+    '''
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+
+    digest = hashlib.sha1()
+    digest.update(np.column_stack([customers["x"], customers["y"]]).tobytes())
+    digest.update(np.column_stack([depots["x"], depots["y"]]).tobytes())
+    digest.update(metric.encode())
+    if matrix_fingerprint is not None:
+        digest.update(matrix_fingerprint.encode())
+
+    return digest.hexdigest()
+
+def _write_matrix(path, shape, block):
+    '''
+    Fills a .npy file block by block (block(start, stop) gives rows start:stop) and moves it into place once complete,
+    so readers never map a partial file.
+    '''
+
+    temporary = f"{path}.{os.getpid()}.partial"
+    values = np.lib.format.open_memmap(temporary, mode="w+", dtype=np.float64, shape=shape)
+    for start in range(0, shape[0], BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, shape[0])
+        values[start:stop] = block(start, stop)
+    values.flush()
+    del values
+    os.replace(temporary, path)
+
+def cached_cost_matrix(inst, metric="euclidean", matrix=None, cache_dir=DEFAULT_CACHE_DIR, matrix_fingerprint=None):
+    '''
+    cost_matrix with a choice of distances, kept in memory-mapped .npy files under cache_dir:
+    metric "euclidean" gives the grid distances of cost_matrix and "haversine" great-circle km, with x the longitude and y the
+    latitude in degrees. matrix is an optional customers x depots array of externally supplied distances (e.g. road distances
+    from a routing engine) used instead; they are priced by CostKm like the others, so with CostKm 1 they are taken as costs.
+    The distances are keyed on the node set (network_key) and the costs also on CostKm. Both are computed in blocks of
+    BLOCK_ROWS customers, and later calls on the same network only map the files. matrix_fingerprint is the matrix_key of
+    matrix, for callers that keep it so that the matrix is not hashed again on every call.
+    Returns {"dist", "cost"} as read-only memory maps, which every solver accepts as costs.
+    '''
+
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}")
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+    shape = (len(customers), len(depots))
+
+    if matrix is not None and np.shape(matrix) != shape:
+        raise ValueError(f"The distance matrix has shape {np.shape(matrix)}, expected {shape} (customers x depots)")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if matrix is not None and matrix_fingerprint is None:
+        matrix_fingerprint = matrix_key(matrix)
+    key = network_key(inst, metric if matrix is None else "external", matrix_fingerprint)
+    dist_path = os.path.join(cache_dir, f"{key}.dist.npy")
+    cost_path = os.path.join(cache_dir, f"{key}.cost.{float(inst['CostKm'])!r}.npy")
+
+    if not os.path.exists(dist_path):
+        if matrix is None:
+            _write_matrix(dist_path, shape, lambda start, stop: round2(_distance_block(customers[start:stop], depots, metric)))
+        else:
+            _write_matrix(dist_path, shape, lambda start, stop: round2(np.asarray(matrix[start:stop], dtype=float)))
+    dist = np.load(dist_path, mmap_mode="r")
+
+    if not os.path.exists(cost_path):
+        _write_matrix(cost_path, shape, lambda start, stop: round2(inst["CostKm"]*dist[start:stop]))
+    cost = np.load(cost_path, mmap_mode="r")
+
+    return {"dist": dist, "cost": cost}
+
+class DistanceBackend:
+    '''
+    Distances that the solvers, the page and the solution caches use for every instance: metric "euclidean" (the grid
+    distances of cost_matrix, computed in memory as before) or "haversine", or an external customers x depots matrix.
+    key tells the distances apart in cache keys; for an external matrix it is the matrix_key, computed once here.
+    Non-grid costs come from cached_cost_matrix.
+    '''
+
+    def __init__(self, metric="euclidean", matrix=None, cache_dir=DEFAULT_CACHE_DIR):
+
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}")
+
+        self.metric = metric
+        self.matrix = matrix
+        self.cache_dir = cache_dir
+        self._matrix_key = None if matrix is None else matrix_key(matrix)
+        self.key = metric if matrix is None else f"external:{self._matrix_key}"
+
+    @property
+    def euclidean(self):
+
+        return self.matrix is None and self.metric == "euclidean"
+
+    def cost_matrix(self, inst):
+
+        if self.euclidean:
+            return cost_matrix(inst)
+        return cached_cost_matrix(inst, self.metric, self.matrix, self.cache_dir, self._matrix_key)
+
+    def pair_costs(self, inst, pair_customer, pair_depot):
+        '''
+        Costs of the given customer/depot pairs (positions in the customer and depot arrays of inst), as in cost_matrix(inst).
+        '''
+
+        if self.euclidean:
+            return pair_costs(inst, pair_customer, pair_depot)
+        return np.asarray(self.cost_matrix(inst)["cost"][pair_customer, pair_depot])
+
+    def block_costs(self, customers, depots, CostKm):
+        '''
+        Costs between arrays of customers and depots that are not the nodes of a whole instance (e.g. the edits of a
+        ModelSession). An external matrix only covers the nodes it was given for, so it cannot price them.
+        '''
+
+        if self.matrix is not None:
+            raise ValueError("External distances only cover the nodes of their instance")
+        return round2(CostKm*round2(_distance_block(customers, depots, self.metric)))
+
+def distances_key(distances):
+    '''
+    Cache key part of a DistanceBackend: None for the grid distances (also distances None), so their keys stay as they were.
+    '''
+
+    if distances is None or distances.euclidean:
+        return None
+    return distances.key
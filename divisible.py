@@ -0,0 +1,485 @@
+#Divisible demand engine: exact transportation assignments of fixed sets of depots, with the search only over which depots open
+
+import heapq
+import itertools
+import math
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+
+from heuristic import DEFAULT_TIME_LIMIT, _greedy_open, _instance_arrays
+from instance import customer_array, depot_array
+from p_algorithm import FRACTION_TOL, lagrangian_lower_bound
+from profiling import finish_profile, new_profile, phase
+
+# Above this many depot sets the search switches from enumeration to local search
+ENUMERATION_LIMIT = 1000
+
+# Up to this many depots, the bounds of every set come from one table (see _Designs._table)
+TABLE_DEPOTS = 16
+
+# Cutting plane iterations of the capacity price dual before the assignment LP takes over regardless
+DUAL_ITERATIONS = 300
+
+def _dual(cost, demand, capacity, prices, cutoff=np.inf):
+    '''
+    Capacity prices (one per column) maximizing the Lagrangian dual of the transportation problem,
+    sum over customers of min_j(cost + demand*price_j) - capacity.prices, which is concave and piecewise linear in the few
+    prices. Every evaluation assigns the customers to their closest depot and gives an exact cut; the next prices maximize
+    the cuts in a box around the best prices so far (cutting planes with a trust region), which stops once the cuts prove
+    the best prices optimal or the dual value reaches cutoff.
+    Returns the prices and their dual value, a lower bound on the transportation cost.
+    '''
+
+    n_customers, n_depots = cost.shape
+    scale = float(np.abs(cost).max(initial=0))/max(float(demand.max(initial=0)), 1e-9)
+    center, best = prices.copy(), -np.inf
+    radius = max(0.25*float(prices.max(initial=0)), 0.1*scale, 1e-9)
+    cut_costs, cut_loads = [], []
+
+    for _ in range(DUAL_ITERATIONS):
+
+        closest = (cost + demand[:, None]*prices).argmin(axis=1)
+        load = np.bincount(closest, weights=demand, minlength=n_depots)
+        cut_costs.append(float(np.take_along_axis(cost, closest[:, None], axis=1).sum()))
+        cut_loads.append(load)
+        value = cut_costs[-1] + (load - capacity) @ prices
+
+        if value > best:
+            # The radius grows after a step to the edge of the box that paid off and shrinks after one that did not
+            if np.abs(prices - center).max(initial=0) >= 0.99*radius:
+                radius *= 2
+            center, best = prices.copy(), value
+        else:
+            radius /= 2
+        if best >= cutoff:
+            break
+
+        # max theta - capacity.prices subject to theta <= cut cost + cut load.prices, over the box
+        result = linprog(np.append(capacity, -1.0), A_ub=np.column_stack([-np.array(cut_loads), np.ones(len(cut_loads))]),
+                         b_ub=np.array(cut_costs), bounds=[(max(0.0, c - radius), c + radius) for c in center] + [(None, None)],
+                         method="highs")
+        if result.status != 0 or -result.fun - best <= 1e-13*max(1.0, abs(best)):
+            break
+        prices = result.x[:n_depots]
+
+    return center, best
+
+def _window(reduced, closest, fixed, demand, residual, window):
+    '''
+    Wider window of contested customers after the LP failed. When the fixed customers overload a depot, the window grows to
+    the reduced cost gap at which the customers of that depot closest to another one carry twice the overload, so they can
+    move in the next LP; otherwise, or if that is no wider, it grows tenfold.
+    '''
+
+    wider = window*10
+    for j in np.flatnonzero(residual < -1e-9):
+        members = fixed[closest[fixed] == j]
+        ranked = np.sort(reduced[members], axis=1)
+        gap = ranked[:, 1] - ranked[:, 0] if ranked.shape[1] > 1 else np.full(len(members), np.inf)
+        order = np.argsort(gap, kind="stable")
+        marginal = int(np.searchsorted(np.cumsum(demand[members][order]), -2*residual[j]))
+        wider = max(wider, float(gap[order[min(marginal, len(order) - 1)]]))
+    return wider
+
+def _transport(cost, demand, capacity, prices=None, cutoff=np.inf, max_rounds=50):
+    '''
+    Exact solution of the capacitated transportation problem on the columns of cost (the open depots): every customer is
+    assigned in fractions that add up to 1, at most capacity per depot, at minimum sum of cost*fraction.
+    The dual over the few depots is solved first by _dual (starting from prices, e.g. those of a neighbouring set of depots).
+    Customers that are not strictly closest to one depot at those prices, usually a handful, are assigned by a small LP
+    (HiGHS) and the others stay with their closest depot. The prices (those of _dual, else the LP capacity duals) are then
+    checked against every customer: customers that would rather move, and the pairs they would move to, join the LP until
+    none is left, which proves the assignment optimal.
+    Returns (customer, column, fraction) arrays, the value and the prices, or None when the capacity falls short or the dual
+    shows that the value is at least cutoff.
+    '''
+
+    n_customers, n_depots = cost.shape
+    rows = np.arange(n_customers)
+    if demand.sum() > capacity.sum() + 1e-9:
+        return None
+
+    prices, bound = _dual(cost, demand, capacity, np.zeros(n_depots) if prices is None else prices, cutoff)
+    if bound >= cutoff:
+        return None
+
+    tolerance = 1e-7*max(1.0, float(np.abs(cost).max(initial=0)))
+    window = tolerance
+    contested = np.zeros(n_customers, dtype=bool)
+    candidate = np.zeros((n_customers, n_depots), dtype=bool)
+
+    for round_number in range(max_rounds):
+
+        # Should the loop not settle, the last round is the LP over every pair
+        if round_number == max_rounds - 1:
+            contested[:] = True
+            candidate[:] = True
+
+        reduced = cost + demand[:, None]*prices
+        closest = reduced.argmin(axis=1)
+        near = reduced <= reduced[rows, closest][:, None] + window
+        contested |= near.sum(axis=1) > 1
+        candidate |= near & contested[:, None]
+        candidate[rows, closest] |= contested
+
+        fixed = np.flatnonzero(~contested)
+        residual = capacity - np.bincount(closest[fixed], weights=demand[fixed], minlength=n_depots)
+        pair_customer, pair_depot = np.nonzero(candidate)
+
+        if len(pair_customer) == 0:
+            fraction = np.zeros(0)
+            lp_prices = np.zeros(n_depots)
+            if (residual < -1e-9).any():
+                window = _window(reduced, closest, fixed, demand, residual, window)
+                continue
+        else:
+            lp_rows = np.searchsorted(np.flatnonzero(contested), pair_customer)
+            n_rows, n_pairs = int(contested.sum()), len(pair_customer)
+            result = linprog(cost[pair_customer, pair_depot],
+                             A_ub=sp.csr_matrix((demand[pair_customer], (pair_depot, np.arange(n_pairs))), shape=(n_depots, n_pairs)),
+                             b_ub=residual,
+                             A_eq=sp.csr_matrix((np.ones(n_pairs), (lp_rows, np.arange(n_pairs))), shape=(n_rows, n_pairs)),
+                             b_eq=np.ones(n_rows), bounds=(0, None), method="highs")
+
+            # The fixed customers overload a depot, or the contested ones do not fit
+            if result.status != 0:
+                window = _window(reduced, closest, fixed, demand, residual, window)
+                continue
+            fraction = result.x
+            lp_prices = np.maximum(-result.ineqlin.marginals, 0)
+
+        # Depots that the LP does not reach keep their price while full; the price of a depot with spare capacity is 0
+        load = capacity - residual + np.bincount(pair_depot, weights=demand[pair_customer]*fraction, minlength=n_depots)
+        reached = np.bincount(pair_depot, minlength=n_depots) > 0
+        full = load >= capacity - 1e-9*np.maximum(capacity, 1)
+        lp_prices = np.where(reached, lp_prices, np.where(full, prices, 0))
+
+        # Optimal once every customer only uses depots that are closest at prices that only charge full depots. The dual
+        # prices are tried first, as the LP duals are degenerate whenever the contested customers do not pin them down.
+        for prices in ((prices, lp_prices) if (full | (prices <= 0)).all() else (lp_prices,)):
+            reduced = cost + demand[:, None]*prices
+            lowest = reduced.min(axis=1)
+            fixed_bad = fixed[reduced[fixed, closest[fixed]] > lowest[fixed] + tolerance]
+            used = fraction > FRACTION_TOL
+            pair_bad = np.unique(pair_customer[used & (reduced[pair_customer, pair_depot] > lowest[pair_customer] + tolerance)])
+            violators = np.concatenate([fixed_bad, pair_bad])
+            if len(violators) == 0:
+                break
+
+        if len(violators) == 0 or round_number == max_rounds - 1:
+            break
+
+        candidate[fixed_bad, closest[fixed_bad]] = True
+        contested[violators] = True
+        candidate[violators] |= reduced[violators] <= lowest[violators, None] + window
+
+    # Fixed customers go whole to their closest depot; LP fractions below FRACTION_TOL are noise and the rest are rescaled
+    keep = fraction > FRACTION_TOL
+    pair_customer, pair_depot, fraction = pair_customer[keep], pair_depot[keep], fraction[keep]
+    fraction = fraction/np.bincount(pair_customer, weights=fraction, minlength=n_customers)[pair_customer]
+
+    pair_customer = np.concatenate([fixed, pair_customer])
+    pair_depot = np.concatenate([closest[fixed], pair_depot])
+    fraction = np.concatenate([np.ones(len(fixed)), fraction])
+    order = np.lexsort((pair_depot, pair_customer))
+
+    value = float((cost[pair_customer, pair_depot]*fraction).sum())
+    return (pair_customer[order], pair_depot[order], fraction[order]), value, prices
+
+class _Designs:
+    '''
+    Values of sets of open depots, each solved once by _transport from the capacity prices of the best set so far.
+    '''
+
+    def __init__(self, cost, demand, capacity, warehouse_cost):
+
+        self.cost, self.demand, self.capacity, self.warehouse_cost = cost, demand, capacity, warehouse_cost
+        # One contiguous row per depot, so that bounds read the columns of a set without copying them
+        self.columns = np.ascontiguousarray(np.asarray(cost).T)
+        self.prices = np.zeros(cost.shape[1])
+        self.best = (None, None, np.inf)
+        self.solved = 0
+        self.tables = {}
+
+    def _table(self, prices):
+        '''
+        Sum over customers of min_j(cost + demand*price_j) over the depots j of every set, indexed by the bit mask of the set.
+        A customer is served in a set by the first of its depots in price order that the set contains, so its cost to depot
+        j counts for the sets that contain j and none of the depots before it; summing these over subsets (a zeta
+        transform over the masks) gives every set from one pass over the customers.
+        '''
+
+        n_depots = len(prices)
+        priced = self.cost + self.demand[:, None]*prices
+        order = priced.argsort(axis=1)
+        ranked = np.take_along_axis(priced, order, axis=1)
+        before = np.zeros_like(order)
+        before[:, 1:] = np.cumsum(1 << order[:, :-1], axis=1)
+
+        table = np.bincount((order << n_depots | before).ravel(), weights=ranked.ravel(),
+                            minlength=n_depots << n_depots).reshape(n_depots, 1 << n_depots)
+        for bit in range(n_depots):
+            view = table.reshape(n_depots, -1, 2, 1 << bit)
+            view[:, :, 1] += view[:, :, 0]
+
+        masks = np.arange(1 << n_depots)
+        outside = masks ^ ((1 << n_depots) - 1)
+        return sum(np.where(masks >> j & 1, table[j, outside], 0) for j in range(n_depots))
+
+    def _priced(self, open_mask, prices):
+
+        opened = np.flatnonzero(open_mask)
+        if len(open_mask) <= TABLE_DEPOTS:
+            key, zero = prices.tobytes(), np.zeros_like(prices).tobytes()
+            if key not in self.tables:
+                # Only the tables at 0 and at the latest prices are kept
+                self.tables = {k: v for k, v in self.tables.items() if k == zero}
+                self.tables[key] = self._table(prices)
+            return self.tables[key][int(open_mask @ (1 << np.arange(len(open_mask))))]
+
+        priced = np.full(len(self.demand), np.inf)
+        for j in opened.tolist():
+            np.minimum(priced, self.columns[j] + self.demand*prices[j] if prices[j] else self.columns[j], out=priced)
+        return priced.sum()
+
+    def bound(self, open_mask):
+        '''
+        Lower bound on the value of a set of open depots from the Lagrangian dual of its capacities, at the prices of the
+        best set and at 0 (the uncapacitated value); inf when the set cannot hold the demand.
+        '''
+
+        opened = np.flatnonzero(open_mask)
+        if self.capacity[opened].sum() < self.demand.sum() - 1e-9:
+            return np.inf
+
+        uncapacitated = self._priced(open_mask, np.zeros_like(self.prices))
+        priced = self._priced(open_mask, self.prices) - (self.capacity[opened]*self.prices[opened]).sum()
+        return max(uncapacitated, priced) + self.warehouse_cost*len(opened)
+
+    def value(self, open_mask):
+        '''
+        Value of a set of open depots (inf when its bound rules it out); it becomes the best set when it improves on it.
+        '''
+
+        if self.bound(open_mask) >= self.best[2] - 1e-9:
+            return np.inf
+
+        opened = np.flatnonzero(open_mask)
+        fixed = self.warehouse_cost*len(opened)
+        result = _transport(np.ascontiguousarray(self.cost[:, opened]), self.demand, self.capacity[opened], self.prices[opened],
+                            self.best[2] - fixed)
+        self.solved += 1
+        if result is None:
+            return np.inf
+
+        (pair_customer, pair_column, fraction), value, prices = result
+        value += fixed
+        if value < self.best[2] - 1e-9:
+            self.best = (open_mask.copy(), (pair_customer, opened[pair_column], fraction), value)
+            self.prices = np.zeros_like(self.prices)
+            self.prices[opened] = prices
+        return value
+
+def _candidate_sets(central, p_regional):
+
+    regional = np.flatnonzero(~central)
+    n_depots = len(central)
+
+    if p_regional is None:
+        for size in range(1, n_depots + 1):
+            for opened in itertools.combinations(range(n_depots), size):
+                yield list(opened)
+    else:
+        for opened in itertools.combinations(regional.tolist(), p_regional):
+            yield np.flatnonzero(central).tolist() + list(opened)
+
+def _enumerate(designs, central, p_regional, deadline):
+    '''
+    Best-first search over every candidate set of open depots: the set with the lowest bound is solved next, after its
+    bound is brought up to date with the prices of the best set, until the lowest bound reaches the best value.
+    Returns the lower bound proven on the optimum, which is the best value when the search completes.
+    '''
+
+    sets, queue = [], []
+    for opened in _candidate_sets(central, p_regional):
+        open_mask = np.zeros(len(central), dtype=bool)
+        open_mask[opened] = True
+        bound = designs.bound(open_mask)
+        if bound < np.inf:
+            queue.append((bound, len(sets)))
+            sets.append(open_mask)
+    heapq.heapify(queue)
+
+    while queue:
+
+        bound, s = queue[0]
+        if bound >= designs.best[2] - 1e-9:
+            break
+        # Out of time, once there is a design to report
+        if time.perf_counter() > deadline and designs.best[0] is not None:
+            return bound
+
+        heapq.heappop(queue)
+        updated = max(bound, designs.bound(sets[s]))
+        if queue and updated > queue[0][0]:
+            heapq.heappush(queue, (updated, s))
+            continue
+        designs.value(sets[s])
+
+    return designs.best[2]
+
+def _local_search(designs, cost, demand, capacity, central, warehouse_cost, p_regional, deadline):
+    '''
+    Greedy depot opening followed by open/close/swap moves, first improvement, as in the heuristic.
+    '''
+
+    regional = np.flatnonzero(~central)
+    open_mask = _greedy_open(cost, demand, capacity, central, warehouse_cost, p_regional)
+    if p_regional is None and capacity[open_mask].sum() < demand.sum():
+        open_mask[:] = True
+    designs.value(open_mask)
+
+    improved = True
+    while improved and time.perf_counter() < deadline and designs.best[0] is not None:
+
+        improved = False
+        open_mask = designs.best[0]
+        opened = [j for j in range(len(central)) if open_mask[j]]
+        closed = [j for j in regional if not open_mask[j]]
+
+        moves = [[j] for j in range(len(central))] if p_regional is None else []
+        moves += [[j, k] for j in opened if not central[j] for k in closed]
+
+        for move in moves:
+            if time.perf_counter() > deadline:
+                break
+            candidate = open_mask.copy()
+            candidate[move] = ~candidate[move]
+            if not candidate.any():
+                continue
+            value = designs.best[2]
+            designs.value(candidate)
+            if designs.best[2] < value:
+                improved = True
+                break
+
+def _divisible(inst, costs, p_regional, time_limit):
+
+    if not inst["Divisible"]:
+        raise ValueError("The divisible engine needs an instance with divisible demand")
+
+    if time_limit is None:
+        time_limit = DEFAULT_TIME_LIMIT
+    deadline = time.perf_counter() + time_limit
+
+    profile = new_profile("assignment" if p_regional is None else "p", p_regional)
+    with phase(profile, "distance"):
+        cost, demand, capacity, central = _instance_arrays(inst, costs)
+    warehouse_cost = inst["CostWarehouse"] if p_regional is None else 0
+
+    designs = _Designs(cost, demand, capacity, warehouse_cost)
+    bound = None
+
+    with phase(profile, "solve"):
+        if p_regional is None or 0 <= p_regional <= (~central).sum():
+            n_regional = int((~central).sum())
+            n_sets = 2**len(central) - 1 if p_regional is None else math.comb(n_regional, p_regional)
+            if n_sets <= ENUMERATION_LIMIT:
+                bound = _enumerate(designs, central, p_regional, deadline)
+            else:
+                _local_search(designs, cost, demand, capacity, central, warehouse_cost, p_regional, deadline)
+
+    open_mask, pairs, value = designs.best
+    if open_mask is not None and bound is None:
+        with phase(profile, "bound"):
+            bound = lagrangian_lower_bound(cost, demand, capacity, central, warehouse_cost, p_regional, value,
+                                           time.perf_counter() + max(deadline - time.perf_counter(), 0.1*time_limit))
+
+    with phase(profile, "extract"):
+        if open_mask is None:
+            status = "infeasible"
+        elif bound >= value - 1e-9*max(1.0, abs(value)):
+            status = "optimal"
+        elif time.perf_counter() > deadline:
+            status = "time_limit"
+        else:
+            status = "heuristic"
+        solution = solution_from_fractions(inst, cost, central, open_mask, pairs, p_regional, status)
+
+    if open_mask is not None:
+        solution["best_bound"] = min(float(bound), solution["total_cost"])
+        solution["gap"] = (solution["total_cost"] - solution["best_bound"])/max(abs(solution["total_cost"]), 1e-10)
+    profile["designs"] = designs.solved
+
+    return finish_profile(solution, profile)
+
+def solution_from_fractions(inst, cost, central, open_mask, pairs, p_regional=None, status="optimal"):
+    '''
+    Solution dictionary, as returned by lp_optimal (p_regional None) or p_algorithm, of a set of open depots and a divisible
+    assignment given as (customer, depot, fraction) position arrays. "assigned_fractions" holds the fraction of every
+    customer at each of its depots, in the order of "assigned_customers".
+    open_mask None stands for no feasible design and gives an empty solution with status "infeasible".
+    '''
+
+    if open_mask is None:
+        return {"assigned_customers": {},
+                "used_warehouses": [],
+                "inbound_cost": 0,
+                "outbound_cost": 0,
+                "warehouse_cost": 0,
+                "total_cost": 0,
+                "best_bound": None,
+                "gap": None,
+                "status": "infeasible",
+                "node_count": 0}
+
+    N_customers = customer_array(inst)["id"].tolist()
+    N_depots = depot_array(inst)["id"].tolist()
+    pair_customer, pair_depot, fraction = pairs
+
+    # The central depot only counts as open when it serves someone in the p variant, where opening it is free
+    if p_regional is not None:
+        open_mask = open_mask & (~central | (np.bincount(pair_depot, minlength=len(N_depots)) > 0))
+
+    pair_cost = cost[pair_customer, pair_depot]*fraction
+    inbound_cost = float(pair_cost[~central[pair_depot]].sum())
+    outbound_cost = float(pair_cost[central[pair_depot]].sum())
+    warehouse_cost = float(inst["CostWarehouse"]*open_mask.sum())
+
+    assigned_customers = {i: [] for i in N_customers}
+    assigned_fractions = {i: [] for i in N_customers}
+    for a, b, f in zip(pair_customer.tolist(), pair_depot.tolist(), fraction.tolist()):
+        assigned_customers[N_customers[a]].append(N_depots[b])
+        assigned_fractions[N_customers[a]].append(f)
+
+    return {"assigned_customers": assigned_customers,
+            "assigned_fractions": assigned_fractions,
+            "used_warehouses": [j for j, is_open in zip(N_depots, open_mask.tolist()) if is_open] + [1001],
+            "inbound_cost": inbound_cost,
+            "outbound_cost": outbound_cost,
+            "warehouse_cost": warehouse_cost,
+            "total_cost": inbound_cost + outbound_cost + (warehouse_cost if p_regional is None else 0),
+            "best_bound": None,
+            "gap": None,
+            "status": status,
+            "node_count": 0}
+
+def divisible_optimal(inst, costs=None, time_limit=None):
+    '''
+    Counterpart of lp_optimal for divisible demand. With few depots every set of open depots is considered, in order of
+    its uncapacitated value until that bound proves the best set optimal; otherwise the sets come from local search and
+    a Lagrangian bound gives "best_bound". Every set is assigned exactly by _transport.
+    time_limit is in seconds (DEFAULT_TIME_LIMIT when None); a search cut short reports status "time_limit".
+    '''
+
+    return _divisible(inst, costs, None, time_limit)
+
+def divisible_p_algorithm(inst, p_regional, costs=None, time_limit=None):
+    '''
+    Counterpart of p_algorithm for divisible demand, searching only the sets with p_regional regional depots.
+    '''
+
+    return _divisible(inst, costs, p_regional, time_limit)
@@ -0,0 +1,343 @@
+#Greedy construction and local search for instances beyond the reach of the MIP
+
+import time
+
+import numpy as np
+
+from instance import customer_array, depot_array
+from p_algorithm import cost_matrix
+from profiling import finish_profile, new_profile, phase
+
+# Time budget in seconds when none is given
+DEFAULT_TIME_LIMIT = 5.0
+
+def _instance_arrays(inst, costs):
+    '''
+    Demand, capacity and central depot arrays aligned with the rows and columns of the cost matrix.
+    '''
+
+    if costs is None:
+        costs = cost_matrix(inst)
+
+    demand = np.asarray(customer_array(inst)["demand"], dtype=float)
+    central = np.asarray(depot_array(inst)["central"], dtype=bool)
+    capacity = np.where(central, inst["WarehouseLimit"], 10000).astype(float)
+
+    return costs["cost"], demand, capacity, central
+
+def _assign(cost, demand, capacity, open_mask):
+    '''
+    Capacity-aware assignment of every customer to an open depot.
+    Customers go to their cheapest open depot; overloaded depots keep the customers that would lose the most by moving
+    and hand the rest to their cheapest depot with spare capacity.
+    Returns the depot index of every customer, or None when the open depots cannot hold the demand.
+    '''
+
+    n_depots = cost.shape[1]
+    if demand.sum() > capacity[open_mask].sum() + 1e-9:
+        return None
+
+    assignment = np.where(open_mask, cost, np.inf).argmin(axis=1)
+    full = np.zeros(n_depots, dtype=bool)
+
+    for _ in range(n_depots):
+
+        load = np.bincount(assignment, weights=demand, minlength=n_depots)
+        over = np.flatnonzero(load > capacity + 1e-9)
+        if len(over) == 0:
+            return assignment
+
+        full[over] = True
+        alternative = np.where(open_mask & ~full, cost, np.inf)
+        best_alternative = alternative.min(axis=1)
+
+        for j in over:
+            members = np.flatnonzero(assignment == j)
+            regret = best_alternative[members] - cost[members, j]
+            members = members[np.argsort(-regret, kind="stable")]
+            keep = np.cumsum(demand[members]) <= capacity[j] + 1e-9
+            evicted = members[~keep]
+            if np.isinf(best_alternative[evicted]).any():
+                return None
+            assignment[evicted] = alternative[evicted].argmin(axis=1)
+
+    return None
+
+def _shift(cost, demand, capacity, open_mask, assignment, deadline):
+    '''
+    Moves customers to cheaper open depots with spare capacity, in batches of best improvement per target depot.
+    '''
+
+    n_customers, n_depots = cost.shape
+    rows = np.arange(n_customers)
+
+    while time.perf_counter() < deadline:
+
+        load = np.bincount(assignment, weights=demand, minlength=n_depots)
+        residual = capacity - load
+        current = cost[rows, assignment]
+
+        fits = open_mask[None, :] & (residual[None, :] >= demand[:, None] - 1e-9)
+        candidate = np.where(fits, cost, np.inf)
+        candidate[rows, assignment] = np.inf
+        target = candidate.argmin(axis=1)
+        gain = current - candidate[rows, target]
+
+        movers = np.flatnonzero(gain > 1e-9)
+        if len(movers) == 0:
+            break
+
+        # Within each target depot, accept the largest gains while its residual capacity lasts
+        movers = movers[np.lexsort((-gain[movers], target[movers]))]
+        movers_target = target[movers]
+        cumulative = np.cumsum(demand[movers])
+        group_start = np.flatnonzero(np.r_[True, movers_target[1:] != movers_target[:-1]])
+        offset = np.repeat(cumulative[group_start] - demand[movers[group_start]], np.diff(np.r_[group_start, len(movers)]))
+        accepted = cumulative - offset <= residual[movers_target] + 1e-9
+
+        assignment[movers[accepted]] = movers_target[accepted]
+
+    return assignment
+
+def _swap(cost, demand, capacity, open_mask, assignment, deadline):
+    '''
+    Exchanges customers between pairs of open depots when capacity blocks the plain shift.
+    The customers that gain the most from each direction are paired up and the improving prefix is applied.
+    '''
+
+    n_depots = cost.shape[1]
+    opened = np.flatnonzero(open_mask)
+    improved = False
+
+    for a, j in enumerate(opened):
+        for k in opened[a+1:]:
+
+            if time.perf_counter() > deadline:
+                return assignment, improved
+
+            at_j = np.flatnonzero(assignment == j)
+            at_k = np.flatnonzero(assignment == k)
+            gain_j = cost[at_j, j] - cost[at_j, k]
+            gain_k = cost[at_k, k] - cost[at_k, j]
+            at_j = at_j[np.argsort(-gain_j)]
+            at_k = at_k[np.argsort(-gain_k)]
+            pairs = min(len(at_j), len(at_k))
+            if pairs == 0:
+                continue
+
+            at_j, at_k = at_j[:pairs], at_k[:pairs]
+            pair_gain = (cost[at_j, j] - cost[at_j, k]) + (cost[at_k, k] - cost[at_k, j])
+
+            load = np.bincount(assignment, weights=demand, minlength=n_depots)
+            delta = np.cumsum(demand[at_k] - demand[at_j])
+            accepted = (np.cumsum(pair_gain > 1e-9) == np.arange(1, pairs+1)) \
+                & (load[j] + delta <= capacity[j] + 1e-9) & (load[k] - delta <= capacity[k] + 1e-9)
+            count = int(np.cumprod(accepted).sum())
+
+            if count:
+                assignment[at_j[:count]] = k
+                assignment[at_k[:count]] = j
+                improved = True
+
+    return assignment, improved
+
+def _improve_assignment(cost, demand, capacity, open_mask, assignment, deadline):
+
+    while True:
+        assignment = _shift(cost, demand, capacity, open_mask, assignment, deadline)
+        assignment, improved = _swap(cost, demand, capacity, open_mask, assignment, deadline)
+        if not improved or time.perf_counter() > deadline:
+            return assignment
+
+def _evaluate(cost, demand, capacity, open_mask, warehouse_cost, deadline):
+    '''
+    Assignment and objective value for a set of open depots, or (None, inf) when it is capacity infeasible.
+    '''
+
+    assignment = _assign(cost, demand, capacity, open_mask)
+    if assignment is None:
+        return None, np.inf
+
+    assignment = _shift(cost, demand, capacity, open_mask, assignment, deadline)
+    value = cost[np.arange(len(assignment)), assignment].sum() + warehouse_cost*open_mask.sum()
+
+    return assignment, value
+
+def _greedy_open(cost, demand, capacity, central, warehouse_cost, p_regional):
+    '''
+    Greedy construction on the uncapacitated savings of opening each depot.
+    '''
+
+    regional = np.flatnonzero(~central)
+
+    open_mask = central.copy()
+    best_cost = np.where(open_mask, cost, np.inf).min(axis=1)
+    target = len(regional) if p_regional is None else p_regional
+
+    while open_mask[regional].sum() < target:
+        savings = np.maximum(best_cost[:, None] - cost[:, regional], 0).sum(axis=0)
+        savings[open_mask[regional]] = -np.inf
+        best = int(np.argmax(savings))
+        if p_regional is None and savings[best] <= warehouse_cost and demand.sum() <= capacity[open_mask].sum():
+            break
+        open_mask[regional[best]] = True
+        best_cost = np.minimum(best_cost, cost[:, regional[best]])
+
+    return open_mask
+
+def _search(cost, demand, capacity, central, warehouse_cost, p_regional, deadline, open_mask=None):
+    '''
+    Greedy depot opening (unless an initial open_mask is given) followed by open/close/swap moves on the depots.
+    With p_regional, exactly p_regional regional depots stay open and the central depot is always open.
+    Returns (open_mask, assignment, value), or (None, None, inf) when no capacity-feasible set of depots is found.
+    '''
+
+    n_depots = cost.shape[1]
+    regional = np.flatnonzero(~central)
+
+    if open_mask is None:
+        open_mask = _greedy_open(cost, demand, capacity, central, warehouse_cost, p_regional)
+
+    assignment, value = _evaluate(cost, demand, capacity, open_mask, warehouse_cost, deadline)
+
+    # Open/close/swap moves, first improvement
+    improved = True
+    while improved and time.perf_counter() < deadline:
+
+        improved = False
+        moves = []
+        opened = [j for j in range(n_depots) if open_mask[j]]
+        closed = [j for j in regional if not open_mask[j]]
+
+        if p_regional is None:
+            moves += [[j] for j in range(n_depots)]
+        moves += [[j, k] for j in opened if not central[j] for k in closed]
+
+        for move in moves:
+            if time.perf_counter() > deadline:
+                break
+            candidate = open_mask.copy()
+            candidate[move] = ~candidate[move]
+            if not candidate.any():
+                continue
+
+            # The uncapacitated value is a lower bound on the capacitated one, so it rules out most moves cheaply
+            relaxed = np.where(candidate, cost, np.inf).min(axis=1).sum() + warehouse_cost*candidate.sum()
+            if relaxed >= value - 1e-9:
+                continue
+
+            candidate_assignment, candidate_value = _evaluate(cost, demand, capacity, candidate, warehouse_cost, deadline)
+            if candidate_value < value - 1e-9:
+                open_mask, assignment, value = candidate, candidate_assignment, candidate_value
+                improved = True
+                break
+
+    if assignment is None:
+        return None, None, np.inf
+
+    assignment = _improve_assignment(cost, demand, capacity, open_mask, assignment, deadline)
+    value = cost[np.arange(len(assignment)), assignment].sum() + warehouse_cost*open_mask.sum()
+
+    return open_mask, assignment, value
+
+def solution_from_design(inst, cost, central, open_mask, assignment, p_regional=None, status="heuristic"):
+    '''
+    Solution dictionary, as returned by lp_optimal (p_regional None) or p_algorithm, of a set of open depots and the
+    depot position of every customer. There is no bound, so "best_bound" and "gap" are None.
+    open_mask None stands for no feasible design and gives an empty solution with status "infeasible".
+    '''
+
+    if open_mask is None:
+        return {"assigned_customers": {},
+                "used_warehouses": [],
+                "inbound_cost": 0,
+                "outbound_cost": 0,
+                "warehouse_cost": 0,
+                "total_cost": 0,
+                "best_bound": None,
+                "gap": None,
+                "status": "infeasible",
+                "node_count": 0}
+
+    N_customers = customer_array(inst)["id"].tolist()
+    N_depots = depot_array(inst)["id"].tolist()
+    CostWarehouse = inst["CostWarehouse"]
+
+    # The central depot only counts as open when it serves someone in the p variant, where opening it is free
+    if p_regional is not None:
+        open_mask = open_mask & (~central | (np.bincount(assignment, minlength=len(N_depots)) > 0))
+
+    assigned_cost = cost[np.arange(len(assignment)), assignment]
+    inbound_cost = float(assigned_cost[~central[assignment]].sum())
+    outbound_cost = float(assigned_cost[central[assignment]].sum())
+    warehouse_cost = float(CostWarehouse*open_mask.sum())
+
+    if inst["Divisible"]:
+        assigned_customers = {i: [N_depots[b]] for i, b in zip(N_customers, assignment.tolist())}
+    else:
+        assigned_customers = {i: N_depots[b] for i, b in zip(N_customers, assignment.tolist())}
+
+    return {"assigned_customers": assigned_customers,
+            "used_warehouses": [j for j, is_open in zip(N_depots, open_mask.tolist()) if is_open] + [1001],
+            "inbound_cost": inbound_cost,
+            "outbound_cost": outbound_cost,
+            "warehouse_cost": warehouse_cost,
+            "total_cost": inbound_cost + outbound_cost + (warehouse_cost if p_regional is None else 0),
+            "best_bound": None,
+            "gap": None,
+            "status": status,
+            "node_count": 0}
+
+def _heuristic(inst, costs, p_regional, time_limit):
+
+    if time_limit is None:
+        time_limit = DEFAULT_TIME_LIMIT
+    deadline = time.perf_counter() + time_limit
+
+    profile = new_profile("assignment" if p_regional is None else "p", p_regional)
+    with phase(profile, "distance"):
+        cost, demand, capacity, central = _instance_arrays(inst, costs)
+    CostWarehouse = inst["CostWarehouse"]
+
+    with phase(profile, "solve"):
+        if p_regional is not None and not 0 <= p_regional <= (~central).sum():
+            open_mask, assignment = None, None
+        else:
+            open_mask, assignment, _ = _search(cost, demand, capacity, central, 0 if p_regional is not None else CostWarehouse, p_regional, deadline)
+
+    with phase(profile, "extract"):
+        solution = solution_from_design(inst, cost, central, open_mask, assignment, p_regional)
+
+    return finish_profile(solution, profile)
+
+def heuristic_optimal(inst, costs=None, time_limit=None):
+    '''
+    Greedy + local search counterpart of lp_optimal, returning the same solution dictionary within time_limit seconds
+    (DEFAULT_TIME_LIMIT when None).
+    Every customer is served by a single depot, also when the demand is divisible.
+    '''
+
+    return _heuristic(inst, costs, None, time_limit)
+
+def heuristic_p_algorithm(inst, p_regional, costs=None, time_limit=None):
+    '''
+    Greedy + local search counterpart of p_algorithm, returning the same solution dictionary within time_limit seconds.
+    '''
+
+    return _heuristic(inst, costs, p_regional, time_limit)
+
+def improve_design(inst, open_mask, p_regional=None, costs=None, time_limit=1.0):
+    '''
+    Local search from a given set of open depots (boolean array over the depots of the instance) using every customer/depot pair.
+    Returns (open_mask, assignment, value) with assignment as depot positions and value in the objective of
+    lp_optimal (p_regional None) or p_algorithm; (None, None, inf) when no capacity-feasible design is found.
+    '''
+
+    deadline = time.perf_counter() + time_limit
+    cost, demand, capacity, central = _instance_arrays(inst, costs)
+
+    open_mask = np.asarray(open_mask, dtype=bool).copy()
+    if p_regional is not None:
+        open_mask |= central
+
+    return _search(cost, demand, capacity, central, 0 if p_regional is not None else inst["CostWarehouse"], p_regional, deadline, open_mask)
@@ -0,0 +1,216 @@
+#Compact array-backed instances with a memory-mappable binary file format
+
+import json
+import os
+
+import numpy as np
+
+CUSTOMER_DTYPE = np.dtype([("id", np.int64), ("x", np.float64), ("y", np.float64), ("demand", np.float64)])
+DEPOT_DTYPE = np.dtype([("id", np.int64), ("x", np.float64), ("y", np.float64), ("central", np.bool_)])
+
+# Scalar parameters of an instance, with the keys used by the dictionaries of CreateInstance
+PARAMETERS = ("GridSize", "Divisible", "CostKm", "CostWarehouse", "WarehouseLimit", "Seed")
+
+# File layout: a fixed-size JSON header padded with spaces, then the depot records, then the customer records.
+# Customers come last so that a writer can append them without knowing their number in advance.
+MAGIC = b"2EFLAP01"
+HEADER_SIZE = 4096
+
+class Instance:
+    '''
+    Instance stored as two structured arrays (customers: id, x, y, demand; depots: id, x, y, central)
+    plus the scalar parameters. Solvers and plots read the arrays directly.
+    inst["allCustomers"] and the other dictionary keys of CreateInstance still work, building lists on demand.
+    An instance loaded with mmap=True pickles as its file path, so worker processes map the same file instead of
+    receiving a copy of the arrays.
+    '''
+
+    __slots__ = ("customers", "depots") + PARAMETERS + ("path",)
+
+    def __init__(self, customers, depots, GridSize, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed=None, path=None):
+
+        self.customers = customers
+        self.depots = depots
+        self.GridSize = GridSize
+        self.Divisible = Divisible
+        self.CostKm = CostKm
+        self.CostWarehouse = CostWarehouse
+        self.WarehouseLimit = WarehouseLimit
+        self.Seed = Seed
+        self.path = path
+
+    @classmethod
+    def from_dict(cls, inst):
+
+        return cls(customer_array(inst), depot_array(inst), **{key: inst[key] for key in PARAMETERS})
+
+    def to_dict(self):
+
+        return {key: self[key] for key in ("allCustomers", "allNodes", "allDepots") + PARAMETERS}
+
+    def __getitem__(self, key):
+
+        if key == "allCustomers":
+            return [[i, x, y, demand] for i, x, y, demand in zip(self.customers["id"].tolist(), _plain(self.customers["x"]),
+                                                                  _plain(self.customers["y"]), _plain(self.customers["demand"]))]
+        if key == "allDepots":
+            return [[j, x, y, central] for j, x, y, central in zip(self.depots["id"].tolist(), _plain(self.depots["x"]),
+                                                                    _plain(self.depots["y"]), self.depots["central"].tolist())]
+        if key == "allNodes":
+            return self["allCustomers"] + self["allDepots"]
+        if key in PARAMETERS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __len__(self):
+
+        return len(self.customers)
+
+    def __repr__(self):
+
+        return f"Instance({len(self.customers)} customers, {len(self.depots)} depots)"
+
+    def __reduce__(self):
+
+        if self.path is not None:
+            return load_instance, (self.path,)
+        return Instance, (self.customers, self.depots) + tuple(getattr(self, key) for key in PARAMETERS)
+
+    def save(self, path):
+
+        save_instance(self, path)
+
+def _plain(values):
+    '''
+    Coordinates and demands as Python numbers, integers where they are whole as in CreateInstance.
+    '''
+
+    if np.all(values == np.round(values)):
+        return values.astype(np.int64).tolist()
+    return values.tolist()
+
+def customer_array(inst):
+    '''
+    Customers of an Instance or of a CreateInstance dictionary as a CUSTOMER_DTYPE array.
+    '''
+
+    if isinstance(inst, Instance):
+        return inst.customers
+
+    rows = np.array([i[:4] for i in inst["allCustomers"]], dtype=float).reshape(-1, 4)
+    customers = np.empty(len(rows), dtype=CUSTOMER_DTYPE)
+    customers["id"] = rows[:, 0]
+    customers["x"] = rows[:, 1]
+    customers["y"] = rows[:, 2]
+    customers["demand"] = rows[:, 3]
+
+    return customers
+
+def depot_array(inst):
+    '''
+    Depots of an Instance or of a CreateInstance dictionary as a DEPOT_DTYPE array.
+    '''
+
+    if isinstance(inst, Instance):
+        return inst.depots
+
+    all_Depots = inst["allDepots"]
+    rows = np.array([j[:3] for j in all_Depots], dtype=float).reshape(-1, 3)
+    depots = np.empty(len(rows), dtype=DEPOT_DTYPE)
+    depots["id"] = rows[:, 0]
+    depots["x"] = rows[:, 1]
+    depots["y"] = rows[:, 2]
+    depots["central"] = [j[3] == True for j in all_Depots]
+
+    return depots
+
+def _write_header(f, params, n_depots, n_customers):
+
+    header = json.dumps({"params": params, "depots": n_depots, "customers": n_customers}).encode()
+    if len(MAGIC) + len(header) > HEADER_SIZE:
+        raise ValueError("Instance parameters do not fit in the file header")
+
+    f.seek(0)
+    f.write(MAGIC + header.ljust(HEADER_SIZE - len(MAGIC)))
+
+def _json_value(value):
+
+    # Parameters may come from NumPy or Streamlit widgets as NumPy scalars
+    return value.item() if isinstance(value, np.generic) else value
+
+class InstanceWriter:
+    '''
+    Writes an instance file incrementally: the depots and parameters up front, then customers in as many append calls as needed.
+    The customer count in the header is filled in on close. Use as a context manager.
+    '''
+
+    def __init__(self, path, depots, params):
+
+        self.path = path
+        self.params = {key: _json_value(params[key]) for key in PARAMETERS}
+        self.depots = np.ascontiguousarray(depots, dtype=DEPOT_DTYPE)
+        self.n_customers = 0
+
+        self._file = open(path, "wb")
+        _write_header(self._file, self.params, len(self.depots), 0)
+        self._file.write(self.depots.tobytes())
+
+    def append(self, customers):
+
+        customers = np.ascontiguousarray(customers, dtype=CUSTOMER_DTYPE)
+        self._file.write(customers.tobytes())
+        self.n_customers += len(customers)
+
+    def close(self):
+
+        if not self._file.closed:
+            _write_header(self._file, self.params, len(self.depots), self.n_customers)
+            self._file.close()
+
+    def instance(self, mmap=True):
+
+        self.close()
+        return load_instance(self.path, mmap)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+def save_instance(inst, path):
+    '''
+    Writes an Instance (or a CreateInstance dictionary) to a binary file that load_instance can memory-map.
+    '''
+
+    with InstanceWriter(path, depot_array(inst), inst) as writer:
+        writer.append(customer_array(inst))
+
+def _read_records(path, dtype, offset, count, mmap):
+
+    # An empty block cannot be memory-mapped
+    if mmap and count:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+def load_instance(path, mmap=True):
+    '''
+    Reads a file written by save_instance. With mmap=True the arrays are read-only memory maps of the file, so opening
+    is instant whatever the size and the pages are shared by every process that maps the same file.
+    '''
+
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not an instance file")
+    header = json.loads(head[len(MAGIC):])
+
+    n_depots, n_customers = header["depots"], header["customers"]
+    customers_offset = HEADER_SIZE + n_depots*DEPOT_DTYPE.itemsize
+
+    depots = _read_records(path, DEPOT_DTYPE, HEADER_SIZE, n_depots, mmap)
+    customers = _read_records(path, CUSTOMER_DTYPE, customers_offset, n_customers, mmap)
+
+    return Instance(customers, depots, path=os.path.abspath(path) if mmap else None, **header["params"])
@@ -0,0 +1,88 @@
+#Vectorized generator of large synthetic instances, in memory or streamed to an instance file
+
+import numpy as np
+
+from instance import CUSTOMER_DTYPE, DEPOT_DTYPE, Instance, InstanceWriter
+
+# Customers are drawn in blocks of this size, each from its own generator seeded by (Seed, block), so the
+# result does not depend on how the blocks are grouped into chunks and memory stays bounded when streaming
+BLOCK_SIZE = 2**18
+
+def _depots(rng, NoOfRegionalDepots, Grid):
+
+    # Same layout as CreateInstance: the central depot 1001 in the middle of the grid, then the regional depots
+    depots = np.empty(int(NoOfRegionalDepots) + 1, dtype=DEPOT_DTYPE)
+    depots["id"] = np.arange(1001, 1001 + len(depots))
+    depots["x"][0] = depots["y"][0] = int(Grid/2)
+    depots["x"][1:] = rng.integers(1, Grid, len(depots) - 1, endpoint=True)
+    depots["y"][1:] = rng.integers(1, Grid, len(depots) - 1, endpoint=True)
+    depots["central"] = np.arange(len(depots)) == 0
+
+    return depots
+
+def _customer_block(rng, first_id, size, Grid, distribution, demand, max_demand, centers, cluster_spread):
+
+    customers = np.empty(size, dtype=CUSTOMER_DTYPE)
+    customers["id"] = np.arange(first_id, first_id + size)
+
+    if distribution == "uniform":
+        customers["x"] = rng.integers(1, Grid, size, endpoint=True)
+        customers["y"] = rng.integers(1, Grid, size, endpoint=True)
+    else:
+        # Gaussian clusters around random centers, rounded to the integer grid
+        cluster = rng.integers(0, len(centers), size)
+        xy = centers[cluster] + rng.normal(0, cluster_spread*Grid, (size, 2))
+        xy = np.clip(np.rint(xy), 1, Grid)
+        customers["x"] = xy[:, 0]
+        customers["y"] = xy[:, 1]
+
+    if demand == "unit":
+        customers["demand"] = 1
+    elif demand == "uniform":
+        customers["demand"] = rng.integers(1, max_demand, size, endpoint=True)
+    else:
+        # Heavy-tailed demand: many small customers and a few large ones
+        customers["demand"] = np.clip(np.ceil(rng.lognormal(0, 1, size)), 1, max_demand)
+
+    return customers
+
+def generate_instance(NoOfCustomers, NoOfRegionalDepots, Grid, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed,
+                      distribution="uniform", demand="unit", max_demand=10, clusters=10, cluster_spread=0.05, path=None):
+    '''
+    NumPy counterpart of CreateInstance for large instances, returning an Instance.
+    distribution is "uniform" (as CreateInstance) or "clustered" (Gaussian clusters around clusters random centers with a
+    standard deviation of cluster_spread*Grid). demand is "unit" (as CreateInstance), "uniform" (integers from 1 to max_demand)
+    or "lognormal" (rounded up and capped at max_demand).
+    With path, customers are streamed to an instance file block by block and the memory-mapped instance is returned.
+    The same arguments always give the same instance. Depots are drawn from their own stream, so unlike CreateInstance
+    they do not repeat the coordinates of the first customers.
+    '''
+
+    if distribution not in ("uniform", "clustered"):
+        raise ValueError(f"Unknown distribution {distribution!r}")
+    if demand not in ("unit", "uniform", "lognormal"):
+        raise ValueError(f"Unknown demand {demand!r}")
+
+    NoOfCustomers = int(NoOfCustomers)
+    params = {"GridSize": Grid, "Divisible": Divisible, "CostKm": CostKm, "CostWarehouse": CostWarehouse,
+              "WarehouseLimit": WarehouseLimit, "Seed": Seed}
+
+    layout = np.random.default_rng([Seed, 0])
+    depots = _depots(layout, NoOfRegionalDepots, Grid)
+    centers = layout.integers(1, Grid, (clusters, 2), endpoint=True)
+
+    def blocks():
+        for block, first in enumerate(range(0, NoOfCustomers, BLOCK_SIZE)):
+            rng = np.random.default_rng([Seed, 1, block])
+            yield _customer_block(rng, first + 1, min(BLOCK_SIZE, NoOfCustomers - first), Grid,
+                                  distribution, demand, max_demand, centers, cluster_spread)
+
+    if path is None:
+        customers = np.concatenate(list(blocks())) if NoOfCustomers else np.empty(0, dtype=CUSTOMER_DTYPE)
+        return Instance(customers, depots, **params)
+
+    with InstanceWriter(path, depots, params) as writer:
+        for customers in blocks():
+            writer.append(customers)
+
+    return writer.instance()
@@ -0,0 +1,235 @@
+#Streaming import of customer and depot lists from CSV and Excel files into instance arrays
+
+import csv
+import io
+import math
+import os
+
+import numpy as np
+from openpyxl import load_workbook
+
+from instance import CUSTOMER_DTYPE, DEPOT_DTYPE, Instance, InstanceWriter
+
+# Rows parsed at a time; the memory used by the parsing grows with this, not with the file
+CHUNK_ROWS = 50000
+
+# Columns of each file (matched case-insensitively) with the default of the optional ones
+REQUIRED_COLUMNS = ("id", "x", "y")
+CUSTOMER_COLUMNS = {"id": None, "x": None, "y": None, "demand": 1.0}
+DEPOT_COLUMNS = {"id": None, "x": None, "y": None, "central": False}
+
+# The solvers report the central depot under this id
+CENTRAL_DEPOT_ID = 1001
+
+def _file_name(source):
+
+    return source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+
+def _size(source):
+
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+def _rows(source, sheet=None):
+    '''
+    Yields (row, fraction of the file read so far or None) for every row of a CSV or XLSX file, header included.
+    source is a path or a binary file object (e.g. a Streamlit upload) whose name tells the format.
+    XLSX files are read with openpyxl in read-only mode, so neither format is loaded whole.
+    '''
+
+    extension = os.path.splitext(str(_file_name(source)))[1].lower()
+
+    if extension == ".csv":
+        size = max(_size(source), 1)
+        binary = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+        text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+        try:
+            for row in csv.reader(text):
+                # The position of the binary stream runs ahead by the read buffer, which is close enough for progress
+                yield row, binary.tell()/size
+        finally:
+            # Closing the wrapper would close an uploaded file the caller still owns
+            text.detach()
+            if binary is not source:
+                binary.close()
+
+    elif extension in (".xlsx", ".xlsm"):
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet is not None else workbook.active
+            total = worksheet.max_row
+            for number, row in enumerate(worksheet.iter_rows(values_only=True), 1):
+                yield row, number/total if total else None
+        finally:
+            workbook.close()
+
+    else:
+        raise ValueError(f"Unsupported file {_file_name(source)!r}; use .csv or .xlsx")
+
+def _column_positions(header, columns, name):
+
+    header = [str(value).strip().lower() if value is not None else "" for value in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"{name}: missing column(s) {', '.join(missing)} (found {', '.join(h for h in header if h)})")
+
+    return {column: header.index(column) for column in columns if column in header}
+
+def _blank(value):
+
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _numbers(rows, position, default, column, name, first_row):
+    '''
+    Column of a chunk of rows as floats, with default for blank cells of optional columns.
+    '''
+
+    values = [row[position] if position < len(row) else None for row in rows]
+    try:
+        if default is not None:
+            values = [default if _blank(value) else value for value in values]
+        return np.array(values, dtype=object).astype(float)
+    except (TypeError, ValueError):
+        for number, value in enumerate(values, first_row):
+            try:
+                float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name}, row {number}: {column} {value!r} is not a number") from None
+        raise
+
+def _flags(rows, position, column, name, first_row):
+
+    values = []
+    for number, row in enumerate(rows, first_row):
+        value = row[position] if position < len(row) else None
+        text = str(value).strip().lower() if not _blank(value) else "false"
+        if text in ("true", "1", "1.0", "yes", "y"):
+            values.append(True)
+        elif text in ("false", "0", "0.0", "no", "n"):
+            values.append(False)
+        else:
+            raise ValueError(f"{name}, row {number}: {column} {value!r} is not true or false")
+    return np.array(values, dtype=bool)
+
+def _chunks(source, columns, dtype, name, chunk_rows, sheet, progress):
+    '''
+    Yields dtype arrays of up to chunk_rows parsed and validated rows; progress(fraction, rows) is called after each one.
+    '''
+
+    rows = _rows(source, sheet)
+    header, _ = next(rows, (None, None))
+    if header is None:
+        raise ValueError(f"{name}: the file is empty")
+    positions = _column_positions(header, columns, name)
+
+    def parse(chunk, first_row):
+
+        records = np.empty(len(chunk), dtype=dtype)
+        for column in dtype.names:
+            if column == "central":
+                if "central" in positions:
+                    records["central"] = _flags(chunk, positions["central"], column, name, first_row)
+                else:
+                    # Without the column, the depot with the central id is the central depot
+                    records["central"] = records["id"] == CENTRAL_DEPOT_ID
+                continue
+            if column not in positions:
+                records[column] = columns[column]
+                continue
+            values = _numbers(chunk, positions[column], columns[column], column, name, first_row)
+            if not np.isfinite(values).all():
+                number = first_row + int(np.flatnonzero(~np.isfinite(values))[0])
+                raise ValueError(f"{name}, row {number}: {column} is not finite")
+            if column == "id" and (values != np.round(values)).any():
+                number = first_row + int(np.flatnonzero(values != np.round(values))[0])
+                raise ValueError(f"{name}, row {number}: id {values[number - first_row]} is not an integer")
+            if column == "demand" and (values < 0).any():
+                number = first_row + int(np.flatnonzero(values < 0)[0])
+                raise ValueError(f"{name}, row {number}: negative demand {values[number - first_row]}")
+            records[column] = values
+        return records
+
+    chunk, first_row, done, fraction = [], 2, 0, None
+    for row, fraction in rows:
+        # Blank lines and empty trailing spreadsheet rows are skipped
+        if not row or (_blank(row[0]) and all(_blank(value) for value in row)):
+            continue
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            yield parse(chunk, first_row)
+            first_row, done, chunk = first_row + len(chunk), done + len(chunk), []
+            if progress is not None:
+                progress(fraction, done)
+
+    if chunk:
+        yield parse(chunk, first_row)
+        done += len(chunk)
+    if progress is not None:
+        progress(1.0, done)
+
+def read_customers(source, chunk_rows=CHUNK_ROWS, sheet=None, progress=None):
+    '''
+    Yields the customers of a CSV or XLSX file (columns id, x, y and optionally demand, 1 by default) as CUSTOMER_DTYPE
+    arrays of up to chunk_rows rows. progress(fraction, rows) is called after every chunk with the fraction of the file read
+    (None when unknown) and the number of customers so far. Raises ValueError, naming the row, on missing or invalid values.
+    '''
+
+    return _chunks(source, CUSTOMER_COLUMNS, CUSTOMER_DTYPE, "Customers", chunk_rows, sheet, progress)
+
+def read_depots(source, sheet=None):
+    '''
+    Depots of a CSV or XLSX file (columns id, x, y and optionally central) as a DEPOT_DTYPE array.
+    Exactly one depot must be central and have id 1001; without a central column the depot with id 1001 is central.
+    '''
+
+    chunks = list(_chunks(source, DEPOT_COLUMNS, DEPOT_DTYPE, "Depots", CHUNK_ROWS, sheet, None))
+    depots = np.concatenate(chunks) if chunks else np.empty(0, dtype=DEPOT_DTYPE)
+
+    if depots["central"].sum() != 1 or depots["id"][depots["central"]][0] != CENTRAL_DEPOT_ID:
+        raise ValueError(f"Depots: exactly one depot must be central, with id {CENTRAL_DEPOT_ID}")
+    if len(np.unique(depots["id"])) != len(depots):
+        raise ValueError("Depots: ids are not unique")
+
+    return depots
+
+def import_instance(customers_source, depots_source, Divisible, CostKm, CostWarehouse, WarehouseLimit, GridSize=None,
+                    path=None, chunk_rows=CHUNK_ROWS, progress=None, customers_sheet=None, depots_sheet=None):
+    '''
+    Instance from a customer file and a depot file (CSV or XLSX, see read_customers and read_depots), read chunk by chunk.
+    GridSize, which only frames the plots, defaults to the largest coordinate rounded up.
+    With path, the customers are streamed to an instance file and the memory-mapped instance is returned, so memory stays
+    bounded by chunk_rows; otherwise the chunks are gathered into the customer array.
+    '''
+
+    depots = read_depots(depots_source, depots_sheet)
+    params = {"GridSize": GridSize, "Divisible": Divisible, "CostKm": CostKm, "CostWarehouse": CostWarehouse,
+              "WarehouseLimit": WarehouseLimit, "Seed": None}
+    largest = max(depots["x"].max(), depots["y"].max())
+
+    chunks = read_customers(customers_source, chunk_rows, customers_sheet, progress)
+    if path is None:
+        customers = []
+        for chunk in chunks:
+            customers.append(chunk)
+            largest = max(largest, chunk["x"].max(), chunk["y"].max())
+        customers = np.concatenate(customers) if customers else np.empty(0, dtype=CUSTOMER_DTYPE)
+        if GridSize is None:
+            params["GridSize"] = math.ceil(largest)
+        inst = Instance(customers, depots, **params)
+    else:
+        with InstanceWriter(path, depots, params) as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+                largest = max(largest, chunk["x"].max(), chunk["y"].max())
+            if GridSize is None:
+                writer.params["GridSize"] = math.ceil(largest)
+        inst = writer.instance()
+
+    if len(np.unique(inst.customers["id"])) != len(inst.customers):
+        raise ValueError("Customers: ids are not unique")
+
+    return inst
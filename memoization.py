@@ -0,0 +1,254 @@
+#Memoization of instance generation and solves across Streamlit reruns
+
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+
+from distances import distances_key
+from instance import customer_array, depot_array
+from miscellanious_functions import CreateInstance
+from p_algorithm import budget_params, lp_optimal, p_algorithm
+from parallel_solver import solve_scenarios
+from solution_store import SolutionStore
+
+class LRUCache:
+    '''
+    Least-recently-used cache bounded both by number of entries and by the pickled size of the stored values.
+    Values are stored pickled, so callers always get a private copy they can modify.
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=512*2**20):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Returns (True, value) on a hit and (False, None) on a miss.
+        '''
+
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return True, pickle.loads(data)
+
+    def put(self, key, value):
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # A value larger than the whole budget would only evict everything else
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._bytes += len(data)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self._entries),
+                    "bytes": self._bytes}
+
+# Shared caches, kept at module level so that they survive Streamlit reruns
+instance_cache = LRUCache(max_entries=64, max_bytes=256*2**20)
+solution_cache = LRUCache(max_entries=1024, max_bytes=512*2**20)
+
+# Solutions on disk, shared across sessions and reused for instances that only differ in CostKm or CostWarehouse
+solution_store = SolutionStore()
+
+def instance_key(inst):
+    '''
+    Fingerprint of everything a solve depends on: node coordinates, demands and the cost and capacity parameters.
+    An Instance and the CreateInstance dictionary it was built from have the same fingerprint.
+    '''
+
+    digest = hashlib.sha1()
+    digest.update(customer_array(inst).tobytes())
+    digest.update(depot_array(inst).tobytes())
+    digest.update(repr((inst["Divisible"], inst["CostKm"], inst["CostWarehouse"], inst["WarehouseLimit"])).encode())
+
+    return digest.hexdigest()
+
+def _params_key(params):
+
+    return tuple(sorted((params or {}).items()))
+
+def cached_create_instance(NoOfCustomers, NoOfRegionalDepots, Grid, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed):
+
+    key = (NoOfCustomers, NoOfRegionalDepots, Grid, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed)
+
+    hit, inst = instance_cache.get(key)
+    if not hit:
+        inst = CreateInstance(*key)
+        instance_cache.put(key, inst)
+
+    return inst
+
+def _solution_key(fingerprint, p_regional, params):
+
+    if p_regional is None:
+        return ("lp", fingerprint, params)
+    return ("p", fingerprint, p_regional, params)
+
+def _get_solution(inst, fingerprint, p_regional, params, distances=None):
+    '''
+    (True, solution) from the in-memory cache or else from the solution store, (False, None) if neither has it.
+    '''
+
+    key = _solution_key(fingerprint, p_regional, params)
+
+    hit, solution = solution_cache.get(key)
+    if hit:
+        return True, solution
+
+    solution = solution_store.get(inst, p_regional, params, distances)
+    if solution is None:
+        return False, None
+    solution_cache.put(key, solution)
+
+    return True, solution
+
+def _put_solution(inst, fingerprint, p_regional, params, solution):
+
+    solution_cache.put(_solution_key(fingerprint, p_regional, params), solution)
+    solution_store.put(inst, p_regional, params, solution)
+
+def cached_lp_optimal(inst, costs=None, params=None, time_limit=None, mip_gap=None):
+
+    fingerprint = instance_key(inst)
+    params_key = _params_key(budget_params(params, time_limit, mip_gap))
+
+    hit, solution = _get_solution(inst, fingerprint, None, params_key)
+    if not hit:
+        solution = lp_optimal(inst, costs, params, time_limit=time_limit, mip_gap=mip_gap)
+        _put_solution(inst, fingerprint, None, params_key, solution)
+
+    return solution
+
+def cached_p_algorithm(inst, p_regional, costs=None, params=None, time_limit=None, mip_gap=None):
+
+    fingerprint = instance_key(inst)
+    params_key = _params_key(budget_params(params, time_limit, mip_gap))
+
+    hit, solution = _get_solution(inst, fingerprint, p_regional, params_key)
+    if not hit:
+        solution = p_algorithm(inst, p_regional, costs, params, time_limit=time_limit, mip_gap=mip_gap)
+        _put_solution(inst, fingerprint, p_regional, params_key, solution)
+
+    return solution
+
+def _scenario_params(method, time_limit, mip_gap, multi_scenario=False, distances=None):
+
+    if method == "mip":
+        params = _params_key(budget_params(None, time_limit, mip_gap))
+    else:
+        params = ((method, time_limit),)
+    # The multi-scenario model solves the p values within their combined time limit, so its results are kept apart
+    if method == "mip" and multi_scenario:
+        params += (("multi_scenario", True),)
+    # Solutions on other than grid distances are kept apart; grid keys stay as they were
+    if distances_key(distances) is not None:
+        params += (("distances", distances_key(distances)),)
+    return params
+
+def lookup_scenarios(inst, p_values, method="mip", time_limit=None, mip_gap=None, multi_scenario=False, distances=None):
+    '''
+    (lp_solution, p_solutions) from the solution cache and store, or None unless every one of them is there.
+    multi_scenario tells whether the p values were solved as one multi-scenario model (SolveJob), which only affects them.
+    distances is the distances.DistanceBackend of the solves, None for grid distances.
+    '''
+
+    fingerprint = instance_key(inst)
+    params = _scenario_params(method, time_limit, mip_gap, distances=distances)
+    p_params = _scenario_params(method, time_limit, mip_gap, multi_scenario, distances)
+
+    hit, lp_solution = _get_solution(inst, fingerprint, None, params, distances)
+    if not hit:
+        return None
+
+    solutions = []
+    for p in p_values:
+        hit, solution = _get_solution(inst, fingerprint, p, p_params, distances)
+        if not hit:
+            return None
+        solutions.append(solution)
+
+    return lp_solution, solutions
+
+def store_scenarios(inst, p_values, lp_solution, p_solutions, method="mip", time_limit=None, mip_gap=None, multi_scenario=False,
+                    distances=None):
+    '''
+    Puts solutions computed elsewhere (e.g. by a background job) into the solution cache and store; lp_solution may be None.
+    Interrupted solves are not stored, since they depend on when they were stopped.
+    '''
+
+    fingerprint = instance_key(inst)
+    params = _scenario_params(method, time_limit, mip_gap, distances=distances)
+    p_params = _scenario_params(method, time_limit, mip_gap, multi_scenario, distances)
+
+    if lp_solution is not None and lp_solution["status"] != "interrupted":
+        _put_solution(inst, fingerprint, None, params, lp_solution)
+    for p, solution in zip(p_values, p_solutions):
+        if solution["status"] != "interrupted":
+            _put_solution(inst, fingerprint, p, p_params, solution)
+
+def cached_solve_scenarios(inst, p_values, include_lp=True, max_workers=None, method="mip", time_limit=None, mip_gap=None,
+                           distances=None):
+    '''
+    solve_scenarios that only dispatches the solves missing from the solution cache and store.
+    MIP entries on grid distances are shared with cached_lp_optimal and cached_p_algorithm.
+    '''
+
+    fingerprint = instance_key(inst)
+    params = _scenario_params(method, time_limit, mip_gap, distances=distances)
+
+    lp_solution = None
+    if include_lp:
+        lp_hit, lp_solution = _get_solution(inst, fingerprint, None, params, distances)
+    else:
+        lp_hit = True
+
+    solutions = {}
+    for p in dict.fromkeys(p_values):
+        hit, solution = _get_solution(inst, fingerprint, p, params, distances)
+        if hit:
+            solutions[p] = solution
+    missing = [p for p in dict.fromkeys(p_values) if p not in solutions]
+
+    if missing or not lp_hit:
+        new_lp, new_solutions = solve_scenarios(inst, missing, not lp_hit, max_workers, method, time_limit, mip_gap, distances)
+        store_scenarios(inst, missing, new_lp, new_solutions, method, time_limit, mip_gap, distances=distances)
+        if not lp_hit:
+            lp_solution = new_lp
+        solutions.update(zip(missing, new_solutions))
+
+    return lp_solution, [solutions[p] for p in p_values]
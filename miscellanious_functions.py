@@ -1,8 +1,10 @@
 import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+import numpy as np
+from instance import customer_array, depot_array
 import random
 import statistics
 import pandas as pd
-from openpyxl import Workbook
 import time
 
 def CreateInstance(NoOfCustomers, NoOfRegionalDepots, Grid, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed):
@@ -44,10 +46,13 @@ def CreateInstance(NoOfCustomers, NoOfRegionalDepots, Grid, Divisible, CostKm, C
     # all_Customers and All_Nodes are lists of lists. Format is [id, x, y].   
 
 
-def SolutionPlot(inst, solution):
+# Above this many customers SolutionPlot aggregates the customers into a demand density instead of drawing every one of them
+PLOT_MAX_CUSTOMERS = 20000
 
-    all_Customers = inst["allCustomers"]
-    all_Depots = inst["allDepots"]
+def SolutionPlot(inst, solution, max_customers=PLOT_MAX_CUSTOMERS):
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
     GridSize = inst["GridSize"]
     Divisible = inst["Divisible"]
 
@@ -56,37 +61,45 @@ def SolutionPlot(inst, solution):
 
     '''
     This function creates a "matplotlib" figure with the MDVRP solution.
+    Customers and depots are drawn as a few scatter collections with colors computed in NumPy.
+    With more than max_customers customers, the customers are shown as a hexbin of their demand (level of detail).
     '''
     fig, ax = plt.subplots(figsize=(8, 6))  # same for both functions
 
     all_colors = ['yellow', 'red', 'green', 'blue', 'purple', 'orange', 'pink', 'brown', 'gray', 'olive', 'cyan', 'magenta', 'lime', 'teal', 'indigo', 'maroon', 'navy', 'peru', 'rosybrown', 'sienna', 'tan', 'darkorange', 'gold', 'darkkhaki', 'olivedrab', 'yellowgreen', 'darkseagreen', 'lightseagreen', 'darkcyan', 'deepskyblue', 'dodgerblue', 'royalblue', 'blueviolet', 'darkorchid', 'mediumvioletred', 'crimson', 'firebrick', 'darkred', 'darkslategray', 'dimgray', 'black']
-    
+    palette = mcolors.to_rgba_array(all_colors)
+
+    def depot_colors(depot_ids):
+        # Depot ids start at 1001; the palette repeats beyond its length
+        return palette[(np.asarray(depot_ids) - 1000) % len(palette)]
+
+    central = np.asarray(depots["central"], dtype=bool)
+
     #Plot the customers with circles (the size of the circle is proportional to the demand and the color is proportional to the depot)
-    if Divisible:
-        for customer in all_Customers:
-            assigned_depots = assigned_customers[customer[0]]
-            if len(assigned_depots) == 1:
-                ax.plot(customer[1], customer[2], 'o', markersize=customer[3]*10, color=all_colors[assigned_depots[0]-1000])
-            else:
-                # Plot the circle with the color of all depots (half for each depot)
-                ax.plot(customer[1], customer[2], 'o', markersize=customer[3]*10, color=all_colors[assigned_depots[0]-1000], alpha=0.5)
-                ax.plot(customer[1], customer[2], 'o', markersize=customer[3]*10, color=all_colors[assigned_depots[1]-1000], alpha=0.5)
-    else:
-        for customer in all_Customers:
-            ax.plot(customer[1], customer[2], 'o', markersize=customer[3]*10, color=all_colors[assigned_customers[customer[0]]-1000])
+    if len(customers) > max_customers:
+        ax.hexbin(customers["x"], customers["y"], C=customers["demand"], reduce_C_function=np.sum,
+                  gridsize=100, extent=(0, GridSize, 0, GridSize), cmap='Greys', mincnt=1)
+    elif len(customers) and assigned_customers:
+        if Divisible:
+            # A customer split between depots is drawn once per depot (the first two) with half opacity
+            assigned = [assigned_customers[i] for i in customers["id"].tolist()]
+            first = [depots_of[0] for depots_of in assigned]
+            second = [depots_of[1] if len(depots_of) > 1 else 0 for depots_of in assigned]
+            split = np.array(second) > 0
+            marks = np.column_stack([np.ones(len(customers), dtype=bool), split]).ravel()
+            rows = np.repeat(np.arange(len(customers)), 1 + split)
+            colors = depot_colors(np.column_stack([first, second]).ravel()[marks])
+            colors[:, 3] = np.where(split[rows], 0.5, 1.0)
+        else:
+            rows = np.arange(len(customers))
+            colors = depot_colors([assigned_customers[i] for i in customers["id"].tolist()])
+
+        ax.scatter(customers["x"][rows], customers["y"][rows], s=(customers["demand"][rows]*10)**2, c=colors, marker='o', linewidths=1.0, edgecolors='face')
 
     #Plot the depots with squares
-    for depot in all_Depots:
-        if depot[3] == True:
-            if depot[0] in used_warehouses:
-                ax.plot(depot[1], depot[2], 'D', markersize=20, color=all_colors[depot[0]-1000])  # Diamond shape
-            else:
-                ax.plot(depot[1], depot[2], 'D', markersize=20, color='black')  # Diamond shape
-        else:
-            if depot[0] in used_warehouses:
-                ax.plot(depot[1], depot[2], 'ks', markersize=15, color=all_colors[depot[0]-1000])
-            else:
-                ax.plot(depot[1], depot[2], 'ks', markersize=15, color='black')
+    colors = np.where(np.isin(depots["id"], used_warehouses)[:, None], depot_colors(depots["id"]), mcolors.to_rgba('black'))
+    ax.scatter(depots["x"][central], depots["y"][central], s=20**2, c=colors[central], marker='D', linewidths=1.0, edgecolors='face')  # Diamond shape
+    ax.scatter(depots["x"][~central], depots["y"][~central], s=15**2, c=colors[~central], marker='s', linewidths=1.0, edgecolors='face')
 
     # Show the plot.
     fig.set_size_inches(8, 8)
@@ -99,7 +112,8 @@ def SolutionPlot(inst, solution):
     legend_elements = [
         plt.Line2D([0], [0], marker='D', color='w', label='Central depot', markerfacecolor='black', markersize=10),
         plt.Line2D([0], [0], marker='s', color='w', label='Regional depot', markerfacecolor='black', markersize=10),
-        plt.Line2D([0], [0], marker='o', color='w', label='Customer', markerfacecolor='black', markersize=10)
+        plt.Line2D([0], [0], marker='h' if len(customers) > max_customers else 'o', color='w',
+                   label='Customer demand' if len(customers) > max_customers else 'Customer', markerfacecolor='black', markersize=10)
     ]
     ax.legend(handles=legend_elements, loc='lower center')
 
@@ -1,206 +1,1021 @@
 #p algorithm for facility location
 
+import itertools
+import threading
+import time
+
 import gurobipy as gp
 from gurobipy import GRB
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+
+from instance import CUSTOMER_DTYPE, PARAMETERS, Instance, customer_array, depot_array
+from profiling import finish_profile, new_profile, phase
+
+# Divisible assignments below this fraction of a customer are solver noise, not splits
+FRACTION_TOL = 1e-6
+
+def round2(values):
+    '''
+    Vectorized round(v, 2) that agrees with Python's built-in round, which resolves ties on the exact binary value.
+    '''
+
+    rounded = np.round(values, 2)
+    scaled = values*100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        ties, inverse = np.unique(values[near_tie], return_inverse=True)
+        rounded[near_tie] = np.array([round(v, 2) for v in ties.tolist()])[inverse]
+    return rounded
+
+def cost_matrix(inst):
+    '''
+    Builds the customer x depot distance and cost arrays in one vectorized pass.
+    Rows follow the customers and columns follow the depots of the instance (an Instance or a CreateInstance dictionary).
+    Customer-customer and depot-depot pairs are never read by the models, so they are not computed.
+    '''
+
+    CostKm = inst["CostKm"]
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+
+    dx = customers["x"][:, None] - depots["x"][None, :]
+    dy = customers["y"][:, None] - depots["y"][None, :]
+
+    return _price(dx, dy, CostKm)
+
+def pair_costs(inst, pair_customer, pair_depot):
+    '''
+    Costs of the given customer/depot pairs (positions in the customer and depot arrays of inst), equal to the entries of
+    cost_matrix(inst)["cost"] without building the whole matrix.
+    '''
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+
+    dx = customers["x"][pair_customer] - depots["x"][pair_depot]
+    dy = customers["y"][pair_customer] - depots["y"][pair_depot]
+
+    return _price(dx, dy, inst["CostKm"])["cost"]
+
+def _price(dx, dy, CostKm):
+
+    # Distances and costs are rounded to cents, so that every solver sees the same costs
+    dist = round2(np.sqrt(dx**2 + dy**2))
+    cost = round2(CostKm*dist)
+
+    return {"dist": dist, "cost": cost}
+
+def nearest_candidates(inst, k_nearest, extra=None):
+    '''
+    Customer/depot candidate pairs for the sparse model: every customer keeps its k_nearest depots plus the central depot.
+    Depot coordinates go into a KD-tree, so the cost is linear in the number of customers.
+    extra is an optional iterable of (customer, depot) positions to keep as well.
+    Returns an array with one sorted (customer, depot) row of positions in the customer and depot arrays per pair.
+    '''
+
+    customers = customer_array(inst)
+    depots = depot_array(inst)
+    n_customers, n_depots = len(customers), len(depots)
+
+    customers_xy = np.column_stack([customers["x"], customers["y"]])
+    depots_xy = np.column_stack([depots["x"], depots["y"]])
+    central = np.flatnonzero(depots["central"])
+
+    k_nearest = min(k_nearest, n_depots)
+    _, nearest = cKDTree(depots_xy).query(customers_xy, k=k_nearest)
+    nearest = np.asarray(nearest).reshape(n_customers, k_nearest)
+
+    keep = np.zeros((n_customers, n_depots), dtype=bool)
+    keep[np.arange(n_customers)[:, None], nearest] = True
+    keep[:, central] = True
+    if extra is not None:
+        for a, b in extra:
+            keep[a, b] = True
+
+    return np.argwhere(keep)
+
+def build_model(inst, costs=None, p_regional=None, params=None, candidates=None):
+    '''
+    Builds the 2E-FLAP model for an instance without optimizing it.
+    With p_regional, the warehouse cost is left out of the objective and exactly p_regional regional depots are opened.
+    params is an optional dictionary of Gurobi parameters, e.g. {"Threads": 2}.
+    candidates is an optional array of (customer, depot) positions, as returned by nearest_candidates; x only exists for those pairs.
+    Returns the model and a dictionary with the variables and constraints the callers need.
+    '''
 
-def lp_optimal(inst):
-    
     # Extracting the data from the instance
 
-    all_Customers = inst["allCustomers"]
-    all_Depots = inst["allDepots"]
-    all_Nodes = inst["allNodes"]
-    Seed = inst["Seed"]
+    customers = customer_array(inst)
+    depots = depot_array(inst)
     Divisible = inst["Divisible"]
-    CostKm = inst["CostKm"]
     CostWarehouse = inst["CostWarehouse"]
     WarehouseLimit = inst["WarehouseLimit"]
 
     # Create sets
 
-    N_customers = [i[0] for i in all_Customers] # Set of customers
-    N_depots = [i[0] for i in all_Depots] # Set of depots
-    N = N_customers + N_depots # Set of all nodes
-
+    N_customers = customers["id"].tolist() # Set of customers
+    N_depots = depots["id"].tolist() # Set of depots
+    n_customers, n_depots = len(N_customers), len(N_depots)
 
-    # Create a dictionary to store the Euclidean distance between nodes
+    # Customer x depot cost array (rows follow N_customers, columns follow N_depots)
 
-    dist = {(i[0], j[0]): round(((i[1]-j[1])**2 + (i[2]-j[2])**2)**0.5, 2) for i in all_Nodes for j in all_Nodes if i[0] != j[0]}
-    cost = {(i[0], j[0]): round(CostKm*dist[i[0], j[0]], 2) for i in all_Nodes for j in all_Nodes if i != j}
-    time = {(i[0], j[0]): round(dist[i[0], j[0]]/30, 2) for i in all_Nodes for j in all_Nodes if i != j}
+    if costs is None:
+        costs = cost_matrix(inst)
+    cost = costs["cost"]
 
-    # Create a dictionary to store the demand of each customer
-    demand = {i[0]: i[3] for i in all_Customers}
+    # Demand of each customer, capacity of each depot and whether the depot is central
+    demand = np.asarray(customers["demand"], dtype=float)
+    central = np.asarray(depots["central"], dtype=bool)
+    capacity = np.where(central, WarehouseLimit, 10000).astype(float)
 
-    # Create a dictionary to store the capacity of each depot
-    capacity = {i[0]: WarehouseLimit if i[3] == True else 10000 for i in all_Depots}
-
-    #Create a binary variable to indicate if the depot is central
-    central = {i[0]: 1 if i[3] == True else 0 for i in all_Depots}
+    # Customer/depot pairs that get an assignment variable, by position in N_customers and N_depots
+    if candidates is None:
+        pair_customer = np.repeat(np.arange(n_customers), n_depots)
+        pair_depot = np.tile(np.arange(n_depots), n_customers)
+    else:
+        pair_customer, pair_depot = np.array(candidates, dtype=int).reshape(-1, 2).T
+    n_pairs = len(pair_customer)
+    pair_cost = cost[pair_customer, pair_depot]
+    pair_central = central[pair_depot]
 
     # Decision variables
 
     m = gp.Model("p_algorithm")
+    for name, value in (params or {}).items():
+        m.setParam(name, value)
+
+    # Read by solver callbacks to tell the solves of a sweep apart
+    m._p_regional = p_regional
+
     if Divisible:
-        x = m.addVars(N_customers, N_depots, vtype=GRB.CONTINUOUS, name="x")
+        x = m.addMVar(n_pairs, vtype=GRB.CONTINUOUS, name="x")
     else:
-        x = m.addVars(N_customers, N_depots, vtype=GRB.BINARY, name="x")
-    y = m.addVars(N_depots, vtype=GRB.BINARY, name="y")
+        x = m.addMVar(n_pairs, vtype=GRB.BINARY, name="x")
+    y = m.addMVar(n_depots, vtype=GRB.BINARY, name="y")
     inbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="inbound_cost")
     outbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="outbound_cost")
     warehouse_cost = m.addVar(vtype=GRB.CONTINUOUS, name="warehouse_cost")
 
     # Objective function
 
-    m.setObjective(inbound_cost + outbound_cost + warehouse_cost, GRB.MINIMIZE)
+    if p_regional is None:
+        m.setObjective(inbound_cost + outbound_cost + warehouse_cost, GRB.MINIMIZE)
+    else:
+        m.setObjective(inbound_cost + outbound_cost, GRB.MINIMIZE)
 
     # Constraints
 
-    m.addConstrs(gp.quicksum(x[i, j] for j in N_depots) == 1 for i in N_customers)
+    pair_index = np.arange(n_pairs)
+    assignment_matrix = sp.csr_matrix((np.ones(n_pairs), (pair_customer, pair_index)), shape=(n_customers, n_pairs))
+    load_matrix = sp.csr_matrix((demand[pair_customer], (pair_depot, pair_index)), shape=(n_depots, n_pairs))
 
-    m.addConstrs(gp.quicksum(x[i, j]*demand[i] for i in N_customers) <= capacity[j] * y[j] for j in N_depots)
+    assignment_constraints = m.addMConstr(assignment_matrix, x, "=", np.ones(n_customers))
 
-    m.addConstr(inbound_cost == gp.quicksum(cost[i, j] * x[i, j] for i in N_customers for j in N_depots if central[j] == 0))
+    capacity_constraints = m.addConstr(load_matrix @ x - sp.diags(capacity) @ y <= 0)
 
-    m.addConstr(outbound_cost == gp.quicksum(cost[i, j] * x[i, j] for i in N_customers for j in N_depots if central[j] == 1))
-
-    m.addConstr(warehouse_cost == gp.quicksum(CostWarehouse * y[j] for j in N_depots))
+    if p_regional is None:
+        p_constraint = None
+    else:
+        p_constraint = m.addMConstr((~central).astype(float)[None, :], y, "=", np.array([p_regional]))
+
+    inbound_constraint = m.addConstr(np.where(pair_central, 0, pair_cost) @ x - inbound_cost == 0)
+
+    outbound_constraint = m.addConstr(np.where(pair_central, pair_cost, 0) @ x - outbound_cost == 0)
+
+    warehouse_constraint = m.addConstr(np.full(n_depots, float(CostWarehouse)) @ y - warehouse_cost == 0)
+
+    model_vars = {"x": x,
+                  "y": y,
+                  "inbound_cost": inbound_cost,
+                  "outbound_cost": outbound_cost,
+                  "warehouse_cost": warehouse_cost,
+                  "p_constraint": p_constraint,
+                  "assignment_constraints": assignment_constraints,
+                  "capacity_constraints": capacity_constraints,
+                  "inbound_constraint": inbound_constraint,
+                  "outbound_constraint": outbound_constraint,
+                  "warehouse_constraint": warehouse_constraint,
+                  "pair_customer": pair_customer,
+                  "pair_depot": pair_depot,
+                  "N_customers": N_customers,
+                  "N_depots": N_depots,
+                  "central": central,
+                  "cost": cost,
+                  "Divisible": Divisible}
+
+    return m, model_vars
+
+# Solver outcome reported in every solution dictionary
+STATUS_NAMES = {GRB.OPTIMAL: "optimal",
+                GRB.INFEASIBLE: "infeasible",
+                GRB.INF_OR_UNBD: "infeasible",
+                GRB.TIME_LIMIT: "time_limit",
+                GRB.INTERRUPTED: "interrupted",
+                GRB.NODE_LIMIT: "node_limit",
+                GRB.SOLUTION_LIMIT: "solution_limit",
+                GRB.SUBOPTIMAL: "suboptimal"}
+
+def budget_params(params=None, time_limit=None, mip_gap=None):
+    '''
+    Adds a solve budget (TimeLimit, in seconds) and a target relative gap (MIPGap) to a dictionary of Gurobi parameters.
+    '''
+
+    params = dict(params or {})
+    if time_limit is not None:
+        params["TimeLimit"] = time_limit
+    if mip_gap is not None:
+        params["MIPGap"] = mip_gap
+    return params
+
+def _assignment(model_vars, x_values, y_values):
+    '''
+    assigned_customers and used_warehouses of a solution from the values of x and y.
+    '''
+
+    N_customers = model_vars["N_customers"]
+    N_depots = model_vars["N_depots"]
+
+    used_warehouses = [N_depots[b] for b in np.flatnonzero(y_values == 1)] + [1001]
+
+    if model_vars["Divisible"]:
+        assigned_customers = {i: [] for i in N_customers}
+        selected = np.flatnonzero(x_values > FRACTION_TOL)
+        for a, b in zip(model_vars["pair_customer"][selected].tolist(), model_vars["pair_depot"][selected].tolist()):
+            assigned_customers[N_customers[a]].append(N_depots[b])
+    else:
 
-    #m.addConstr(gp.quicksum(y[j] for j in N_depots if central[j] == 0) == 0)
+        # Create a dictionary to store the solution
+        selected = np.flatnonzero(x_values == 1)
+        assigned_customers = {N_customers[a]: N_depots[b] for a, b in zip(model_vars["pair_customer"][selected].tolist(), model_vars["pair_depot"][selected].tolist())}
 
-    # Optimize the model
+    return assigned_customers, used_warehouses
 
-    m.optimize()
+def extract_solution(m, model_vars):
+    '''
+    Reads the solution dictionary used by SolutionPlot and PComparisonPlot from an optimized model.
+    x and y are fetched in one attribute call each. When the solve stopped early (time limit, interruption) the best
+    incumbent is returned; "status", "best_bound", "gap" and "node_count" tell how good it is.
+    Without any incumbent the assignment is empty and every cost is 0.
+    '''
 
-    if m.status == GRB.INFEASIBLE:
+    if m.SolCount == 0:
         solution = {"assigned_customers": {},
                 "used_warehouses": [],
                 "inbound_cost": 0,
                 "outbound_cost": 0,
                 "warehouse_cost": 0,
-                "total_cost": 0}
+                "total_cost": 0,
+                "best_bound": None,
+                "gap": None}
     else:
 
-        if Divisible:
-            solution = {"assigned_customers": {i: [j for j in N_depots if x[i, j].x > 0] for i in N_customers},
-                        "used_warehouses": [j for j in N_depots if y[j].x == 1] + [1001],
-                        "inbound_cost": inbound_cost.x,
-                        "outbound_cost": outbound_cost.x,
-                        "warehouse_cost": warehouse_cost.x,
-                        "total_cost": m.objVal}
-        else:
+        assigned_customers, used_warehouses = _assignment(model_vars, model_vars["x"].X, model_vars["y"].X)
 
-            # Create a dictionary to store the solution
-            solution = {"assigned_customers": {i: j for i in N_customers for j in N_depots if x[i, j].x == 1},
-                        "used_warehouses": [j for j in N_depots if y[j].x == 1] + [1001],
-                        "inbound_cost": inbound_cost.x,
-                        "outbound_cost": outbound_cost.x,
-                        "warehouse_cost": warehouse_cost.x,
-                        "total_cost": m.objVal}
+        solution = {"assigned_customers": assigned_customers,
+                    "used_warehouses": used_warehouses,
+                    "inbound_cost": model_vars["inbound_cost"].x,
+                    "outbound_cost": model_vars["outbound_cost"].x,
+                    "warehouse_cost": model_vars["warehouse_cost"].x,
+                    "total_cost": m.objVal,
+                    "best_bound": m.ObjBound,
+                    "gap": m.MIPGap}
+
+    solution["status"] = STATUS_NAMES.get(m.status, f"status_{m.status}")
+    solution["node_count"] = int(m.NodeCount)
 
     return solution
 
-def p_algorithm(inst, p_regional):
+def _optimize(m, callback=None, profile=None):
+    '''
+    m.optimize(callback), recording in profile the solve time, the presolve time (runtime at the last presolve callback)
+    and the model size.
+    '''
 
-    # Extracting the data from the instance
+    presolve = []
 
-    all_Customers = inst["allCustomers"]
-    all_Depots = inst["allDepots"]
-    all_Nodes = inst["allNodes"]
-    GridSize = inst["GridSize"]
-    Seed = inst["Seed"]
-    Divisible = inst["Divisible"]
-    CostKm = inst["CostKm"]
-    CostWarehouse = inst["CostWarehouse"]
-    WarehouseLimit = inst["WarehouseLimit"]
+    def timed(model, where):
+        if where == GRB.Callback.PRESOLVE:
+            presolve.append(model.cbGet(GRB.Callback.RUNTIME))
+        if callback is not None:
+            callback(model, where)
 
-    # Create sets
+    with phase(profile, "solve"):
+        m.optimize(timed)
 
-    N_customers = [i[0] for i in all_Customers] # Set of customers
-    N_depots = [i[0] for i in all_Depots] # Set of depots
-    N = N_customers + N_depots # Set of all nodes
+    if presolve:
+        profile["presolve"] = (profile["presolve"] or 0.0) + presolve[-1]
+    profile["rows"], profile["columns"], profile["nonzeros"] = m.NumConstrs, m.NumVars, m.NumNZs
 
+def _extract(m, model_vars, profile):
 
-    # Create a dictionary to store the Euclidean distance between nodes
+    with phase(profile, "extract"):
+        return extract_solution(m, model_vars)
 
+def _lagrangian_bound(reduced_cost, multipliers, capacity, central, warehouse, p_regional):
+    '''
+    Lower bound of the full model with the capacity constraints relaxed by multipliers (one per depot, >= 0).
+    reduced_cost is cost + multiplier * demand for every customer/depot pair.
+    '''
 
-    dist = {(i[0], j[0]): round(((i[1]-j[1])**2 + (i[2]-j[2])**2)**0.5, 2) for i in all_Nodes for j in all_Nodes if i[0] != j[0]}
-    cost = {(i[0], j[0]): round(CostKm*dist[i[0], j[0]], 2) for i in all_Nodes for j in all_Nodes if i != j}
-    time = {(i[0], j[0]): round(dist[i[0], j[0]]/30, 2) for i in all_Nodes for j in all_Nodes if i != j}
+    depot_term = warehouse - multipliers*capacity
 
-    # Create a dictionary to store the demand of each customer
-    demand = {i[0]: i[3] for i in all_Customers}
+    if p_regional is None:
+        depot_bound = np.minimum(depot_term, 0).sum()
+    else:
+        depot_bound = np.minimum(depot_term[central], 0).sum() + np.sort(depot_term[~central])[:p_regional].sum()
 
-    # Create a dictionary to store the capacity of each depot
-    capacity = {i[0]: WarehouseLimit if i[3] == True else 10000 for i in all_Depots}
+    return reduced_cost.min(axis=1).sum() + depot_bound
 
-    #Create a binary variable to indicate if the depot is central
-    central = {i[0]: 1 if i[3] == True else 0 for i in all_Depots}
+def _knapsack_relaxation(reduced_cost, demand, capacity, central, fixed_cost, p_regional):
+    '''
+    Inner problem of the Lagrangian relaxation of the assignment constraints, for reduced costs cost - multiplier.
+    Every depot serves, as a continuous knapsack, the customers with negative reduced cost in order of reduced cost per unit
+    of demand; depots are opened when that is worth their fixed cost (exactly p_regional regional depots in the p variant).
+    Returns the optimal value and how much of every customer is served.
+    '''
 
-    # Decision variables
+    n_customers, n_depots = reduced_cost.shape
 
-    m = gp.Model("p_algorithm")
+    rows, cols = np.nonzero(reduced_cost < 0)
+    values = reduced_cost[rows, cols]
+    pair_demand = demand[rows]
 
-    if Divisible:
-        x = m.addVars(N_customers, N_depots, vtype=GRB.CONTINUOUS, name="x")
+    order = np.lexsort((values/np.maximum(pair_demand, 1e-12), cols))
+    rows, cols, values, pair_demand = rows[order], cols[order], values[order], pair_demand[order]
+
+    # Demand already packed into the depot before each pair
+    cumulative = np.cumsum(pair_demand)
+    group_start = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]]) if len(cols) else np.array([], dtype=int)
+    before = cumulative - pair_demand - np.repeat(cumulative[group_start] - pair_demand[group_start], np.diff(np.r_[group_start, len(cols)]))
+    fraction = np.where(pair_demand > 0, np.clip((capacity[cols] - before)/np.maximum(pair_demand, 1e-12), 0, 1), 1)
+
+    depot_value = fixed_cost + np.bincount(cols, weights=values*fraction, minlength=n_depots)
+
+    if p_regional is None:
+        opened = depot_value < 0
     else:
-        x = m.addVars(N_customers, N_depots, vtype=GRB.BINARY, name="x")
-    y = m.addVars(N_depots, vtype=GRB.BINARY, name="y")
-    inbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="inbound_cost")
-    outbound_cost = m.addVar(vtype=GRB.CONTINUOUS, name="outbound_cost")
-    warehouse_cost = m.addVar(vtype=GRB.CONTINUOUS, name="warehouse_cost")
+        regional = np.flatnonzero(~central)
+        opened = central & (depot_value < 0)
+        opened[regional[np.argsort(depot_value[regional], kind="stable")[:p_regional]]] = True
 
-    # Objective function
+    served = np.bincount(rows, weights=fraction*opened[cols], minlength=n_customers)
 
-    m.setObjective(inbound_cost + outbound_cost, GRB.MINIMIZE)
+    return depot_value[opened].sum(), served
 
-    # Constraints
+def lagrangian_lower_bound(cost, demand, capacity, central, warehouse, p_regional, upper_bound, deadline, max_iterations=200):
+    '''
+    Lower bound of the full model (lp_optimal with p_regional None, p_algorithm otherwise) from the Lagrangian relaxation of
+    the assignment constraints, with multipliers improved by subgradient steps towards upper_bound until deadline.
+    The bound holds for divisible and indivisible demand alike.
+    '''
+
+    fixed_cost = np.full(cost.shape[1], float(warehouse))
+    multipliers = cost.min(axis=1)
+    best = -np.inf
+    step, stall = 2.0, 0
+
+    for _ in range(max_iterations):
+
+        value, served = _knapsack_relaxation(cost - multipliers[:, None], demand, capacity, central, fixed_cost, p_regional)
+        bound = multipliers.sum() + value
+
+        if best == -np.inf or bound > best + 1e-9*max(1, abs(best)):
+            best, stall = bound, 0
+        else:
+            stall += 1
+            if stall >= 5:
+                step, stall = step/2, 0
+
+        subgradient = 1 - served
+        norm = (subgradient**2).sum()
+        if norm < 1e-12 or step < 1e-4 or time.perf_counter() > deadline:
+            break
+        multipliers = multipliers + step*max(upper_bound - bound, 1e-6)/norm*subgradient
+
+    return best
+
+def _pruned_solve(inst, costs, p_regional, params, k_nearest, callback, profile):
+    '''
+    Solves the model restricted to the k_nearest depots of every customer (plus the central depot) and grows the candidate set when needed.
+    An infeasible restricted model doubles k_nearest. Otherwise the restricted optimum is checked against all pairs:
+    the Lagrangian bound from the capacity duals of its LP relaxation may prove it optimal; if not, pairs to an open depot
+    that beat the customer's current (priced) assignment, or pairs to the depots of a cheaper design found by local search,
+    are added and the model is solved again. When neither check finds anything to add, k_nearest doubles, so the loop ends
+    at the latest with the full model.
+    The best incumbent over the rounds seeds every new round (its pairs stay candidates) and is what is returned, with the best
+    Lagrangian bound as best bound: the bound of a restricted model does not hold for the full one.
+    A TimeLimit in params bounds the whole loop rather than each solve; an incumbent that is not proven optimal when it runs
+    out is returned with status "heuristic" (or the status of its solve when that stopped early).
+    The phases of every round add up in profile, which also counts the rounds; the optimality checks go into "pricing".
+    '''
+
+    params = dict(params or {})
+    deadline = time.perf_counter() + params.get("TimeLimit", float("inf"))
+
+    profile["rounds"] = 0
+
+    cost = costs["cost"]
+    demand = np.asarray(customer_array(inst)["demand"], dtype=float)
+    central = np.asarray(depot_array(inst)["central"], dtype=bool)
+    capacity = np.where(central, inst["WarehouseLimit"], 10000).astype(float)
+    warehouse = inst["CostWarehouse"] if p_regional is None else 0
+    n_depots = len(central)
+
+    # Bound of the full model without multipliers, so a valid bound is reported even if no round gets to pricing
+    lower = _lagrangian_bound(cost, np.zeros(n_depots), capacity, central, warehouse, p_regional)
+
+    extra = set()
+    best = None # (solution, pair customers, pair depots, their x values, y values) of the best incumbent so far
+
+    def finish(solution, proven=False):
+        solution = dict(solution)
+        if proven:
+            solution["status"] = "optimal"
+        elif solution["status"] == "optimal":
+            solution["status"] = "heuristic"
+        solution["best_bound"] = min(lower, solution["total_cost"])
+        solution["gap"] = (solution["total_cost"] - solution["best_bound"])/max(abs(solution["total_cost"]), 1e-10)
+        return solution
+
+    while True:
+
+        if "TimeLimit" in params:
+            params["TimeLimit"] = max(0.0, deadline - time.perf_counter())
+
+        profile["rounds"] += 1
+        with phase(profile, "build"):
+            candidates = nearest_candidates(inst, k_nearest, extra)
+            m, model_vars = build_model(inst, costs, p_regional, params, candidates)
+            if best is not None:
+                _seed(model_vars, n_depots, *best[1:])
+            m.update()
+        _optimize(m, callback, profile)
+
+        full = k_nearest >= n_depots
+        if m.SolCount > 0 and (best is None or m.objVal < best[0]["total_cost"] - 1e-6*max(1, abs(m.objVal))):
+            solution = _extract(m, model_vars, profile)
+            x_values = model_vars["x"].X
+            used = np.flatnonzero(x_values > 0)
+            best = (solution, model_vars["pair_customer"][used], model_vars["pair_depot"][used], x_values[used], np.round(model_vars["y"].X))
+            extra.update(zip(best[1].tolist(), best[2].tolist()))
+
+        # With every depot a candidate the model is the full one and its bound holds
+        if full:
+            if best is None or m.status == GRB.OPTIMAL:
+                return _extract(m, model_vars, profile)
+            if m.SolCount > 0:
+                lower = max(lower, m.ObjBound)
+            return finish(best[0])
+
+        if m.status in (GRB.INFEASIBLE, GRB.INF_OR_UNBD) and time.perf_counter() < deadline:
+            k_nearest = min(2*k_nearest, n_depots)
+            continue
+        if m.SolCount == 0:
+            return _extract(m, model_vars, profile) if best is None else finish(best[0])
+
+        with phase(profile, "pricing"):
+            bound, missing = _missing_pairs(inst, m, model_vars, costs, demand, capacity, central, warehouse, p_regional, deadline)
+        lower = max(lower, bound)
+        if lower >= best[0]["total_cost"] - 1e-6*max(1, abs(best[0]["total_cost"])):
+            return finish(best[0], proven=True)
+
+        if time.perf_counter() >= deadline:
+            return finish(best[0])
+
+        if missing.any():
+            extra.update(zip(*np.nonzero(missing)))
+        else:
+            # Nothing to add, yet nothing proven: the restricted optimum may still miss pairs, so the candidates widen
+            k_nearest = min(2*k_nearest, n_depots)
+
+def _seed(model_vars, n_depots, pair_customer, pair_depot, x_values, y_values):
+    '''
+    Sets the x/y Start of a restricted model to an incumbent of an earlier round, given by its used pairs (customer and depot
+    positions) with their x values and the y values. Every used pair must be a candidate of the model.
+    '''
+
+    keys = model_vars["pair_customer"]*n_depots + model_vars["pair_depot"]
+    order = np.argsort(keys, kind="stable")
+    position = order[np.searchsorted(keys[order], pair_customer*n_depots + pair_depot)]
+
+    start = np.zeros(len(keys))
+    start[position] = x_values
+    model_vars["x"].Start = start
+    model_vars["y"].Start = y_values
+
+def _missing_pairs(inst, m, model_vars, costs, demand, capacity, central, warehouse, p_regional, deadline):
+    '''
+    Optimality checks of _pruned_solve for a restricted optimum. Returns the Lagrangian lower bound of the full model and
+    None when that bound proves the restricted optimum optimal, otherwise a boolean customer x depot array of the pairs to
+    add (empty when nothing is found).
+    '''
+
+    cost = costs["cost"]
+
+    # Capacity multipliers from the LP relaxation of the restricted model; the copy keeps the parameters of m, so the time
+    # limit that is nearly used up by the rounds is lifted (without duals the multipliers are 0 and the bound still holds)
+    relaxed = m.relax()
+    relaxed.Params.TimeLimit = GRB.INFINITY
+    relaxed.optimize()
+    if relaxed.status == GRB.OPTIMAL:
+        relaxed_constrs = relaxed.getConstrs()
+        multipliers = np.maximum(0.0, -np.array(relaxed.getAttr("Pi", [relaxed_constrs[c.index] for c in model_vars["capacity_constraints"].tolist()])))
+    else:
+        multipliers = np.zeros(cost.shape[1])
+
+    reduced_cost = cost + multipliers[None, :]*demand[:, None]
+    bound = _lagrangian_bound(reduced_cost, multipliers, capacity, central, warehouse, p_regional)
+    if bound >= m.objVal - 1e-6*max(1, abs(m.objVal)):
+        return bound, None
 
-    m.addConstrs(gp.quicksum(x[i, j] for j in N_depots) == 1 for i in N_customers)
+    # Pairs to an open depot that are cheaper than what the customer pays now show the restricted optimum is not optimal
+    rows, cols = model_vars["pair_customer"], model_vars["pair_depot"]
+    in_model = np.zeros(cost.shape, dtype=bool)
+    in_model[rows, cols] = True
+    x_values = np.zeros(cost.shape)
+    x_values[rows, cols] = model_vars["x"].X
+    opened = model_vars["y"].X > 0.5
+    current = (reduced_cost*x_values).sum(axis=1)
 
-    m.addConstrs(gp.quicksum(x[i, j] * demand[i] for i in N_customers) <= capacity[j] * y[j] for j in N_depots)
+    missing = ~in_model & opened[None, :] & (reduced_cost < current[:, None] - 1e-6)
 
-    m.addConstr(gp.quicksum(y[j] for j in N_depots if central[j] == 0) == p_regional)
+    # A better design found by local search over all pairs is a witness that the restricted optimum is not optimal
+    if not missing.any() and time.perf_counter() < deadline:
+        from heuristic import improve_design # heuristic imports this module
+        witness_open, _, witness_value = improve_design(inst, opened, p_regional, costs, min(1.0, deadline - time.perf_counter()))
+        if witness_value < m.objVal - 1e-6*max(1, abs(m.objVal)):
+            missing = ~in_model & witness_open[None, :]
 
-    m.addConstr(inbound_cost == gp.quicksum(cost[i, j] * x[i, j] for i in N_customers for j in N_depots if central[j] == 0))
+    return bound, missing
 
-    m.addConstr(outbound_cost == gp.quicksum(cost[i, j] * x[i, j] for i in N_customers for j in N_depots if central[j] == 1))
+def lp_optimal(inst, costs=None, params=None, k_nearest=None, time_limit=None, mip_gap=None, callback=None):
 
-    m.addConstr(warehouse_cost == gp.quicksum(CostWarehouse * y[j] for j in N_depots))
+    # Solve budget in seconds and target relative gap; the best incumbent is returned when either is reached
+    params = budget_params(params, time_limit, mip_gap)
+
+    profile = new_profile("assignment")
+    with phase(profile, "distance"):
+        if costs is None:
+            costs = cost_matrix(inst)
+
+    # Sparse mode on the nearest depots of every customer
+    if k_nearest is not None:
+        return finish_profile(_pruned_solve(inst, costs, None, params, k_nearest, callback, profile), profile)
+
+    with phase(profile, "build"):
+        m, model_vars = build_model(inst, costs, params=params)
+        m.update()
 
     # Optimize the model
 
-    m.optimize()
+    _optimize(m, callback, profile)
 
-    if m.status == GRB.INFEASIBLE:
-        solution = {"assigned_customers": {},
-                "used_warehouses": [],
-                "inbound_cost": 0,
-                "outbound_cost": 0,
-                "warehouse_cost": 0,
-                "total_cost": 0}
-    else:
-        
-        if Divisible:
-
-            # Create a dictionary to store the solution
-            solution = {"assigned_customers": {i: [j for j in N_depots if x[i, j].x > 0] for i in N_customers},
-                        "used_warehouses": [j for j in N_depots if y[j].x == 1] + [1001],
-                        "inbound_cost": inbound_cost.x,
-                        "outbound_cost": outbound_cost.x,
-                        "warehouse_cost": warehouse_cost.x,
-                        "total_cost": m.objVal}
-        else:   
-
-            # Create a dictionary to store the solution
-            solution = {"assigned_customers": {i: j for i in N_customers for j in N_depots if x[i, j].x == 1},
-                        "used_warehouses": [j for j in N_depots if y[j].x == 1] + [1001],
-                        "inbound_cost": inbound_cost.x,
-                        "outbound_cost": outbound_cost.x,
-                        "warehouse_cost": warehouse_cost.x,
-                        "total_cost": m.objVal}
+    return finish_profile(_extract(m, model_vars, profile), profile)
 
-    return solution
+def p_algorithm(inst, p_regional, costs=None, params=None, k_nearest=None, time_limit=None, mip_gap=None, callback=None):
+
+    # Solve budget in seconds and target relative gap; the best incumbent is returned when either is reached
+    params = budget_params(params, time_limit, mip_gap)
+
+    profile = new_profile("p", p_regional)
+    with phase(profile, "distance"):
+        if costs is None:
+            costs = cost_matrix(inst)
+
+    # Sparse mode on the nearest depots of every customer
+    if k_nearest is not None:
+        return finish_profile(_pruned_solve(inst, costs, p_regional, params, k_nearest, callback, profile), profile)
+
+    with phase(profile, "build"):
+        m, model_vars = build_model(inst, costs, p_regional, params)
+        m.update()
+
+    # Optimize the model
+
+    _optimize(m, callback, profile)
+
+    return finish_profile(_extract(m, model_vars, profile), profile)
+
+def _mip_start(m, model_vars, p_regional):
+    '''
+    Seeds the next solve of a sweep with the current incumbent.
+    The sweep runs in increasing p, so the incumbent stays feasible once the cheapest closed regional depots are opened on top of it.
+    '''
+
+    x = model_vars["x"]
+    y = model_vars["y"]
+    central = model_vars["central"]
+
+    y_values = np.round(y.X)
+
+    closed = np.flatnonzero(~central & (y_values == 0))
+    missing = p_regional - int(y_values[~central].sum())
+    if missing < 0 or missing > len(closed):
+        return False
+
+    # Open the regional depots that are closest to the customers overall
+    column_cost = model_vars["cost"].sum(axis=0)
+    y_values[closed[np.argsort(column_cost[closed], kind="stable")[:missing]]] = 1
+
+    x.Start = x.X
+    y.Start = y_values
+    return True
+
+def p_sweep(inst, p_values, costs=None, params=None, time_limit=None, mip_gap=None, callback=None):
+    '''
+    Solves p_algorithm for every p in p_values on a single model.
+    Only the right-hand side of the regional depot count constraint changes between solves, and each solve is seeded with the previous incumbent.
+    time_limit and mip_gap apply to each solve. callback is an optional Gurobi callback for every solve; model._p_regional tells them apart.
+    Returns the solutions in the order of p_values, as p_algorithm would.
+    The distance computation and the model construction are counted in the profile of the first solve;
+    the "build" of the others is the update of the right-hand side and of the MIP start.
+    '''
+
+    profile = new_profile("p")
+    with phase(profile, "distance"):
+        if costs is None:
+            costs = cost_matrix(inst)
+
+    with phase(profile, "build"):
+        m, model_vars = build_model(inst, costs, 0, budget_params(params, time_limit, mip_gap))
+        m.update()
+    p_constraint = model_vars["p_constraint"]
+    all_vars = m.getVars()
+
+    solutions = {}
+    has_incumbent = False
+
+    for p in sorted(set(p_values)):
+
+        profile["p_regional"] = p
+        with phase(profile, "build"):
+            p_constraint.RHS = np.array([p])
+            m._p_regional = p
+
+            if not (has_incumbent and _mip_start(m, model_vars, p)):
+                m.setAttr("Start", all_vars, [GRB.UNDEFINED]*len(all_vars))
+
+        # Optimize the model
+
+        _optimize(m, callback, profile)
+
+        solutions[p] = finish_profile(_extract(m, model_vars, profile), profile)
+        has_incumbent = m.SolCount > 0
+        profile = new_profile("p")
+
+    return [solutions[p] for p in p_values]
+
+def p_scenarios(inst, p_values, warehouse_limits=None, cost_warehouses=None, costs=None, params=None, time_limit=None,
+                mip_gap=None, callback=None):
+    '''
+    Solves p_algorithm for every p in p_values, and optionally every WarehouseLimit in warehouse_limits and CostWarehouse in
+    cost_warehouses, as the scenarios of one Gurobi multi-scenario model, so a single optimize call shares presolve and
+    branch-and-bound work between them.
+    Scenarios may only differ in bounds, objective and right-hand sides: p is the right-hand side of the regional depot count
+    constraint, and with warehouse_limits the capacity of the central depot becomes the right-hand side of a row of its own,
+    its capacity row keeping the largest limit so that it still closes the depot without load. CostWarehouse is not in the
+    objective of p_algorithm, so it only changes the warehouse cost reported for each design.
+    time_limit and mip_gap apply to the whole solve. callback is an optional Gurobi callback; model._p_regional is the tuple of p values.
+    Returns the solutions in the order of itertools.product(p_values, warehouse_limits, cost_warehouses), which is the order of
+    p_values without the grids. The distance computation, the model construction and the solve are counted in the profile of
+    the first solution and "node_count" is that of the whole solve.
+    '''
+
+    if warehouse_limits is None:
+        warehouse_limits = [inst["WarehouseLimit"]]
+    if cost_warehouses is None:
+        cost_warehouses = [inst["CostWarehouse"]]
+    scenarios = list(itertools.product(dict.fromkeys(p_values), dict.fromkeys(warehouse_limits)))
+
+    profile = new_profile("p")
+    with phase(profile, "distance"):
+        if costs is None:
+            costs = cost_matrix(inst)
+
+    with phase(profile, "build"):
+        params = budget_params(params, time_limit, mip_gap)
+        m, model_vars = build_model(inst, costs, 0, params)
+        m.update()
+        m._p_regional = tuple(dict.fromkeys(p_values))
+
+        central = np.flatnonzero(model_vars["central"])
+        y = model_vars["y"].tolist()
+        p_constraint = model_vars["p_constraint"].tolist()
+
+        limit_constraints = []
+        if len(warehouse_limits) > 1 or warehouse_limits[0] != inst["WarehouseLimit"]:
+            capacity_constraints = model_vars["capacity_constraints"].tolist()
+            for b in central.tolist():
+                m.chgCoeff(capacity_constraints[b], y[b], -max(warehouse_limits))
+            pairs = np.flatnonzero(np.isin(model_vars["pair_depot"], central))
+            demand = np.asarray(customer_array(inst)["demand"], dtype=float)
+            limit_matrix = sp.csr_matrix((demand[model_vars["pair_customer"][pairs]],
+                                          (np.searchsorted(central, model_vars["pair_depot"][pairs]), pairs)),
+                                         shape=(len(central), len(model_vars["pair_customer"])))
+            limit_constraints = m.addMConstr(limit_matrix, model_vars["x"], "<", np.full(len(central), float(max(warehouse_limits)))).tolist()
+
+        m.NumScenarios = len(scenarios)
+        for s, (p, limit) in enumerate(scenarios):
+            m.Params.ScenarioNumber = s
+            m.setAttr("ScenNRHS", p_constraint, [p])
+            if limit_constraints:
+                m.setAttr("ScenNRHS", limit_constraints, [float(limit)]*len(limit_constraints))
+        m.update()
+
+    # Optimize the model
+
+    _optimize(m, callback, profile)
+
+    status = STATUS_NAMES.get(m.status, f"status_{m.status}")
+    target_gap = m.Params.MIPGap
+    solutions = {}
+
+    for s, (p, limit) in enumerate(scenarios):
+
+        profile["p_regional"] = p
+        with phase(profile, "extract"):
+            m.Params.ScenarioNumber = s
+            objective, bound = m.ScenNObjVal, m.ScenNObjBound
+
+            # A scenario without a solution has an infinite objective; it is infeasible once the whole model is solved
+            if abs(objective) >= GRB.INFINITY:
+                found = None
+                solution = {"assigned_customers": {},
+                            "used_warehouses": [],
+                            "inbound_cost": 0,
+                            "outbound_cost": 0,
+                            "warehouse_cost": 0,
+                            "total_cost": 0,
+                            "best_bound": None,
+                            "gap": None,
+                            "status": "infeasible" if m.status == GRB.OPTIMAL else status}
+            else:
+                x_values = model_vars["x"].ScenNX
+                y_values = np.round(model_vars["y"].ScenNX)
+                found = _assignment(model_vars, x_values if model_vars["Divisible"] else np.round(x_values), y_values)
+                gap = max(objective - bound, 0)/max(abs(objective), 1e-10)
+                solution = {"assigned_customers": found[0],
+                            "used_warehouses": found[1],
+                            "inbound_cost": model_vars["inbound_cost"].ScenNX,
+                            "outbound_cost": model_vars["outbound_cost"].ScenNX,
+                            "warehouse_cost": 0,
+                            "total_cost": objective,
+                            "best_bound": bound,
+                            "gap": gap,
+                            "status": "optimal" if m.status == GRB.OPTIMAL or gap <= target_gap else status}
+            solution["node_count"] = int(m.NodeCount)
+
+        for CostWarehouse in dict.fromkeys(cost_warehouses):
+            scenario_solution = dict(solution)
+            if found is not None:
+                scenario_solution["warehouse_cost"] = CostWarehouse*float(y_values.sum())
+            solutions[p, limit, CostWarehouse] = finish_profile(scenario_solution, profile)
+            profile = new_profile("p", p)
+
+    return [solutions[key] for key in itertools.product(p_values, warehouse_limits, cost_warehouses)]
+
+class ModelSession:
+    '''
+    Model of lp_optimal (p_regional None) or p_algorithm that is kept between solves and edited in place:
+    customers can be added or removed, depots moved and WarehouseLimit or CostWarehouse changed without a rebuild.
+    Every solve starts from the previous solution; the assignment of new customers is left for Gurobi to complete.
+    sync(inst) works out those edits from the previous instance; a new set of depots or a change of Divisible or CostKm rebuilds the model.
+    distances is an optional distances.DistanceBackend for other than grid distances; with an external matrix any change of the
+    nodes rebuilds the model, since the matrix cannot price new ones.
+    The "build" time in the profile of a solve is the time spent on the edits since the previous solve.
+    Solves and edits hold lock, so a session can be shared between threads.
+    '''
+
+    def __init__(self, inst, p_regional=None, params=None, distances=None):
+
+        self.p_regional = p_regional
+        self.distances = distances
+        self.base_params = dict(params or {})
+        self.lock = threading.RLock()
+        self.rebuilds = 0
+        self._build(inst)
+
+    def _build(self, inst):
+
+        stime = time.perf_counter()
+
+        self.customers = customer_array(inst).copy()
+        self.depots = depot_array(inst).copy()
+        self.params = {key: inst[key] for key in PARAMETERS}
+
+        costs = cost_matrix(inst) if self.distances is None else self.distances.cost_matrix(inst)
+        self.m, self.model_vars = build_model(inst, costs, self.p_regional, self.base_params)
+        self.m.update()
+
+        n_depots = len(self.depots)
+        # A private copy, since the edits change it in place and cached costs are read-only
+        self.cost = np.array(costs["cost"])
+        self.central = self.model_vars["central"]
+        # Variables and constraints as object arrays, one row of x per customer
+        self.x = np.array(self.model_vars["x"].tolist(), dtype=object).reshape(-1, n_depots)
+        self.y = np.array(self.model_vars["y"].tolist(), dtype=object)
+        self.assignment_constraints = np.array(self.model_vars["assignment_constraints"].tolist(), dtype=object)
+        self.capacity_constraints = np.array(self.model_vars["capacity_constraints"].tolist(), dtype=object)
+
+        # Starting point of the next solve (nan where there is none)
+        self.x_start = np.full(self.x.shape, np.nan)
+        self.y_start = np.full(n_depots, np.nan)
+
+        self.rebuilds += 1
+        self._edit_time = time.perf_counter() - stime
+
+    def instance(self):
+        '''
+        Instance with the current customers, depots and parameters of the session.
+        '''
+
+        return Instance(self.customers, self.depots, **self.params)
+
+    def _costs(self, customers, depots):
+
+        if self.distances is not None:
+            return self.distances.block_costs(customers, depots, self.params["CostKm"])
+        return cost_matrix(Instance(customers, depots, **self.params))["cost"]
+
+    def add_customers(self, customers):
+        '''
+        Adds customers, given as an array of CUSTOMER_DTYPE, with one assignment row and one x variable per depot each.
+        '''
+
+        with self.lock:
+            stime = time.perf_counter()
+
+            customers = np.asarray(customers, dtype=CUSTOMER_DTYPE)
+            cost = self._costs(customers, self.depots)
+            n_new, n_depots = cost.shape
+
+            vtype = GRB.CONTINUOUS if self.params["Divisible"] else GRB.BINARY
+            x = self.m.addMVar((n_new, n_depots), vtype=vtype)
+            assignment_constraints = self.m.addConstr(x.sum(axis=1) == 1)
+            x = np.array(x.tolist(), dtype=object).reshape(n_new, n_depots)
+
+            # New columns of the capacity and transportation cost rows
+            inbound = self.model_vars["inbound_constraint"].item()
+            outbound = self.model_vars["outbound_constraint"].item()
+            demand = customers["demand"].tolist()
+            for a in range(n_new):
+                for b in range(n_depots):
+                    self.m.chgCoeff(self.capacity_constraints[b], x[a, b], demand[a])
+                    self.m.chgCoeff(outbound if self.central[b] else inbound, x[a, b], cost[a, b])
+
+            self.customers = np.concatenate([self.customers, customers])
+            self.cost = np.vstack([self.cost, cost])
+            self.x = np.vstack([self.x, x])
+            self.assignment_constraints = np.concatenate([self.assignment_constraints,
+                                                          np.array(assignment_constraints.tolist(), dtype=object)])
+            self.x_start = np.vstack([self.x_start, np.full((n_new, n_depots), np.nan)])
+
+            self._edit_time += time.perf_counter() - stime
+
+    def remove_customers(self, ids):
+        '''
+        Removes the customers with the given ids together with their variables and assignment rows.
+        '''
+
+        with self.lock:
+            stime = time.perf_counter()
+
+            removed = np.isin(self.customers["id"], np.asarray(list(ids)))
+            self.m.remove(self.x[removed].ravel().tolist() + self.assignment_constraints[removed].tolist())
+
+            kept = ~removed
+            self.customers = self.customers[kept]
+            self.cost = self.cost[kept]
+            self.x = self.x[kept]
+            self.assignment_constraints = self.assignment_constraints[kept]
+            self.x_start = self.x_start[kept]
+
+            self._edit_time += time.perf_counter() - stime
+
+    def move_depot(self, depot_id, x, y):
+        '''
+        Moves a depot, updating the transportation cost coefficients of its column.
+        '''
+
+        with self.lock:
+            stime = time.perf_counter()
+
+            b = int(np.flatnonzero(self.depots["id"] == depot_id)[0])
+            self.depots["x"][b] = x
+            self.depots["y"][b] = y
+
+            cost = self._costs(self.customers, self.depots[b:b + 1])[:, 0]
+            constraint = self.model_vars["outbound_constraint" if self.central[b] else "inbound_constraint"].item()
+            for a in np.flatnonzero(cost != self.cost[:, b]).tolist():
+                self.m.chgCoeff(constraint, self.x[a, b], cost[a])
+            self.cost[:, b] = cost
+
+            self._edit_time += time.perf_counter() - stime
+
+    def set_warehouse_limit(self, WarehouseLimit):
+        '''
+        Changes the capacity of the central depot (the coefficient of its y in its capacity row).
+        '''
+
+        with self.lock:
+            stime = time.perf_counter()
+
+            for b in np.flatnonzero(self.central).tolist():
+                self.m.chgCoeff(self.capacity_constraints[b], self.y[b], -WarehouseLimit)
+            self.params["WarehouseLimit"] = WarehouseLimit
+
+            self._edit_time += time.perf_counter() - stime
+
+    def set_cost_warehouse(self, CostWarehouse):
+
+        with self.lock:
+            stime = time.perf_counter()
+
+            constraint = self.model_vars["warehouse_constraint"].item()
+            for b in range(len(self.y)):
+                self.m.chgCoeff(constraint, self.y[b], CostWarehouse)
+            self.params["CostWarehouse"] = CostWarehouse
+
+            self._edit_time += time.perf_counter() - stime
+
+    def sync(self, inst):
+        '''
+        Applies the edits that turn the current instance into inst. Returns False when the model had to be rebuilt instead.
+        Customers are matched by id; a customer whose coordinates or demand changed is removed and added again.
+        '''
+
+        with self.lock:
+            depots = depot_array(inst)
+            external = self.distances is not None and self.distances.matrix is not None
+            if (len(depots) != len(self.depots) or (depots["id"] != self.depots["id"]).any()
+                    or (depots["central"] != self.depots["central"]).any()
+                    or inst["Divisible"] != self.params["Divisible"] or inst["CostKm"] != self.params["CostKm"]
+                    or (external and not (np.array_equal(depots, self.depots)
+                                          and np.array_equal(customer_array(inst), self.customers)))):
+                self._build(inst)
+                return False
+
+            self.params.update(GridSize=inst["GridSize"], Seed=inst["Seed"])
+            if inst["WarehouseLimit"] != self.params["WarehouseLimit"]:
+                self.set_warehouse_limit(inst["WarehouseLimit"])
+            if inst["CostWarehouse"] != self.params["CostWarehouse"]:
+                self.set_cost_warehouse(inst["CostWarehouse"])
+
+            for b in np.flatnonzero((depots["x"] != self.depots["x"]) | (depots["y"] != self.depots["y"])).tolist():
+                self.move_depot(int(depots["id"][b]), depots["x"][b], depots["y"][b])
+
+            customers = customer_array(inst)
+            position = {i: a for a, i in enumerate(self.customers["id"].tolist())}
+            current = np.array([position.get(i, -1) for i in customers["id"].tolist()], dtype=int)
+            unchanged = current >= 0
+            unchanged[unchanged] = customers[unchanged] == self.customers[current[unchanged]]
+
+            kept = np.zeros(len(self.customers), dtype=bool)
+            kept[current[unchanged]] = True
+            if not kept.all():
+                self.remove_customers(self.customers["id"][~kept])
+            if not unchanged.all():
+                self.add_customers(customers[~unchanged])
+
+            return True
+
+    def optimize(self, time_limit=None, mip_gap=None, callback=None):
+        '''
+        Solves the current model from the previous solution and returns the solution dictionary of lp_optimal or p_algorithm.
+        '''
+
+        with self.lock:
+            profile = new_profile("assignment" if self.p_regional is None else "p", self.p_regional)
+            profile["build"] = self._edit_time
+            self._edit_time = 0.0
+
+            # The budget of the previous solve does not carry over
+            for name, value in budget_params(dict(self.base_params, TimeLimit=GRB.INFINITY, MIPGap=1e-4), time_limit, mip_gap).items():
+                self.m.setParam(name, value)
+
+            all_x = self.x.ravel().tolist()
+            self.m.setAttr("Start", all_x, np.nan_to_num(self.x_start.ravel(), nan=GRB.UNDEFINED).tolist())
+            self.m.setAttr("Start", self.y.tolist(), np.nan_to_num(self.y_start, nan=GRB.UNDEFINED).tolist())
+
+            _optimize(self.m, callback, profile)
+
+            if self.m.SolCount > 0:
+                self.x_start = np.array(self.m.getAttr("X", all_x)).reshape(self.x.shape)
+                self.y_start = np.array(self.m.getAttr("X", self.y.tolist()))
+
+            n_customers, n_depots = self.x.shape
+            model_vars = dict(self.model_vars,
+                              x=gp.MVar.fromlist(all_x),
+                              pair_customer=np.repeat(np.arange(n_customers), n_depots),
+                              pair_depot=np.tile(np.arange(n_depots), n_customers),
+                              N_customers=self.customers["id"].tolist(),
+                              N_depots=self.depots["id"].tolist(),
+                              Divisible=self.params["Divisible"])
+
+            return finish_profile(_extract(self.m, model_vars, profile), profile)
 
 '''
 # Test the function
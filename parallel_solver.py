@@ -0,0 +1,222 @@
+#Parallel execution of independent scenario solves
+
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from gurobipy import GRB
+
+from divisible import divisible_optimal, divisible_p_algorithm
+from heuristic import heuristic_optimal, heuristic_p_algorithm
+from p_algorithm import cost_matrix, lp_optimal, p_algorithm, p_sweep
+from screening import mip_time_limit, screen_scenarios
+
+# Seconds between progress updates (and cancellation checks) of the workers of solve_in_pool
+PROGRESS_INTERVAL = 0.25
+
+# Worker processes are kept alive between calls so that Streamlit reruns do not pay the start-up cost again
+_executor = None
+_executor_workers = 0
+
+def _get_executor(max_workers):
+    '''
+    Returns the shared process pool, recreating it when a different number of workers is requested.
+    Workers are spawned rather than forked so that no Gurobi environment is inherited from the parent process.
+    '''
+
+    global _executor, _executor_workers
+
+    if _executor is None or _executor_workers != max_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        _executor_workers = max_workers
+
+    return _executor
+
+def map_in_pool(function, tasks, max_workers=None):
+    '''
+    list(map(function, tasks)) on the shared process pool; function must be importable by the workers (module level).
+    With a single worker the tasks run in this process.
+    '''
+
+    tasks = list(tasks)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(tasks)))
+
+    if max_workers == 1:
+        return [function(task) for task in tasks]
+    return list(_get_executor(max_workers).map(function, tasks))
+
+def _solve_task(task):
+
+    inst, costs, p_regional, params, method, time_limit, mip_gap = task
+
+    if method == "heuristic":
+        if p_regional is None:
+            return heuristic_optimal(inst, costs, time_limit)
+        return heuristic_p_algorithm(inst, p_regional, costs, time_limit)
+
+    if method == "divisible":
+        if p_regional is None:
+            return divisible_optimal(inst, costs, time_limit)
+        return divisible_p_algorithm(inst, p_regional, costs, time_limit)
+
+    if p_regional is None:
+        return lp_optimal(inst, costs, params, time_limit=time_limit, mip_gap=mip_gap)
+    return p_algorithm(inst, p_regional, costs, params, time_limit=time_limit, mip_gap=mip_gap)
+
+def _progress_task(task):
+    '''
+    _solve_task in a worker that puts (p_regional, objective, bound, runtime) of the running MIP on the updates queue and
+    terminates the solve once the stop event is set. Both are polled at most every PROGRESS_INTERVAL seconds, since every
+    call is a round trip to the manager process.
+    '''
+
+    inst, costs, p_regional, params, method, time_limit, mip_gap, updates, stop = task
+    if method != "mip":
+        return _solve_task(task[:7])
+
+    last = [-PROGRESS_INTERVAL]
+
+    def callback(model, where):
+
+        if where == GRB.Callback.POLLING:
+            return
+        runtime = model.cbGet(GRB.Callback.RUNTIME)
+        if runtime - last[0] < PROGRESS_INTERVAL:
+            return
+        last[0] = runtime
+
+        try:
+            if stop.is_set():
+                model.terminate()
+            elif where == GRB.Callback.MIP:
+                updates.put((p_regional, model.cbGet(GRB.Callback.MIP_OBJBST), model.cbGet(GRB.Callback.MIP_OBJBND), runtime))
+        except (OSError, EOFError):
+            # The manager is gone, so nobody is waiting for this solve any more
+            model.terminate()
+
+    if p_regional is None:
+        return lp_optimal(inst, costs, params, time_limit=time_limit, mip_gap=mip_gap, callback=callback)
+    return p_algorithm(inst, p_regional, costs, params, time_limit=time_limit, mip_gap=mip_gap, callback=callback)
+
+def solve_in_pool(inst, costs, p_values, method="mip", time_limit=None, mip_gap=None, max_workers=None, params=None,
+                  report=None, cancelled=None):
+    '''
+    Solves every p in p_values (None for the assignment model) on the shared process pool and yields (p_regional, solution)
+    as the workers finish them, for callers that show progress while the solves run (e.g. SolveJob).
+    report(p_regional, objective, bound, runtime) receives the progress of the running MIPs and, once cancelled() returns
+    True, the running solves are terminated and those not started are dropped, so fewer solutions may come out.
+    params defaults to an equal share of the cores per worker (Threads), without solver logs.
+    '''
+
+    p_values = list(p_values)
+    cores = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = cores
+    max_workers = max(1, min(max_workers, len(p_values)))
+    if params is None:
+        params = {"OutputFlag": 0, "Threads": max(1, cores // max_workers)}
+
+    executor = _get_executor(max_workers)
+    manager = multiprocessing.get_context("spawn").Manager()
+    updates, stop = manager.Queue(), manager.Event()
+    futures = {}
+    try:
+        futures = {executor.submit(_progress_task, (inst, costs, p, params, method, time_limit, mip_gap, updates, stop)): p
+                   for p in p_values}
+        pending = set(futures)
+
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+
+            while True:
+                try:
+                    update = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if report is not None:
+                    report(*update)
+
+            if cancelled is not None and cancelled() and not stop.is_set():
+                stop.set()
+                for future in pending:
+                    future.cancel()
+
+            for future in done:
+                if not future.cancelled():
+                    yield futures[future], future.result()
+    finally:
+        # After a failed solve, or when the caller stops early, the other solves are stopped before the manager goes
+        stop.set()
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        manager.shutdown()
+
+def solve_scenarios(inst, p_values, include_lp=True, max_workers=None, method="mip", time_limit=None, mip_gap=None, distances=None):
+    '''
+    Solves lp_optimal and p_algorithm for every p in p_values across a process pool.
+    With method="heuristic" the greedy + local search counterparts are used instead, and with method="divisible" the divisible
+    demand engine (divisible.py), which needs an instance with divisible demand.
+    time_limit (seconds) bounds every solve of either method and mip_gap is the target gap of the MIP solves.
+    Each worker is limited to its share of the cores through the Gurobi Threads parameter, so the machine is not oversubscribed.
+    MIP solves are screened first (screen_scenarios) and only the scenarios that screening cannot settle are dispatched,
+    with the screening time taken off their time limit.
+    distances is an optional distances.DistanceBackend for other than grid distances.
+    Returns (lp_solution, p_solutions) with p_solutions in the order of p_values; lp_solution is None when include_lp is False.
+    '''
+
+    cores = os.cpu_count() or 1
+    costs = cost_matrix(inst) if distances is None else distances.cost_matrix(inst)
+
+    all_p = p_values
+    screened = {}
+    if method == "mip":
+        scenarios = ([None] if include_lp else []) + list(p_values)
+        stime = time.perf_counter()
+        screened, _ = screen_scenarios(inst, scenarios, costs, mip_gap, time_limit)
+        time_limit = mip_time_limit(time_limit, time.perf_counter() - stime, len(set(scenarios)))
+        if None in screened:
+            include_lp = False
+        p_values = [p for p in p_values if p not in screened]
+
+    unique_p = list(dict.fromkeys(p_values))
+    tasks = ([None] if include_lp else []) + unique_p
+
+    if max_workers is None:
+        max_workers = min(len(tasks), cores)
+    max_workers = max(1, min(max_workers, len(tasks)))
+
+    # A single worker gains nothing from a pool; the warm-started sweep is faster in-process
+    if max_workers == 1 and method != "mip":
+        lp_solution = _solve_task((inst, costs, None, None, method, time_limit, mip_gap)) if include_lp else None
+        solutions = {p: _solve_task((inst, costs, p, None, method, time_limit, mip_gap)) for p in unique_p}
+    elif max_workers == 1:
+        lp_solution = lp_optimal(inst, costs, time_limit=time_limit, mip_gap=mip_gap) if include_lp else None
+        solutions = dict(zip(unique_p, p_sweep(inst, unique_p, costs, None, time_limit, mip_gap))) if unique_p else {}
+    else:
+        params = {"Threads": max(1, cores // max_workers)}
+        executor = _get_executor(max_workers)
+        results = list(executor.map(_solve_task, [(inst, costs, p, params, method, time_limit, mip_gap) for p in tasks]))
+
+        lp_solution = results.pop(0) if include_lp else None
+        solutions = dict(zip(unique_p, results))
+
+    solutions.update(screened)
+    return screened.get(None, lp_solution), [solutions[p] for p in all_p]
+
+def per_solve_time_limit(total_time, n_tasks, max_workers=None):
+    '''
+    Time limit for each of n_tasks solves so that solve_scenarios finishes within total_time seconds.
+    '''
+
+    cores = os.cpu_count() or 1
+    workers = max(1, min(max_workers or cores, n_tasks))
+    rounds = -(-n_tasks // workers)
+
+    return total_time/rounds
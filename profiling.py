@@ -0,0 +1,72 @@
+#Per-phase profiles of the solves, with optional hooks that receive them
+
+import threading
+import time
+from contextlib import contextmanager
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+def add_profile_hook(hook):
+    '''
+    Registers hook(profile), called after every solve in this process with the profile that is also stored in
+    solution["profile"]. Solves that run in worker processes only report to hooks registered in those processes.
+    '''
+
+    with _hooks_lock:
+        _hooks.append(hook)
+
+def remove_profile_hook(hook):
+
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+def new_profile(model, p_regional=None):
+    '''
+    Empty profile of one solve. Phase times are in seconds; presolve is part of solve.
+    Model size, node count and gap stay None for solves without a MIP model (e.g. the heuristic).
+    '''
+
+    return {"model": model,
+            "p_regional": p_regional,
+            "distance": 0.0,
+            "build": 0.0,
+            "presolve": None,
+            "solve": 0.0,
+            "extract": 0.0,
+            "rows": None,
+            "columns": None,
+            "nonzeros": None,
+            "node_count": None,
+            "gap": None,
+            "status": None}
+
+@contextmanager
+def phase(profile, name):
+    '''
+    Adds the wall time of the block to profile[name], so that repeated phases (e.g. rounds of a pruned solve) accumulate.
+    '''
+
+    stime = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile[name] = (profile.get(name) or 0.0) + time.perf_counter() - stime
+
+def finish_profile(solution, profile):
+    '''
+    Copies the outcome of the solve into the profile, attaches it to the solution and passes it to the hooks.
+    '''
+
+    profile["node_count"] = solution["node_count"]
+    profile["gap"] = solution["gap"]
+    profile["status"] = solution["status"]
+    solution["profile"] = profile
+
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        hook(profile)
+
+    return solution
@@ -1,7 +1,11 @@
 import streamlit as st
 import time
-from miscellanious_functions import CreateInstance, SolutionPlot, PComparisonPlot
-from p_algorithm import p_algorithm, lp_optimal
+from miscellanious_functions import SolutionPlot, PComparisonPlot
+from background_solver import SolveJob
+from distances import DistanceBackend, distances_key
+from instance import Instance
+from instance_import import import_instance
+from memoization import cached_create_instance, instance_cache, instance_key, lookup_scenarios, solution_cache, solution_store
 
 
 st.set_page_config(page_title = "Facility Location Problem Simulator", 
@@ -78,47 +82,197 @@ with st.sidebar:
         Divisible = True
     else:
         Divisible = False
+
+    # Real customer and depot lists replace the generated instance; the cost and capacity inputs above still apply
+    with st.expander("Import customers and depots 📂"):
+        customers_file = st.file_uploader("Customers file (id, x, y, demand)", type=["csv", "xlsx"],
+        help="One row per customer; demand is optional and 1 by default")
+        depots_file = st.file_uploader("Depots file (id, x, y, central)", type=["csv", "xlsx"],
+        help="One row per depot; the central depot must have id 1001")
+        DistanceMetric = st.radio("Distances between the imported nodes", ("Grid", "Great-circle"),
+        help="Great-circle distances are in km, with x the longitude and y the latitude in degrees")
  
     st.subheader("Solution Method")
 
     option = st.selectbox(
     'Choose a Construction Algorithm:',
-    ('LP Linear Programming'))
+    ('LP Linear Programming', 'Greedy + Local Search', 'Divisible Transportation Engine'))
 
+    if option == 'Greedy + Local Search':
+        method = "heuristic"
+    elif option == 'Divisible Transportation Engine' and not Divisible:
+        st.warning("The divisible transportation engine needs divisible demand; LP Linear Programming is used instead")
+        method = "mip"
+    elif option == 'Divisible Transportation Engine':
+        method = "divisible"
+    else:
+        method = "mip"
+
+    # One Gurobi model whose scenarios are the p values shares presolve and branch-and-bound work across the curve
+    multi_scenario = st.checkbox("Solve the trade-off curve as one multi-scenario model", value=False,
+    disabled=method != "mip",
+    help="All p values of the cost trade-off are solved in a single optimize call instead of one model per p")
+
+    TimeBudget = st.number_input('Insert time budget for the page (s) ⏱️',
+    min_value=1.0,
+    max_value=300.0,
+    value=30.0,
+    step=1.0,
+    help="Maximum time spent solving all the models on the page. The best solution found so far is shown when it runs out"
+    )
+
+    TargetGap = st.number_input('Insert target optimality gap (%) 🎯',
+    min_value=0.0,
+    max_value=50.0,
+    value=0.01,
+    step=0.5,
+    help="The solver stops as soon as its solution is proven to be within this percentage of the optimum"
+    )
 
-# Initializing the problem instances
-inst = CreateInstance(NoOfCustomers, NoOfRegionalDepots, GridSize, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed)
 
 stime = time.time()
 cpu_stime = time.process_time()
 
+# Wall time of every phase of this page run, shown in the diagnostics panel
+page_times = {}
+
+# Initializing the problem instances
+phase_stime = time.perf_counter()
+if customers_file is not None and depots_file is not None:
+
+    # The files are parsed once per upload; the arrays are kept for the reruns
+    import_key = (customers_file.file_id, depots_file.file_id)
+    imported = st.session_state.get("imported")
+    if imported is None or imported[0] != import_key:
+        import_bar = st.progress(0.0, text="Importing customers...")
+
+        def report(fraction, rows):
+            import_bar.progress(min(fraction or 0.0, 1.0), text=f"Imported {rows:,} customers")
 
+        try:
+            imported_inst = import_instance(customers_file, depots_file, Divisible, CostKm, CostWarehouse, WarehouseLimit, progress=report)
+        except ValueError as error:
+            import_bar.empty()
+            st.error(f"Import failed: {error}")
+            st.stop()
+        import_bar.empty()
+        imported = (import_key, imported_inst.customers, imported_inst.depots, imported_inst.GridSize)
+        st.session_state["imported"] = imported
+
+    _, customers, depots, GridSize = imported
+    inst = Instance(customers, depots, GridSize, Divisible, CostKm, CostWarehouse, WarehouseLimit)
+    # The solves, the model session and the cached solutions all price the instance with these distances
+    distances = DistanceBackend("haversine") if DistanceMetric == "Great-circle" else None
+    NoOfRegionalDepots = len(depots) - 1
+    st.caption(f"Imported instance: {len(customers):,} customers, {NoOfRegionalDepots} regional depots")
+else:
+    inst = cached_create_instance(NoOfCustomers, NoOfRegionalDepots, GridSize, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed)
+    distances = None
+page_times["Instance"] = time.perf_counter() - phase_stime
+
+
+# Solving the assignment and the trade-off scenarios in a background job
+# The assignment runs next to the trade-off sweep, whose solves share the page budget
+p_vector = [0, 1, 2, 3, 4, NoOfRegionalDepots]
+time_limit = TimeBudget/len(set(p_vector))
+mip_gap = TargetGap/100
+
+phase_stime = time.perf_counter()
+cached = lookup_scenarios(inst, p_vector, method, time_limit, mip_gap, multi_scenario, distances)
+
+if cached is None:
+    job_key = (instance_key(inst), tuple(p_vector), method, time_limit, mip_gap, multi_scenario, distances_key(distances))
+    job = st.session_state.get("solve_job")
+
+    # A job for other inputs is stale: stop it instead of waiting for it
+    if job is None or job.key != job_key or (job.done and job.result is None):
+        if job is not None:
+            job.cancel()
+        # The assignment model is kept across reruns and edited in place when only some inputs change
+        if "model_sessions" not in st.session_state:
+            st.session_state["model_sessions"] = {}
+        job = SolveJob(inst, p_vector, method, time_limit, mip_gap, key=job_key, sessions=st.session_state["model_sessions"],
+                       multi_scenario=multi_scenario, distances=distances)
+        st.session_state["solve_job"] = job
+
+    # Changing an input interrupts this loop with a rerun, which cancels the job above
+    with st.status("Solving...", expanded=True) as status_box:
+        progress_table = st.empty()
+        while not job.done:
+            progress_table.dataframe(job.progress(), hide_index=True)
+            status_box.update(label=f"Solving... {job.elapsed():.0f} s")
+            time.sleep(0.25)
+        progress_table.dataframe(job.progress(), hide_index=True)
+        status_box.update(label=f"Solved in {job.elapsed():.1f} s", state="complete", expanded=False)
+
+    if job.error is not None:
+        raise job.error
+    solution, p_solutions = job.result
+    page_times["Solve (background job)"] = time.perf_counter() - phase_stime
+else:
+    solution, p_solutions = cached
+    page_times["Solve (from cache)"] = time.perf_counter() - phase_stime
 
 col1, col2 = st.columns(2)
 
 with col1:   
     st.header("Assignment Plot")
-    solution = lp_optimal(inst)
-    figure = SolutionPlot(inst, solution)   
-    st.pyplot(fig=figure, use_container_width=True)
+    if solution["assigned_customers"]:
+        phase_stime = time.perf_counter()
+        figure = SolutionPlot(inst, solution)   
+        st.pyplot(fig=figure, use_container_width=True)
+        page_times["Assignment plot"] = time.perf_counter() - phase_stime
+        if solution["status"] != "optimal" and solution["gap"] is not None:
+            st.caption(f"Stopped with status '{solution['status']}': best bound {solution['best_bound']:.2f}, gap {100*solution['gap']:.2f}%")
+    else:
+        st.warning(f"No solution found (status '{solution['status']}')")
     #figure.savefig('plot.jpeg')
 
 with col2:
     st.header("Cost Trade-off")
-    p_vector = [0, 1, 2, 3, 4, NoOfRegionalDepots]
     solution_vector = []
     x_vector = []
-    for p in p_vector:
-        inst = CreateInstance(NoOfCustomers, NoOfRegionalDepots, GridSize, Divisible, CostKm, CostWarehouse, WarehouseLimit, Seed)
-        solution = p_algorithm(inst, p)
-        if solution['total_cost'] == 0:
+    # Infeasible p values, and solves stopped before finding any solution, have no point on the curve
+    for p, p_solution in zip(p_vector, p_solutions):
+        if p_solution['status'] == "infeasible" or not p_solution['assigned_customers']:
             pass
         else:
-            solution_vector.append(solution)
+            solution_vector.append(p_solution)
             x_vector.append(p)
     
+    phase_stime = time.perf_counter()
     fig2 = PComparisonPlot(inst, x_vector, solution_vector)
     st.pyplot(fig=fig2, use_container_width=True)
+    page_times["Trade-off plot"] = time.perf_counter() - phase_stime
     #fig2.savefig('plot2.jpeg')
 
-    
+solution_stats = solution_cache.stats()
+instance_stats = instance_cache.stats()
+store_stats = solution_store.stats()
+st.sidebar.caption(f"Cache: {solution_stats['hits']} solution hits / {solution_stats['misses']} misses, "
+                   f"{instance_stats['hits']} instance hits / {instance_stats['misses']} misses; "
+                   f"store: {store_stats['hits']} hits / {store_stats['misses']} misses, {store_stats['entries']} solutions")
+
+# Where the time of this page run went, and the profile of every solve (as recorded when it was solved, also for cached results)
+with st.expander("Diagnostics 🩺"):
+    page_times["Page total"] = time.time() - stime
+    st.markdown(f"**Page run** (CPU time {time.process_time() - cpu_stime:.2f} s)")
+    st.dataframe([{"Phase": name, "Time (s)": round(value, 4)} for name, value in page_times.items()], hide_index=True)
+
+    st.markdown("**Solves**")
+    profile_rows = []
+    for p, p_solution in [(None, solution)] + list(zip(p_vector, p_solutions)):
+        profile = p_solution.get("profile") or {}
+        profile_rows.append({"Model": "Assignment" if p is None else f"p = {p}",
+                             "Status": p_solution["status"],
+                             "Distance (s)": profile.get("distance"),
+                             "Build (s)": profile.get("build"),
+                             "Presolve (s)": profile.get("presolve"),
+                             "Solve (s)": profile.get("solve"),
+                             "Extract (s)": profile.get("extract"),
+                             "Rows": profile.get("rows"),
+                             "Columns": profile.get("columns"),
+                             "Nonzeros": profile.get("nonzeros"),
+                             "Nodes": p_solution["node_count"],
+                             "Gap (%)": None if p_solution["gap"] is None else 100*p_solution["gap"]})
+    st.dataframe(profile_rows, hide_index=True)
@@ -0,0 +1,117 @@
+#Evaluation of a fixed network design under many sampled demand vectors, without solving again
+
+import numpy as np
+import scipy.sparse as sp
+
+from instance import customer_array, depot_array
+from p_algorithm import cost_matrix
+
+def sample_demand(inst, n_scenarios, distribution="poisson", cv=0.3, seed=None):
+    '''
+    n_scenarios x customers array of demand samples around the demand of the instance.
+    distribution is "poisson" (integer demand, variance equal to the mean), "lognormal" or "normal" (clipped at 0),
+    the last two with a coefficient of variation cv.
+    '''
+
+    mean = np.asarray(customer_array(inst)["demand"], dtype=float)
+    rng = np.random.default_rng(seed)
+    shape = (int(n_scenarios), len(mean))
+
+    if distribution == "poisson":
+        return rng.poisson(mean, shape).astype(float)
+    if distribution == "lognormal":
+        sigma = np.sqrt(np.log1p(cv**2))
+        return mean*rng.lognormal(-sigma**2/2, sigma, shape)
+    if distribution == "normal":
+        return np.maximum(rng.normal(mean, cv*mean, shape), 0)
+    raise ValueError(f"Unknown distribution {distribution!r}")
+
+class DesignEvaluator:
+    '''
+    A solution of lp_optimal or p_algorithm (open depots and assignment) prepared for evaluate(demand), which prices it
+    under any number of demand scenarios at once. Transportation costs are charged per unit of demand shipped, so with the
+    unit demand of CreateInstance the nominal scenario gives back the costs of the solution.
+    With divisible demand the split of every customer comes from "assigned_fractions" (solutions of divisible.py); solutions
+    without it do not record the split, so the demand of a customer is split evenly between its depots.
+    '''
+
+    def __init__(self, inst, solution, costs=None):
+
+        if not solution["assigned_customers"]:
+            raise ValueError("The solution has no assignment to evaluate")
+
+        customers = customer_array(inst)
+        depots = depot_array(inst)
+        if costs is None:
+            costs = cost_matrix(inst)
+        cost = costs["cost"]
+
+        self.depots = depots["id"]
+        self.central = np.asarray(depots["central"], dtype=bool)
+        self.capacity = np.where(self.central, inst["WarehouseLimit"], 10000).astype(float)
+
+        customer_position = {i: a for a, i in enumerate(customers["id"].tolist())}
+        depot_position = {j: b for b, j in enumerate(self.depots.tolist())}
+
+        # One (customer, depot, share of the customer's demand) triple per assignment
+        fractions = solution.get("assigned_fractions")
+        pair_customer, pair_depot, pair_share = [], [], []
+        for i, assigned in solution["assigned_customers"].items():
+            assigned = assigned if isinstance(assigned, list) else [assigned]
+            shares = fractions[i] if fractions is not None else [1/len(assigned)]*len(assigned)
+            for j, share in zip(assigned, shares):
+                pair_customer.append(customer_position[i])
+                pair_depot.append(depot_position[j])
+                pair_share.append(share)
+        pair_customer = np.array(pair_customer, dtype=int)
+        pair_depot = np.array(pair_depot, dtype=int)
+        pair_share = np.array(pair_share)
+
+        n_customers, n_depots = len(customers), len(self.depots)
+
+        # Customers x depots shares, so that the depot loads of all scenarios are one sparse product
+        self.shares = sp.csr_matrix((pair_share, (pair_customer, pair_depot)), shape=(n_customers, n_depots))
+
+        # Inbound and outbound cost of one unit of demand of every customer
+        pair_cost = pair_share*cost[pair_customer, pair_depot]
+        pair_central = self.central[pair_depot]
+        self.inbound_unit_cost = np.bincount(pair_customer, weights=np.where(pair_central, 0, pair_cost), minlength=n_customers)
+        self.outbound_unit_cost = np.bincount(pair_customer, weights=np.where(pair_central, pair_cost, 0), minlength=n_customers)
+
+        # used_warehouses lists the depots opened plus the central depot 1001
+        self.warehouse_cost = float(inst["CostWarehouse"]*max(len(solution["used_warehouses"]) - 1, 0))
+
+    def evaluate(self, demand, overflow_cost=0.0):
+        '''
+        Prices the design under every row of demand (scenarios x customers). overflow_cost is charged per unit of demand
+        above the capacity of a depot. Returns a dictionary of arrays with one entry per scenario: "load" and "violation"
+        (scenarios x depots, in the order of "depots"), "inbound_cost", "outbound_cost", "warehouse_cost", "overflow",
+        "overflow_cost" and "total_cost".
+        '''
+
+        demand = np.atleast_2d(np.asarray(demand, dtype=float))
+
+        load = np.asarray((self.shares.T @ demand.T).T)
+        violation = np.maximum(load - self.capacity, 0)
+        overflow = violation.sum(axis=1)
+
+        inbound_cost = demand @ self.inbound_unit_cost
+        outbound_cost = demand @ self.outbound_unit_cost
+        warehouse_cost = np.full(len(demand), self.warehouse_cost)
+
+        return {"depots": self.depots,
+                "load": load,
+                "violation": violation,
+                "inbound_cost": inbound_cost,
+                "outbound_cost": outbound_cost,
+                "warehouse_cost": warehouse_cost,
+                "overflow": overflow,
+                "overflow_cost": overflow_cost*overflow,
+                "total_cost": inbound_cost + outbound_cost + warehouse_cost + overflow_cost*overflow}
+
+def evaluate_design(inst, solution, demand, overflow_cost=0.0, costs=None):
+    '''
+    DesignEvaluator(inst, solution, costs).evaluate(demand, overflow_cost), for a single batch of scenarios.
+    '''
+
+    return DesignEvaluator(inst, solution, costs).evaluate(demand, overflow_cost)
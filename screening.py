@@ -0,0 +1,120 @@
+#Screening of the scenarios before any MIP is built: capacity arithmetic, then heuristic solutions with Lagrangian bounds
+
+import time
+
+import numpy as np
+
+from heuristic import heuristic_optimal, heuristic_p_algorithm
+from instance import customer_array, depot_array
+from p_algorithm import cost_matrix, lagrangian_lower_bound
+from profiling import finish_profile, new_profile, phase
+
+# Screening budget of every scenario: this share of the time limit of its solve, or SCREEN_TIME_LIMIT seconds without one
+SCREEN_SHARE = 0.1
+SCREEN_TIME_LIMIT = 1.0
+
+# Relative gap at which Gurobi reports a solve as optimal when no MIPGap is given
+DEFAULT_MIP_GAP = 1e-4
+
+def _infeasible(p_regional):
+
+    profile = new_profile("assignment" if p_regional is None else "p", p_regional)
+    solution = {"assigned_customers": {},
+                "used_warehouses": [],
+                "inbound_cost": 0,
+                "outbound_cost": 0,
+                "warehouse_cost": 0,
+                "total_cost": 0,
+                "best_bound": None,
+                "gap": None,
+                "status": "infeasible",
+                "node_count": 0}
+
+    return finish_profile(solution, profile)
+
+def capacity_feasible(total_demand, largest_demand, capacity, central, p_regional, divisible):
+    '''
+    Necessary condition for a feasible design: the depots that may open (every depot for the assignment model, the central
+    depots and the p_regional largest regional depots otherwise) can hold the total demand, and with indivisible demand
+    the largest customer fits in one of them. Runs in O(D) from the demand totals.
+    '''
+
+    regional = np.sort(capacity[~central])[::-1]
+    if p_regional is not None:
+        if p_regional > len(regional):
+            return False
+        regional = regional[:p_regional]
+
+    usable = np.concatenate([capacity[central], regional])
+    if usable.sum() < total_demand:
+        return False
+
+    return divisible or largest_demand <= usable.max(initial=0)
+
+def screen_scenarios(inst, scenarios, costs=None, mip_gap=None, time_limit=None):
+    '''
+    Solutions of the scenarios (p values, None for the assignment model) that need no MIP:
+    - a scenario that fails capacity_feasible gets an empty solution with status "infeasible" at once;
+    - the others get a heuristic solution and a Lagrangian lower bound, within SCREEN_SHARE of time_limit (the time limit of
+      the solves); when the gap between them is within mip_gap the heuristic solution is kept as "optimal", as Gurobi would
+      report it, since a MIP could not move that point of the trade-off curve by more than the gap.
+    Returns (screened solutions by scenario, scenarios that still need a MIP).
+    '''
+
+    if costs is None:
+        costs = cost_matrix(inst)
+    if mip_gap is None:
+        mip_gap = DEFAULT_MIP_GAP
+    time_limit = SCREEN_TIME_LIMIT if time_limit is None else SCREEN_SHARE*time_limit
+
+    cost = costs["cost"]
+    demand = np.asarray(customer_array(inst)["demand"], dtype=float)
+    central = np.asarray(depot_array(inst)["central"], dtype=bool)
+    capacity = np.where(central, inst["WarehouseLimit"], 10000).astype(float)
+    total_demand, largest_demand = demand.sum(), demand.max(initial=0)
+
+    screened, remaining = {}, []
+
+    for p in dict.fromkeys(scenarios):
+
+        if not capacity_feasible(total_demand, largest_demand, capacity, central, p, inst["Divisible"]):
+            screened[p] = _infeasible(p)
+            continue
+
+        stime = time.perf_counter()
+        if p is None:
+            solution = heuristic_optimal(inst, costs, time_limit/2)
+        else:
+            solution = heuristic_p_algorithm(inst, p, costs, time_limit/2)
+
+        if solution["status"] == "infeasible":
+            remaining.append(p)
+            continue
+
+        profile = solution["profile"]
+        with phase(profile, "bound"):
+            warehouse = inst["CostWarehouse"] if p is None else 0
+            bound = lagrangian_lower_bound(cost, demand, capacity, central, warehouse, p, solution["total_cost"],
+                                           stime + time_limit)
+        gap = float(solution["total_cost"] - bound)/max(abs(solution["total_cost"]), 1e-10)
+
+        if gap <= mip_gap:
+            solution["best_bound"] = min(bound, solution["total_cost"])
+            solution["gap"] = profile["gap"] = max(gap, 0.0)
+            solution["status"] = profile["status"] = "optimal"
+            screened[p] = solution
+        else:
+            remaining.append(p)
+
+    return screened, remaining
+
+def mip_time_limit(time_limit, screening_time, n_scenarios):
+    '''
+    Time limit of every MIP left by screen_scenarios after it took screening_time seconds over n_scenarios scenarios.
+    Each MIP is charged the average screening time of a scenario, so screening and the MIPs solved one after another stay
+    within n_scenarios times time_limit.
+    '''
+
+    if time_limit is None:
+        return None
+    return max(0.0, time_limit - screening_time/max(n_scenarios, 1))
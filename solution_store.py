@@ -0,0 +1,187 @@
+#Persistent solution store shared across sessions, keyed on instances with the cost parameters normalized out
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from instance import customer_array, depot_array
+from p_algorithm import pair_costs
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "2e-flap", "solutions.sqlite")
+
+def _cost_scale(inst):
+
+    # Every cost is CostKm times a distance; without CostKm the costs are kept as they are
+    return inst["CostKm"] if inst["CostKm"] > 0 else 1
+
+def canonical_key(inst, p_regional, params):
+    '''
+    Fingerprint of a solve that only keeps what its optimal assignment depends on: node coordinates, demands, capacities,
+    Divisible, the model (p_regional) and the solve parameters. The p model does not depend on CostKm (a uniform scaling of its
+    objective) nor on CostWarehouse (not part of its objective); the assignment model only depends on CostWarehouse/CostKm.
+    Costs are rounded to cents pair by pair, so instances that only differ in the cost parameters can still tie differently.
+    '''
+
+    if inst["CostKm"] > 0:
+        costs = ("p",) if p_regional is not None else ("lp", float(f"{inst['CostWarehouse']/inst['CostKm']:.12g}"))
+    else:
+        costs = ("no_km",) if p_regional is not None else ("no_km", inst["CostWarehouse"])
+
+    digest = hashlib.sha1()
+    digest.update(customer_array(inst).tobytes())
+    digest.update(depot_array(inst).tobytes())
+    digest.update(repr((bool(inst["Divisible"]), inst["WarehouseLimit"], p_regional, costs, params)).encode())
+
+    return digest.hexdigest()
+
+def normalize_solution(inst, solution):
+    '''
+    Solution with the costs in units of CostKm and the warehouse cost replaced by the number of depots opened,
+    so it can be rescaled to any cost-equivalent instance by rescale_solution.
+    '''
+
+    scale = _cost_scale(inst)
+
+    record = dict(solution)
+    record["inbound_cost"] = solution["inbound_cost"]/scale
+    record["outbound_cost"] = solution["outbound_cost"]/scale
+    record["best_bound"] = None if solution["best_bound"] is None else solution["best_bound"]/scale
+    # used_warehouses lists the depots opened plus the central depot 1001
+    record["warehouse_cost"] = max(len(solution["used_warehouses"]) - 1, 0)
+    del record["total_cost"]
+
+    return record
+
+def rescale_solution(inst, record, p_regional, distances=None):
+    '''
+    Solution of inst from a record of normalize_solution. With indivisible demand the transportation costs are recomputed
+    from the stored assignment exactly as the model prices it (with distances, a distances.DistanceBackend, when given);
+    fractional assignments are not stored, so with divisible demand they are scaled instead.
+    '''
+
+    scale = _cost_scale(inst)
+    solution = dict(record)
+
+    assigned = record["assigned_customers"]
+    if assigned and not inst["Divisible"]:
+        customers = customer_array(inst)
+        depots = depot_array(inst)
+        depot_position = {j: b for b, j in enumerate(depots["id"].tolist())}
+        customer_position = {i: a for a, i in enumerate(customers["id"].tolist())}
+
+        a = np.array([customer_position[i] for i in assigned], dtype=int)
+        b = np.array([depot_position[j] for j in assigned.values()], dtype=int)
+
+        cost = pair_costs(inst, a, b) if distances is None else distances.pair_costs(inst, a, b)
+        central = depots["central"][b]
+        solution["inbound_cost"] = float(cost[~central].sum())
+        solution["outbound_cost"] = float(cost[central].sum())
+    else:
+        solution["inbound_cost"] = record["inbound_cost"]*scale
+        solution["outbound_cost"] = record["outbound_cost"]*scale
+
+    solution["warehouse_cost"] = float(inst["CostWarehouse"]*record["warehouse_cost"])
+    solution["total_cost"] = solution["inbound_cost"] + solution["outbound_cost"]
+    if p_regional is None:
+        solution["total_cost"] += solution["warehouse_cost"]
+    # The recomputed costs can fall below the scaled bound by the rounding to cents
+    solution["best_bound"] = None if record["best_bound"] is None else min(record["best_bound"]*scale, solution["total_cost"])
+
+    return solution
+
+class SolutionStore:
+    '''
+    SQLite file of normalized solutions, shared by every session and process that opens the same path.
+    The pickled records are bounded by max_bytes in total; the least recently used ones are evicted first.
+    '''
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_bytes=256*2**20):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+
+        # Opened on first use, so importing the module never touches the disk
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS solutions "
+                                     "(key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._connection.commit()
+        return self._connection
+
+    def get(self, inst, p_regional, params, distances=None):
+        '''
+        Solution of inst from the store, rescaled to its cost parameters, or None.
+        params must tell apart the distances (distances.distances_key) that the costs are recomputed with.
+        '''
+
+        key = canonical_key(inst, p_regional, params)
+
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT data FROM solutions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self.hits += 1
+
+        return rescale_solution(inst, pickle.loads(row[0]), p_regional, distances)
+
+    def put(self, inst, p_regional, params, solution):
+
+        data = pickle.dumps(normalize_solution(inst, solution), protocol=pickle.HIGHEST_PROTOCOL)
+
+        # A record larger than the whole budget would only evict everything else
+        if len(data) > self.max_bytes:
+            return
+
+        key = canonical_key(inst, p_regional, params)
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+
+                total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM solutions").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = 0
+                    for old_key, size in connection.execute("SELECT key, size FROM solutions ORDER BY last_used").fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        connection.execute("DELETE FROM solutions WHERE key = ?", (old_key,))
+                        total -= size
+                        evicted += 1
+                    self.evictions += evicted
+
+    def clear(self):
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM solutions")
+
+    def stats(self):
+
+        with self._lock:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM solutions").fetchone()
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": entries,
+                    "bytes": size}